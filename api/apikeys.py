@@ -0,0 +1,348 @@
+"""
+Long-lived API keys for service accounts.
+
+A key looks like "tsk_<key id>_<secret>". Only an HMAC-SHA256 of the whole key,
+keyed with API_KEY_SECRET, is kept, and an in-memory dict maps digests to key
+records, so authenticating a request costs one HMAC and one dict lookup instead
+of a bcrypt verify and a token refresh cycle.
+
+Keys are kept in API_KEYS_PATH, shared by every worker. They can be provisioned
+ahead of time:
+
+    python -m api.apikeys issue --owner testuser --name billing-service
+    python -m api.apikeys revoke <key id>
+    python -m api.apikeys list
+
+Keys issued or revoked through the API are written to the same file, under an
+exclusive lock so concurrent writers don't lose each other's changes. Workers
+re-read the file when it changes: right away when a key they don't know is
+presented, and otherwise every API_KEYS_RELOAD_INTERVAL seconds, which bounds
+how long a revoked key keeps working elsewhere. Usage counters are per worker.
+Changing API_KEY_SECRET invalidates every stored key.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes from concurrent processes are not serialized
+    fcntl = None
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+PREFIX = "tsk_"
+
+
+def _timestamp(epoch: Optional[float]) -> Optional[str]:
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(int(epoch), timezone.utc).isoformat()
+
+
+def _file_stat(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class ApiKey:
+    """
+    A stored key: its public id, owner and name, the keyed hash of the secret
+    and usage counters.
+    """
+
+    __slots__ = ("key_id", "name", "owner", "digest", "created", "last_used", "uses", "revoked")
+
+    def __init__(self, key_id: str, name: str, owner: str, digest: bytes,
+                 created: float, revoked: bool = False):
+        self.key_id = key_id
+        self.name = name
+        self.owner = owner
+        self.digest = digest
+        self.created = created
+        self.last_used: Optional[float] = None
+        self.uses = 0
+        self.revoked = revoked
+
+    def to_dict(self) -> Dict:
+        return {
+            "key_id": self.key_id,
+            "name": self.name,
+            "owner": self.owner,
+            "created": _timestamp(self.created),
+            "last_used": _timestamp(self.last_used),
+            "uses": self.uses,
+            "revoked": self.revoked,
+        }
+
+
+class ApiKeyStore:
+    """
+    Key records indexed by id and by digest. Revoked keys are dropped from the
+    digest index, so they fail the same single lookup as unknown keys.
+
+    With a path, issue() and revoke() write through to the key file and
+    reload() picks up changes other processes made to it.
+    """
+
+    def __init__(self, secret: str, path: Optional[str] = None):
+        self._secret = secret.encode("utf-8")
+        self.path = path
+        self._by_id: Dict[str, ApiKey] = {}
+        self._by_digest: Dict[bytes, ApiKey] = {}
+        self._lock = threading.Lock()
+        # Key file identity (inode, mtime, size) the records were last read from
+        self._loaded_stat: Optional[Tuple[int, int, int]] = None
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def digest(self, key: str) -> bytes:
+        return hmac.new(self._secret, key.encode("utf-8"), hashlib.sha256).digest()
+
+    def add(self, record: ApiKey) -> None:
+        with self._lock:
+            self._by_id[record.key_id] = record
+            if not record.revoked:
+                self._by_digest[record.digest] = record
+
+    def issue(self, owner: str, name: str) -> Tuple[str, ApiKey]:
+        """
+        Create a key for owner. Returns (key, record); the key itself is not
+        stored and cannot be shown again.
+        """
+        def create():
+            key_id = secrets.token_hex(6)
+            while key_id in self._by_id:
+                key_id = secrets.token_hex(6)
+            key = f"{PREFIX}{key_id}_{secrets.token_urlsafe(32)}"
+            record = ApiKey(key_id, name, owner, self.digest(key), time.time())
+            self.add(record)
+            return key, record
+
+        return self._update(create)
+
+    def find(self, key: str) -> Optional[ApiKey]:
+        """
+        Return the active record for key, or None, without counting a use.
+        """
+        if not key.startswith(PREFIX):
+            return None
+        digest = self.digest(key)
+        record = self._by_digest.get(digest)
+        if record is None and self.reload():
+            # Issued by another worker since the file was last read
+            record = self._by_digest.get(digest)
+        return record
+
+    def authenticate(self, key: str) -> Optional[ApiKey]:
+        """
+        Return the active record for key and count the use, or None.
+        """
+        record = self.find(key)
+        if record is not None:
+            with self._lock:
+                record.uses += 1
+                record.last_used = time.time()
+        return record
+
+    def get(self, key_id: str) -> Optional[ApiKey]:
+        self.reload()
+        return self._by_id.get(key_id)
+
+    def revoke(self, key_id: str) -> Optional[ApiKey]:
+        """
+        Revoke an active key. Returns its record, or None if there was none.
+        """
+        def mark():
+            with self._lock:
+                record = self._by_id.get(key_id)
+                if record is None or record.revoked:
+                    return None
+                record.revoked = True
+                self._by_digest.pop(record.digest, None)
+                return record
+
+        return self._update(mark)
+
+    def list(self, owner: Optional[str] = None) -> List[ApiKey]:
+        self.reload()
+        return [record for record in self if owner is None or record.owner == owner]
+
+    def _update(self, change: Callable):
+        """
+        Apply change() and write the records back to the key file, holding an
+        exclusive lock on it so changes made by other processes in between are
+        neither lost nor overwritten. change() returns None when nothing changed.
+        """
+        if self.path is None:
+            return change()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                # Released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.reload()
+            result = change()
+            if result is not None:
+                self.save(self.path)
+                self._loaded_stat = _file_stat(self.path)
+        return result
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Re-read the key file if it changed since it was last read, keeping the
+        usage counters of known keys. Returns whether the records were replaced.
+        """
+        if self.path is None:
+            return False
+        stat = _file_stat(self.path)
+        if stat is None or (stat == self._loaded_stat and not force):
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            records = [ApiKey(item["key_id"], item["name"], item["owner"], bytes.fromhex(item["digest"]),
+                              item["created"], item.get("revoked", False))
+                       for item in data.get("keys", [])]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable API key file {self.path}: {str(e)}")
+            return False
+        by_id: Dict[str, ApiKey] = {}
+        by_digest: Dict[bytes, ApiKey] = {}
+        with self._lock:
+            for record in records:
+                known = self._by_id.get(record.key_id)
+                if known is not None:
+                    record.uses, record.last_used = known.uses, known.last_used
+                by_id[record.key_id] = record
+                if not record.revoked:
+                    by_digest[record.digest] = record
+            # Two reference swaps; a lookup in between sees the old or the new keys
+            self._by_id, self._by_digest = by_id, by_digest
+            self._loaded_stat = stat
+        return True
+
+    def save(self, path: str) -> None:
+        data = {"keys": [
+            {"key_id": r.key_id, "name": r.name, "owner": r.owner, "digest": r.digest.hex(),
+             "created": r.created, "revoked": r.revoked}
+            for r in self
+        ]}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+_store: Optional[ApiKeyStore] = None
+_store_lock = threading.Lock()
+_watcher: Optional[threading.Thread] = None
+_watcher_pid: Optional[int] = None
+
+
+def _open_store(path: str) -> ApiKeyStore:
+    store = ApiKeyStore(Config.API_KEY_SECRET, path)
+    if store.reload():
+        logger.info(f"Loaded {len(store)} API keys from {path}")
+    return store
+
+
+def get_api_key_store() -> ApiKeyStore:
+    """
+    Return the process-wide key store, loading the key file on first use. A
+    background thread re-reads the file when it changes.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _open_store(Config.API_KEYS_PATH)
+    if _watcher_pid != os.getpid() and Config.API_KEYS_RELOAD_INTERVAL > 0:
+        _start_watcher()
+    return _store
+
+
+def _watch_loop() -> None:
+    while True:
+        time.sleep(Config.API_KEYS_RELOAD_INTERVAL)
+        try:
+            _store.reload()
+        except Exception as e:
+            logger.error(f"API key file reload failed: {str(e)}")
+
+
+def _start_watcher() -> None:
+    global _watcher, _watcher_pid
+    with _store_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+        _watcher = threading.Thread(target=_watch_loop, name="api-key-reload", daemon=True)
+    _watcher.start()
+
+
+def _reinit_after_fork() -> None:
+    global _store_lock, _watcher, _watcher_pid
+    # The watcher thread does not survive fork; a lock held by it would never be released
+    _store_lock = threading.Lock()
+    _watcher = None
+    _watcher_pid = None
+    if _store is not None:
+        _store._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage provisioned API keys.")
+    parser.add_argument("command", choices=("issue", "revoke", "list"))
+    parser.add_argument("key_id", nargs="?", help="key to revoke")
+    parser.add_argument("--owner", help="user the key acts as")
+    parser.add_argument("--name", help="label for the key, e.g. the calling service")
+    parser.add_argument("--path", default=Config.API_KEYS_PATH)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    store = _open_store(args.path)
+    if args.command == "issue":
+        if not args.owner or not args.name:
+            parser.error("issue needs --owner and --name")
+        key, record = store.issue(args.owner, args.name)
+        print(f"{record.key_id} {key}")
+    elif args.command == "revoke":
+        if not args.key_id:
+            parser.error("revoke needs a key id")
+        if store.revoke(args.key_id) is None:
+            print(f"No active key {args.key_id}")
+            return 1
+    else:
+        for record in store:
+            state = "revoked" if record.revoked else "active"
+            print(f"{record.key_id} {record.owner} {record.name} {state} {_timestamp(record.created)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Fingerprinted static assets and pre-rendered pages.
+
+Every file under static/ is also served under a name carrying a hash of its
+content (css/custom.css -> css/custom.3f9a1c2b7d4e.css). Templates link assets
+through the `asset_url` global, so a changed file gets a new URL and the
+fingerprinted ones can be cached by browsers and CDNs forever:
+
+    <link rel="stylesheet" href="{{ asset_url('css/custom.css') }}">
+
+The HTML pages depend on nothing but their path, so each is rendered once per
+process and then served from memory with an ETag (conditional requests get a
+304 without a body).
+"""
+import os
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from .config import Config
+
+# Long enough to never expire in practice; the URL changes with the content
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Unfingerprinted assets and pages can change with a deploy, so keep them short
+REVALIDATE = "public, max-age=300"
+
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def fingerprinted_name(path: str, digest: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+class AssetManifest:
+    """
+    Logical static paths mapped to fingerprinted names, and back.
+    """
+
+    __slots__ = ("static_dir", "urls", "files")
+
+    def __init__(self, static_dir: str):
+        self.static_dir = static_dir
+        self.urls: Dict[str, str] = {}  # "css/custom.css" -> "css/custom.<hash>.css"
+        self.files: Dict[str, str] = {}  # "css/custom.<hash>.css" -> "css/custom.css"
+        for root, _, names in os.walk(static_dir):
+            for name in names:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, static_dir).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    hashed = fingerprinted_name(path, fingerprint(f.read()))
+                self.urls[path] = hashed
+                self.files[hashed] = path
+
+    def url(self, path: str) -> str:
+        """
+        URL of a static file, fingerprinted when the file exists.
+        """
+        path = path.lstrip("/")
+        return f"/static/{self.urls.get(path, path)}"
+
+    def resolve(self, path: str) -> Tuple[str, bool]:
+        """
+        (file path under static/, whether the request used a fingerprinted name).
+        """
+        original = self.files.get(path)
+        if original is not None:
+            return original, True
+        return path, False
+
+
+_manifest: Optional[AssetManifest] = None
+_manifest_lock = threading.Lock()
+
+
+def get_asset_manifest() -> AssetManifest:
+    """
+    Return the process-wide manifest, hashing the static files on first use.
+    """
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = AssetManifest(Config.STATIC_DIR)
+    return _manifest
+
+
+def asset_url(path: str) -> str:
+    return get_asset_manifest().url(path)
+
+
+class PageCache:
+    """
+    Rendered HTML pages with their ETags, keyed by template and request path.
+    """
+
+    def __init__(self):
+        self._pages: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+
+    def get(self, template: str, path: str, render) -> Tuple[bytes, str]:
+        key = (template, path)
+        page = self._pages.get(key)
+        if page is None:
+            body = render().encode("utf-8")
+            page = self._pages[key] = (body, fingerprint(body))
+        return page
+
+    def clear(self) -> None:
+        self._pages.clear()
+
+
+pages = PageCache()
+
+
+def init_app(app) -> None:
+    """
+    Add asset_url to the templates and serve /static with cache headers:
+    fingerprinted names as immutable, plain names with a short max-age.
+    """
+    from flask import send_from_directory
+
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    def serve_static(path):
+        if app.debug:
+            # Files change under the dev server; hash them on every request there
+            manifest = AssetManifest(Config.STATIC_DIR)
+        else:
+            manifest = get_asset_manifest()
+        filename, hashed = manifest.resolve(path)
+        response = send_from_directory(Config.STATIC_DIR, filename)
+        response.headers["Cache-Control"] = IMMUTABLE if hashed else REVALIDATE
+        return response
+
+    app.add_url_rule("/static/<path:path>", "serve_static", serve_static)
+
+
+def render_page(template: str):
+    """
+    Flask response for a page template, rendered once per process (every time
+    in debug mode) and answered with 304 when the client's copy is current.
+    """
+    from flask import current_app, render_template, request
+
+    def render():
+        return render_template(template, request=request)
+
+    if current_app.debug:
+        body, etag = render().encode("utf-8"), None
+    else:
+        body, etag = pages.get(template, request.path, render)
+    response = current_app.response_class(body, mimetype="text/html")
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = REVALIDATE
+        response = response.make_conditional(request)
+    return response
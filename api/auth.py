@@ -1,16 +1,21 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import jwt
 import os
 from passlib.context import CryptContext
 import logging
-from flask import request, jsonify, g
+from . import metrics, userdata
+from .apikeys import get_api_key_store
+from .config import Config
+from .routing import TimedRoute
+from .timing import stage
+from .zoneindex import get_zone_index
 
-# Initialize router
-router = APIRouter()
+# Initialize router; TimedRoute adds Server-Timing headers and sampled profiling
+router = APIRouter(route_class=TimedRoute)
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -18,8 +23,9 @@ logger = logging.getLogger(__name__)
 # Initialize password context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# OAuth2 scheme for token authentication
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
+# OAuth2 scheme for token authentication; service accounts send an API key instead
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
+api_key_scheme = APIKeyHeader(name=Config.API_KEY_HEADER, auto_error=False)
 
 # JWT Secret and configuration
 SECRET_KEY = os.environ.get("JWT_SECRET", "insecure_default_secret_key_for_development")
@@ -33,7 +39,8 @@ fake_users_db = {
         "username": "testuser",
         "full_name": "Test User",
         "email": "user@example.com",
-        "hashed_password": pwd_context.hash("password123"),
+        # Precomputed bcrypt hash of "password123" (hashing at import costs ~0.4s)
+        "hashed_password": "$2b$12$/w21da3UfiDtdkq34lV/3OBDcZaJ4KCC.jJla4Th/6s4LXkE57QlK",
         "disabled": False,
     }
 }
@@ -61,6 +68,27 @@ class UserCreate(BaseModel):
     password: str
     full_name: Optional[str] = None
 
+class FavoriteCreate(BaseModel):
+    timezone: str
+
+class FavoriteList(BaseModel):
+    favorite_timezones: List[str]
+
+class ApiKeyCreate(BaseModel):
+    name: str
+
+class ApiKeyInfo(BaseModel):
+    key_id: str
+    name: str
+    owner: str
+    created: str
+    last_used: Optional[str] = None
+    uses: int
+    revoked: bool
+
+class IssuedApiKey(ApiKeyInfo):
+    api_key: str
+
 # Helper functions
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -109,14 +137,29 @@ def verify_token(token: str) -> Dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: Optional[str] = Depends(oauth2_scheme),
+                           api_key: Optional[str] = Depends(api_key_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if api_key:
+        # One HMAC and one dict lookup; no token to verify
+        with stage("verify_api_key"):
+            record = get_api_key_store().authenticate(api_key)
+        metrics.API_KEY_VERIFY_COUNT.inc("valid" if record else "invalid")
+        if record is None:
+            raise credentials_exception
+        user = get_user(fake_users_db, username=record.owner)
+        if user is None:
+            raise credentials_exception
+        return user
+    if not token:
+        raise credentials_exception
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with stage("verify_token"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -133,20 +176,30 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_password_user(current_user: User = Depends(get_current_active_user),
+                            api_key: Optional[str] = Depends(api_key_scheme)):
+    # A leaked key must not be able to mint its own replacement or keep itself alive
+    if api_key:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="API keys are managed with a bearer token from /token, not an API key")
+    return current_user
+
 # Routes
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    with stage("verify_password"):
+        user = authenticate_user(fake_users_db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    with stage("sign_token"):
+        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        access_token = create_access_token(
+            data={"sub": user.username}, expires_delta=access_token_expires
+        )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/register", response_model=User)
@@ -180,11 +233,56 @@ async def register_user(user: UserCreate):
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
+@router.get("/users/me/dashboard", response_model=Dict)
+async def read_users_me_dashboard(current_user: User = Depends(get_current_active_user)):
+    """
+    Current details of the user's favorite zones and their recent conversions in one response.
+    """
+    return await userdata.adashboard(current_user.username)
+
+@router.post("/users/me/favorites", response_model=FavoriteList)
+async def add_favorite(request: FavoriteCreate, current_user: User = Depends(get_current_active_user)):
+    if request.timezone not in get_zone_index():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid timezone: {request.timezone}")
+    favorites = userdata.add_favorite(current_user.username, request.timezone)
+    if favorites is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {Config.USER_MAX_FAVORITES} favorite timezones")
+    return {"favorite_timezones": favorites}
+
+@router.delete("/users/me/favorites/{zone:path}", response_model=FavoriteList)
+async def remove_favorite(zone: str, current_user: User = Depends(get_current_active_user)):
+    return {"favorite_timezones": userdata.remove_favorite(current_user.username, zone)}
+
+@router.post("/api-keys", response_model=IssuedApiKey, status_code=status.HTTP_201_CREATED)
+async def issue_api_key(request: ApiKeyCreate, current_user: User = Depends(get_password_user)):
+    key, record = get_api_key_store().issue(current_user.username, request.name)
+    logger.info(f"Issued API key {record.key_id} for {current_user.username}")
+    # The key is only ever shown in this response
+    return dict(record.to_dict(), api_key=key)
+
+@router.get("/api-keys", response_model=List[ApiKeyInfo])
+async def list_api_keys(current_user: User = Depends(get_current_active_user)):
+    return [record.to_dict() for record in get_api_key_store().list(current_user.username)]
+
+@router.delete("/api-keys/{key_id}", response_model=ApiKeyInfo)
+async def revoke_api_key(key_id: str, current_user: User = Depends(get_password_user)):
+    store = get_api_key_store()
+    record = store.get(key_id)
+    if record is None or record.owner != current_user.username:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="API key not found")
+    # Written to API_KEYS_PATH, so every worker stops accepting the key
+    record = store.revoke(key_id) or store.get(key_id)
+    logger.info(f"Revoked API key {key_id} for {current_user.username}")
+    return record.to_dict()
+
 # Flask-compatible functions
 def login_for_access_token_flask():
     """
     Flask-compatible function for user login.
     """
+    from flask import request, jsonify
+
     try:
         data = request.get_json()
         if not data:
@@ -214,6 +312,8 @@ def register_user_flask():
     """
     Flask-compatible function for user registration.
     """
+    from flask import request, jsonify
+
     try:
         data = request.get_json()
         if not data:
@@ -256,6 +356,8 @@ def get_current_user_flask():
     """
     Flask-compatible function to get current user details.
     """
+    from flask import request, jsonify
+
     try:
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -0,0 +1,132 @@
+"""
+Binary batch conversion protocol.
+
+For clients converting many instants at once, JSON and ISO 8601 strings cost
+more to encode, send and parse than the conversions themselves. An
+`application/octet-stream` batch is two packed little-endian columns:
+
+    request:  n x int64 epoch seconds, then n x uint16 zone ids
+    response: n x int32 UTC offsets in seconds, then n x uint8 flags
+
+Zone ids come from the zone registry (GET /api/timesync/zones/registry). Flag
+bit 0 is set when DST is in effect (as is_dst in the JSON API) and bit 1 when
+the zone id is unknown, in which case the offset is 0. The columns are read in
+place through memoryview casts (NumPy frombuffer views when NumPy is
+installed), so nothing is decoded item by item.
+"""
+from array import array
+from bisect import bisect_right
+
+from .config import Config
+from .tzsnapshot import get_tz_tables
+from .zoneregistry import get_zone_registry
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional speedup
+    numpy = None
+
+MIMETYPE = "application/octet-stream"
+
+FLAG_DST = 1
+FLAG_UNKNOWN_ZONE = 2
+
+# Request bytes per item: int64 epoch + uint16 zone id
+ITEM_SIZE = 10
+
+# Average items per zone below which the NumPy path is slower than the loop
+_MIN_GROUP_SIZE = 64
+
+
+class BatchFormatError(ValueError):
+    """A binary batch body that is not whole items or holds too many of them."""
+
+
+def item_count(size: int) -> int:
+    """
+    Number of items in a request body of `size` bytes.
+    """
+    count, remainder = divmod(size, ITEM_SIZE)
+    if remainder:
+        raise BatchFormatError(f"Body must be n int64 epochs followed by n uint16 zone ids "
+                               f"({ITEM_SIZE} bytes per item), got {size} bytes")
+    if count > Config.MAX_BINARY_BATCH_SIZE:
+        raise BatchFormatError(f"Batch too large: at most {Config.MAX_BINARY_BATCH_SIZE} items per request")
+    return count
+
+
+def convert_packed(body) -> bytes:
+    """
+    Convert a packed request body (bytes or any buffer) and return the packed response.
+    """
+    count = item_count(len(body))
+    if numpy is not None:
+        return _convert_numpy(body, count)
+    return _convert_python(body, count)
+
+
+def _convert_python(body, count: int) -> bytes:
+    view = memoryview(body).cast("B")
+    epochs = view[:8 * count].cast("q")
+    ids = view[8 * count:].cast("H")
+
+    tables = get_tz_tables()
+    slices = get_zone_registry().slices(tables)
+    known = len(slices)
+    transitions, offsets, dst = tables.transitions, tables.offsets, tables.dst
+
+    out = array("i", bytes(4 * count))
+    flags = bytearray(count)
+    for i in range(count):
+        zone_id = ids[i]
+        span = slices[zone_id] if zone_id < known else None
+        if span is None:
+            flags[i] = FLAG_UNKNOWN_ZONE
+            continue
+        start, end = span
+        idx = bisect_right(transitions, epochs[i], start, end) - 1
+        if idx < start:
+            idx = start
+        out[i] = offsets[idx]
+        if dst[idx] > 0:
+            flags[i] = FLAG_DST
+    return out.tobytes() + flags
+
+
+def _convert_numpy(body, count: int) -> bytes:
+    np = numpy
+    epochs = np.frombuffer(body, dtype="<i8", count=count)
+    ids = np.frombuffer(body, dtype="<u2", count=count, offset=8 * count)
+
+    # Group the items by zone and search each zone's transitions once, vectorized
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    bounds = np.flatnonzero(np.diff(sorted_ids)) + 1
+    if len(bounds) * _MIN_GROUP_SIZE > count:
+        # Small groups cost more in per-group NumPy overhead than the plain loop
+        return _convert_python(body, count)
+
+    tables = get_tz_tables()
+    slices = get_zone_registry().slices(tables)
+    transitions = np.frombuffer(tables.transitions, dtype=np.int64)
+    offsets = np.frombuffer(tables.offsets, dtype=np.int32)
+    dst = np.frombuffer(tables.dst, dtype=np.int32)
+
+    out = np.zeros(count, dtype="<i4")
+    flags = np.zeros(count, dtype=np.uint8)
+    for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [count]))):
+        if lo == hi:
+            continue
+        zone_id = int(sorted_ids[lo])
+        positions = order[lo:hi]
+        span = slices[zone_id] if zone_id < len(slices) else None
+        if span is None:
+            flags[positions] = FLAG_UNKNOWN_ZONE
+            continue
+        start, end = span
+        idx = np.searchsorted(transitions[start:end], epochs[positions], side="right") - 1
+        np.maximum(idx, 0, out=idx)
+        idx += start
+        out[positions] = offsets[idx]
+        flags[positions] = np.where(dst[idx] > 0, FLAG_DST, 0)
+    return out.tobytes() + flags.tobytes()
@@ -1,77 +1,461 @@
+import os
+import math
 import time
-from typing import Dict, Any, Optional
+import heapq
+import random
+import asyncio
+import inspect
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Keys the janitor deletes per lock acquisition, so a large expiry burst never
+# blocks request threads for long
+JANITOR_CHUNK = 1000
+
+# Live caches, so their locks and threads can be reset in forked children
+_instances: "weakref.WeakSet[TimeCache]" = weakref.WeakSet()
+
+
+class _Flight:
+    """
+    A computation in progress for one cache key, shared by every caller that
+    misses the key while it runs.
+    """
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Entry:
+    """
+    A cached value with its soft expiry time and compute duration; the hard
+    expiry is the soft expiry plus the cache's stale_ttl.
+    """
+
+    __slots__ = ("value", "expires", "delta")
+
+    def __init__(self, value: Any, expires: float, delta: float):
+        self.value = value
+        self.expires = expires
+        self.delta = delta
+
+
 class TimeCache:
     """
     A simple in-memory cache implementation for time conversion results.
+
+    Entries have a soft expiry (`ttl`) and a hard expiry (`ttl + stale_ttl`).
+    get() treats an entry as expired after its soft expiry. get_or_compute()
+    keeps serving it until the hard expiry while a background refresh
+    recomputes it, and may refresh a fresh entry early (probabilistic early
+    expiration, weighted by `early_refresh_beta` and how long the value took
+    to compute) so hot keys do not all expire on the same cliff.
+
+    Hard expiry is handled by a timing wheel: every entry is filed in the
+    bucket for its expiry tick (`janitor_interval` seconds wide), and a
+    background janitor thread deletes whole buckets as their tick passes, in
+    small chunks. Expiry costs O(1) per entry and never scans the whole dict.
+    
+    Lookups and writes hold the cache lock, so the cache is safe to share
+    between threads; ShardedTimeCache spreads that lock over several caches.
     """
     
-    def __init__(self):
-        self.cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, stale_ttl: int = 0, early_refresh_beta: float = 0.0, refresh_workers: int = 2,
+                 janitor_interval: float = 1.0):
+        self.cache: Dict[str, _Entry] = {}
+        self.stale_ttl = stale_ttl
+        self.early_refresh_beta = early_refresh_beta
+        self.refresh_workers = refresh_workers
+        self.janitor_interval = janitor_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        # Lock acquisitions on the read/write paths, and how many had to wait
+        self.acquisitions = 0
+        self.contended = 0
+        # Set when this cache is a shard of a ShardedTimeCache, which owns the
+        # janitor and the refresh pool
+        self._owner: Optional["ShardedTimeCache"] = None
+        # Keys being computed by get_or_compute / aget_or_compute
+        self._inflight: Dict[str, _Flight] = {}
+        self._async_inflight: Dict[str, "asyncio.Future"] = {}
+        self._inflight_lock = threading.Lock()
+        # Background refresh pool, created lazily in each worker process
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        # Timing wheel: expiry tick -> keys, plus a heap of the ticks in use
+        self._wheel: Dict[int, Set[str]] = {}
+        self._ticks: List[int] = []
+        self._lock = threading.Lock()
+        self._janitor: Optional[threading.Thread] = None
+        _instances.add(self)
         logger.debug("Initialized TimeCache")
     
+    def _tick(self, entry: _Entry) -> int:
+        return int((entry.expires + self.stale_ttl) // self.janitor_interval) if self.janitor_interval > 0 else 0
+    
+    def _unlink(self, key: str, entry: _Entry) -> None:
+        # Drop key from its wheel bucket; caller holds self._lock
+        bucket = self._wheel.get(self._tick(entry))
+        if bucket is not None:
+            bucket.discard(key)
+    
+    def _acquire(self) -> threading.Lock:
+        """
+        Take the cache lock, counting acquisitions that had to wait for another thread.
+        """
+        lock = self._lock
+        if not lock.acquire(blocking=False):
+            lock.acquire()
+            self.contended += 1
+        self.acquisitions += 1
+        return lock
+    
+    def _evict(self, key: str, entry: _Entry) -> None:
+        """
+        Delete an entry found past its hard expiry on the read path; caller holds self._lock.
+        """
+        if self.cache.get(key) is entry:
+            del self.cache[key]
+            self._unlink(key, entry)
+            self.evictions += 1
+        logger.debug("Cache entry expired for key: %s", key)
+    
     def get(self, key: str) -> Optional[Any]:
         """
         Get a value from the cache.
         Returns None if the key doesn't exist or if the entry has expired.
         """
-        if key not in self.cache:
+        lock = self._acquire()
+        try:
+            # One lookup: the janitor may delete the key between a membership test and a read
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            now = time.time()
+            if entry.expires < now:
+                # Keep stale entries around for get_or_compute until the hard expiry
+                if entry.expires + self.stale_ttl < now:
+                    self._evict(key, entry)
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+        finally:
+            lock.release()
+        logger.debug("Cache hit for key: %s", key)
+        return entry.value
+    
+    def set(self, key: str, value: Any, ttl: int = 3600, delta: float = 0.0) -> None:
+        """
+        Set a value in the cache with a specified TTL (time to live) in seconds.
+        Default TTL is 1 hour. `delta` is how long the value took to compute,
+        used for early refresh.
+        """
+        expires = time.time() + ttl
+        # The compute duration only matters for early refresh
+        entry = _Entry(value, expires, delta if self.early_refresh_beta > 0 else 0.0)
+        tick = self._tick(entry)
+        lock = self._acquire()
+        try:
+            old = self.cache.get(key)
+            if old is not None:
+                self._unlink(key, old)
+            self.cache[key] = entry
+            bucket = self._wheel.get(tick)
+            if bucket is None:
+                bucket = self._wheel[tick] = set()
+                heapq.heappush(self._ticks, tick)
+            bucket.add(key)
+        finally:
+            lock.release()
+        if self._janitor is None and self.janitor_interval > 0:
+            (self._owner or self)._start_janitor()
+        logger.debug("Cached value for key: %s, TTL: %ss", key, ttl)
+    
+    def _peek(self, key: str) -> Optional[Any]:
+        # Unexpired value for key without touching the hit/miss counters
+        entry = self.cache.get(key)
+        if entry is None or entry.expires < time.time():
             return None
+        return entry.value
+    
+    def _lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        Cache lookup for get_or_compute. Returns (value, refresh): value is None
+        on a miss, and refresh is set when the entry is stale or due for early
+        refresh, in which case the caller starts the refresh.
+        """
+        lock = self._acquire()
+        try:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            
+            now = time.time()
+            if now < entry.expires:
+                self.hits += 1
+                # XFetch: refresh early with a probability that grows towards expiry
+                beta = self.early_refresh_beta
+                if beta > 0 and entry.delta > 0:
+                    if now - entry.delta * beta * math.log(1.0 - random.random()) >= entry.expires:
+                        return entry.value, True
+                return entry.value, False
+            
+            if now < entry.expires + self.stale_ttl:
+                self.hits += 1
+                self.stale_hits += 1
+                return entry.value, True
+            
+            self._evict(key, entry)
+            self.misses += 1
+            return None, False
+        finally:
+            lock.release()
+    
+    def _compute_and_store(self, key: str, compute: Callable[[], Any], ttl: int) -> Any:
+        start = time.perf_counter()
+        value = compute()
+        if value is not None:
+            self.set(key, value, ttl, delta=time.perf_counter() - start)
+        return value
+    
+    def _refresh_executor(self) -> ThreadPoolExecutor:
+        if self._owner is not None:
+            return self._owner._refresh_executor()
+        # Threads do not survive fork, so each worker process gets its own pool
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._inflight_lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.refresh_workers, thread_name_prefix="cache-refresh")
+                    self._executor_pid = pid
+        return self._executor
+    
+    def _start_refresh(self, key: str, compute: Callable[[], Any], ttl: int) -> None:
+        """
+        Recompute a stale or soon-to-expire key in the background, unless it is
+        already being computed.
+        """
+        with self._inflight_lock:
+            if key in self._inflight:
+                return
+            flight = self._inflight[key] = _Flight()
+            self.refreshes += 1
         
-        entry = self.cache[key]
-        if entry["expires"] < time.time():
-            # Remove expired entry
-            del self.cache[key]
-            logger.debug(f"Cache entry expired for key: {key}")
-            return None
+        def run():
+            try:
+                flight.value = self._compute_and_store(key, compute, ttl)
+            except BaseException as e:
+                flight.error = e
+                logger.error(f"Background refresh failed for key {key}: {str(e)}")
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[key]
+                flight.done.set()
         
-        logger.debug(f"Cache hit for key: {key}")
-        return entry["value"]
+        try:
+            self._refresh_executor().submit(run)
+        except RuntimeError:
+            # Interpreter shutting down; leave the stale value in place
+            with self._inflight_lock:
+                del self._inflight[key]
+            flight.done.set()
     
-    def set(self, key: str, value: Any, ttl: int = 3600) -> None:
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 3600) -> Any:
         """
-        Set a value in the cache with a specified TTL (time to live) in seconds.
-        Default TTL is 1 hour.
+        Get a value from the cache, computing and storing it on a miss.
+        Concurrent misses for the same key are coalesced: one thread runs
+        `compute` and the others wait for its result (or its exception).
+        Stale values are served while a background refresh recomputes them.
         """
-        self.cache[key] = {
-            "value": value,
-            "expires": time.time() + ttl
-        }
-        logger.debug(f"Cached value for key: {key}, TTL: {ttl}s")
+        value, refresh = self._lookup(key)
+        if value is not None:
+            if refresh:
+                self._start_refresh(key, compute, ttl)
+            return value
+        
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                # Another leader may have stored the value since our miss
+                value = self._peek(key)
+                if value is not None:
+                    return value
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        
+        try:
+            flight.value = self._compute_and_store(key, compute, ttl)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            flight.done.set()
+    
+    async def _acompute_and_store(self, key: str, compute: Callable[[], Any], ttl: int) -> Any:
+        start = time.perf_counter()
+        value = compute()
+        if inspect.isawaitable(value):
+            value = await value
+        if value is not None:
+            self.set(key, value, ttl, delta=time.perf_counter() - start)
+        return value
+    
+    async def _arefresh(self, key: str, compute: Callable[[], Any], ttl: int) -> None:
+        future = self._async_inflight[key]
+        try:
+            future.set_result(await self._acompute_and_store(key, compute, ttl))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            logger.error(f"Background refresh failed for key {key}: {str(e)}")
+        finally:
+            del self._async_inflight[key]
+    
+    async def aget_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 3600) -> Any:
+        """
+        Asyncio variant of get_or_compute for the FastAPI routes.
+        `compute` may be a plain function or return an awaitable; tasks that
+        miss the key while it is being computed await the same future, and
+        stale values are refreshed in a background task.
+        """
+        value, refresh = self._lookup(key)
+        if value is not None:
+            if refresh and key not in self._async_inflight:
+                loop = asyncio.get_running_loop()
+                self._async_inflight[key] = loop.create_future()
+                self.refreshes += 1
+                loop.create_task(self._arefresh(key, compute, ttl))
+            return value
+        
+        future = self._async_inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # Shield so a cancelled waiter does not cancel the shared computation
+            return await asyncio.shield(future)
+        
+        future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self._acompute_and_store(key, compute, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._async_inflight[key]
     
     def clear(self) -> None:
         """
         Clear all entries from the cache.
         """
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self._wheel.clear()
+            self._ticks.clear()
         logger.debug("Cache cleared")
     
     def remove(self, key: str) -> None:
         """
         Remove a specific key from the cache.
         """
-        if key in self.cache:
-            del self.cache[key]
-            logger.debug(f"Removed cache entry for key: {key}")
+        with self._lock:
+            entry = self.cache.pop(key, None)
+            if entry is None:
+                return
+            self._unlink(key, entry)
+        logger.debug("Removed cache entry for key: %s", key)
     
     def cleanup(self) -> int:
         """
-        Remove all expired entries from the cache.
+        Remove all entries past their hard expiry from the cache.
         Returns the number of entries removed.
         """
-        now = time.time()
-        expired_keys = [k for k, v in self.cache.items() if v["expires"] < now]
-        
-        for key in expired_keys:
-            del self.cache[key]
+        now_tick = int(time.time() // self.janitor_interval) if self.janitor_interval > 0 else 0
+        removed = 0
+        while True:
+            # Detach the oldest overdue bucket; only whole past ticks are swept,
+            # so every entry still filed under one is past its hard expiry
+            with self._lock:
+                if not self._ticks or self._ticks[0] >= now_tick:
+                    break
+                tick = heapq.heappop(self._ticks)
+                bucket = self._wheel.pop(tick, None)
+            if not bucket:
+                continue
+            
+            keys = list(bucket)
+            for i in range(0, len(keys), JANITOR_CHUNK):
+                deleted = 0
+                with self._lock:
+                    for key in keys[i:i + JANITOR_CHUNK]:
+                        entry = self.cache.get(key)
+                        # Skip keys re-set since, which moved to a later bucket
+                        if entry is not None and self._tick(entry) == tick:
+                            del self.cache[key]
+                            deleted += 1
+                    self.evictions += deleted
+                removed += deleted
         
-        if expired_keys:
-            logger.debug(f"Cleaned up {len(expired_keys)} expired cache entries")
+        if removed:
+            logger.debug("Cleaned up %d expired cache entries", removed)
         
-        return len(expired_keys)
+        return removed
+    
+    def _start_janitor(self) -> None:
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(
+                target=_janitor_loop, args=(weakref.ref(self),), name="cache-janitor", daemon=True)
+        self._janitor.start()
+    
+    def _after_fork(self) -> None:
+        # Locks may have been held by threads that do not exist in the child,
+        # and in-flight computations belong to those threads
+        self._lock = threading.Lock()
+        self._inflight_lock = threading.Lock()
+        self._inflight.clear()
+        self._async_inflight.clear()
+        self._janitor = None
+        self._executor = None
+        self._executor_pid = None
     
     def size(self) -> int:
         """
@@ -83,12 +467,159 @@ class TimeCache:
         """
         Return statistics about the cache.
         """
-        now = time.time()
-        expired_count = sum(1 for v in self.cache.values() if v["expires"] < now)
+        # Entries past their hard expiry that the janitor has not reached yet;
+        # only the few overdue wheel buckets are counted, not the whole cache
+        now_tick = int(time.time() // self.janitor_interval) if self.janitor_interval > 0 else 0
+        with self._lock:
+            expired_count = sum(len(self._wheel.get(tick, ())) for tick in self._ticks if tick < now_tick)
         active_count = len(self.cache) - expired_count
         
         return {
             "total_entries": len(self.cache),
             "active_entries": active_count,
-            "expired_entries": expired_count
+            "expired_entries": expired_count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "lock_acquisitions": self.acquisitions,
+            "lock_contended": self.contended
         }
+
+
+def _summed(name: str) -> property:
+    return property(lambda self: sum(getattr(shard, name) for shard in self.shards),
+                    doc=f"{name} summed over the shards")
+
+
+class ShardedTimeCache:
+    """
+    A TimeCache split into `shards` independently locked TimeCaches, picked by
+    key hash, for threaded workers: threads touching different keys rarely
+    wait for the same lock, and get-or-compute coalescing is per shard. Every
+    lookup happens under its shard's lock, so expiry by the janitor or by a
+    concurrent reader is safe. The shards share one janitor thread and one
+    background refresh pool.
+
+    Same interface and counters as TimeCache; `contended` counts lock
+    acquisitions that had to wait, out of `acquisitions`.
+    """
+    
+    hits = _summed("hits")
+    misses = _summed("misses")
+    evictions = _summed("evictions")
+    coalesced = _summed("coalesced")
+    stale_hits = _summed("stale_hits")
+    refreshes = _summed("refreshes")
+    acquisitions = _summed("acquisitions")
+    contended = _summed("contended")
+    
+    def __init__(self, shards: int = 16, stale_ttl: int = 0, early_refresh_beta: float = 0.0,
+                 refresh_workers: int = 2, janitor_interval: float = 1.0):
+        self.shards: List[TimeCache] = []
+        for _ in range(max(1, shards)):
+            shard = TimeCache(stale_ttl, early_refresh_beta, refresh_workers, janitor_interval)
+            shard._owner = self
+            self.shards.append(shard)
+        self.stale_ttl = stale_ttl
+        self.refresh_workers = refresh_workers
+        self.janitor_interval = janitor_interval
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._janitor: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+    
+    def shard(self, key: str) -> TimeCache:
+        return self.shards[hash(key) % len(self.shards)]
+    
+    def get(self, key: str) -> Optional[Any]:
+        return self.shard(key).get(key)
+    
+    def set(self, key: str, value: Any, ttl: int = 3600, delta: float = 0.0) -> None:
+        self.shard(key).set(key, value, ttl, delta)
+    
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 3600) -> Any:
+        return self.shard(key).get_or_compute(key, compute, ttl)
+    
+    async def aget_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 3600) -> Any:
+        return await self.shard(key).aget_or_compute(key, compute, ttl)
+    
+    def remove(self, key: str) -> None:
+        self.shard(key).remove(key)
+    
+    def clear(self) -> None:
+        for shard in self.shards:
+            shard.clear()
+    
+    def cleanup(self) -> int:
+        return sum(shard.cleanup() for shard in self.shards)
+    
+    def size(self) -> int:
+        return sum(len(shard.cache) for shard in self.shards)
+    
+    def shard_sizes(self) -> List[int]:
+        return [len(shard.cache) for shard in self.shards]
+    
+    def stats(self) -> Dict[str, Any]:
+        totals: Dict[str, Any] = {}
+        for shard in self.shards:
+            for name, value in shard.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        totals["shards"] = len(self.shards)
+        return totals
+    
+    def _refresh_executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive fork, so each worker process gets its own pool
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.refresh_workers, thread_name_prefix="cache-refresh")
+                    self._executor_pid = pid
+        return self._executor
+    
+    def _start_janitor(self) -> None:
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(
+                target=_janitor_loop, args=(weakref.ref(self),), name="cache-janitor", daemon=True)
+            # Shards only check their own field before asking for a janitor
+            for shard in self.shards:
+                shard._janitor = self._janitor
+        self._janitor.start()
+    
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._janitor = None
+        self._executor = None
+        self._executor_pid = None
+
+
+def _janitor_loop(cache_ref: "weakref.ref[TimeCache]") -> None:
+    """
+    Sweep expired wheel buckets every janitor_interval seconds until the cache is gone.
+    """
+    while True:
+        cache = cache_ref()
+        if cache is None:
+            return
+        interval = cache.janitor_interval
+        try:
+            cache.cleanup()
+        except Exception as e:
+            logger.error(f"Cache janitor failed: {str(e)}")
+        del cache
+        time.sleep(interval)
+
+
+def _reinit_after_fork() -> None:
+    for cache in list(_instances):
+        cache._after_fork()
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
@@ -1,10 +1,17 @@
 import os
 import logging
 from typing import Dict, Any
+from dotenv import load_dotenv
+
+# Load environment variables from .env file before reading settings
+load_dotenv()
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Repository root, used to locate build artifacts
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 class Config:
     """
     Configuration settings for the Global TimeSync API.
@@ -22,13 +29,68 @@ class Config:
     JWT_SECRET = os.environ.get("JWT_SECRET", "insecure_default_secret_key_for_development")
     JWT_ALGORITHM = "HS256"
     JWT_EXPIRATION_MINUTES = 30
+    API_KEY_SECRET = os.environ.get("API_KEY_SECRET", JWT_SECRET)  # HMAC key for stored API key digests
+    API_KEY_HEADER = "X-API-Key"
+    API_KEYS_PATH = os.environ.get("API_KEYS_PATH", os.path.join(BASE_DIR, "data", "api_keys.json"))
+    API_KEYS_RELOAD_INTERVAL = float(os.environ.get("API_KEYS_RELOAD_INTERVAL", 5))  # seconds; 0 disables polling
     
     # Cache settings
     DEFAULT_CACHE_TTL = 3600  # 1 hour
     TIMEZONE_INFO_CACHE_TTL = 300  # 5 minutes
+    CACHE_STALE_TTL = int(os.environ.get("CACHE_STALE_TTL", 60))  # seconds a stale entry is served while it refreshes
+    CACHE_EARLY_REFRESH_BETA = float(os.environ.get("CACHE_EARLY_REFRESH_BETA", 1.0))  # 0 disables early refresh
+    CACHE_JANITOR_INTERVAL = float(os.environ.get("CACHE_JANITOR_INTERVAL", 1.0))  # expiry sweep period in seconds, 0 disables
+    CACHE_SHARDS = int(os.environ.get("CACHE_SHARDS", 16))  # independently locked cache partitions
     
     # Performance settings
-    MAX_WORKERS = os.environ.get("MAX_WORKERS", 4)
+    MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 4))  # upper bound on gunicorn workers
+    WORKER_CLASS = os.environ.get("WORKER_CLASS", "sync")  # sync, gthread or uvicorn (ASGI mode)
+    WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 0))  # gthread threads per worker, 0 = from CPU count
+    WORKER_TIMEOUT = int(os.environ.get("WORKER_TIMEOUT", 30))
+    PRELOAD_APP = os.environ.get("PRELOAD_APP", "1") == "1"
+    WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1") == "1"
+    MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 1000))
+    MAX_PLANNER_ZONES = int(os.environ.get("MAX_PLANNER_ZONES", 50))
+    MAX_PLANNER_DAYS = int(os.environ.get("MAX_PLANNER_DAYS", 366))
+    MAX_BINARY_BATCH_SIZE = int(os.environ.get("MAX_BINARY_BATCH_SIZE", 1000000))
+    
+    # Rate limiting and admission control (per worker process)
+    RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+    RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 20))  # requests/second per credential
+    RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 40))
+    RATE_LIMIT_IP_RATE = float(os.environ.get("RATE_LIMIT_IP_RATE", 50))  # requests/second per client IP
+    RATE_LIMIT_IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", 100))
+    TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))  # proxies appending to X-Forwarded-For
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 64))  # 0 disables
+    ADMISSION_MAX_QUEUE_MS = float(os.environ.get("ADMISSION_MAX_QUEUE_MS", 2000))  # 0 disables
+    ADMISSION_LATENCY_TARGET_MS = float(os.environ.get("ADMISSION_LATENCY_TARGET_MS", 500))  # 0 disables
+    
+    # User activity settings
+    USER_HISTORY_SIZE = int(os.environ.get("USER_HISTORY_SIZE", 20))  # recent conversions kept per user
+    USER_MAX_FAVORITES = int(os.environ.get("USER_MAX_FAVORITES", 20))
+    ACTIVITY_BUFFER_SIZE = int(os.environ.get("ACTIVITY_BUFFER_SIZE", 10000))  # new conversions dropped beyond this; favorite changes never are
+    ACTIVITY_BATCH_SIZE = int(os.environ.get("ACTIVITY_BATCH_SIZE", 500))
+    ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_FLUSH_INTERVAL", 1.0))  # seconds between flushes
+    
+    # Startup settings
+    STATIC_DIR = os.environ.get("STATIC_DIR", os.path.join(BASE_DIR, "static"))
+    ZONE_INDEX_PATH = os.environ.get("ZONE_INDEX_PATH", os.path.join(BASE_DIR, "data", "zone_index.json"))
+    TZ_SNAPSHOT_PATH = os.environ.get("TZ_SNAPSHOT_PATH", os.path.join(BASE_DIR, "data", "tz_snapshot.bin"))
+    ZONE_REGISTRY_PATH = os.environ.get("ZONE_REGISTRY_PATH", os.path.join(BASE_DIR, "data", "zone_registry.txt"))
+    TZ_RELOAD_INTERVAL = float(os.environ.get("TZ_RELOAD_INTERVAL", 60))  # seconds; 0 disables hot reload
+    STARTUP_BUDGET_MS = int(os.environ.get("STARTUP_BUDGET_MS", 400))
+    
+    # Logging settings
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # "text" or "json"
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped
+    LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")  # e.g. "api.cache=100" keeps 1 in 100
+    
+    # Instrumentation settings
+    SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "0") == "1"  # exposes internal stage timings
+    PROFILE_SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))  # profile 1 in N requests, 0 disables
+    PROFILE_HEADER_ENABLED = os.environ.get("PROFILE_HEADER_ENABLED", "0") == "1"
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+    PROFILE_REPORT_EVERY = int(os.environ.get("PROFILE_REPORT_EVERY", 50))
     
     @classmethod
     def to_dict(cls) -> Dict[str, Any]:
@@ -49,5 +111,7 @@ class Config:
         # Remove sensitive information
         if 'JWT_SECRET' in config_dict:
             config_dict['JWT_SECRET'] = '***REDACTED***'
+        if 'API_KEY_SECRET' in config_dict:
+            config_dict['API_KEY_SECRET'] = '***REDACTED***'
         
         logger.info(f"Application Configuration: {config_dict}")
@@ -0,0 +1,327 @@
+"""
+Framework-free conversion engine.
+
+Everything the HTTP routes do to convert timestamps and describe zones lives
+here and imports neither Flask nor FastAPI, so co-located Python services can
+call it directly:
+
+    from api import engine
+
+    engine.convert("2024-03-10T09:00:00", "America/New_York", source_timezone="Asia/Tokyo").to_dict()
+    engine.convert_many(["2024-01-01T00:00:00Z", "2024-07-01T00:00:00Z"], "Europe/Paris")
+    engine.zone_info("Asia/Kolkata")
+    await engine.aconvert("2024-01-01T00:00:00Z", "Europe/Paris")   # from asyncio code
+    engine.transitions("Europe/London", start=datetime(2024, 1, 1), end=datetime(2025, 1, 1))
+
+Bad input raises ConversionError (a ValueError) with the message the API
+returns. The routes in main.py and api/timesync.py only parse requests and
+render what these functions return.
+"""
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from . import metrics
+from .cache import ShardedTimeCache
+from .config import Config
+from .results import ConversionResult, offset_string
+from .timing import stage
+from .tzsnapshot import (AMBIGUOUS_POLICIES, MIN_INSTANT, NONEXISTENT_POLICIES, AmbiguousTimeError,
+                         NonExistentTimeError, fixed_offset, get_tz_tables, to_epoch, zone_cache_key)
+from .zoneindex import get_zone_index
+
+Timestamp = Union[str, datetime, int, float]
+
+INVALID_TIMESTAMP = "Invalid timestamp format. Use ISO 8601 format (e.g., '2023-05-01T12:00:00Z')"
+
+
+class ConversionError(ValueError):
+    """Invalid conversion input: a bad timestamp, zone or policy, or a local time
+    rejected by the "raise" policies."""
+
+
+# Conversion and zone info results, shared by every caller (and thread) in the process
+time_cache = ShardedTimeCache(shards=Config.CACHE_SHARDS, stale_ttl=Config.CACHE_STALE_TTL,
+                              early_refresh_beta=Config.CACHE_EARLY_REFRESH_BETA,
+                              janitor_interval=Config.CACHE_JANITOR_INTERVAL)
+
+
+# Timestamp parsing: ISO 8601 fast path with dateutil as the fallback
+def parse_timestamp(value: str) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        # Deferred import: dateutil is only needed for non-ISO input
+        from dateutil import parser
+        parsed = parser.parse(value)
+        metrics.TIMESTAMP_PARSE_COUNT.inc("fallback")
+        return parsed
+    metrics.TIMESTAMP_PARSE_COUNT.inc("fast")
+    return parsed
+
+
+def to_local(utc_time: datetime, zone: str):
+    """
+    Convert an aware datetime to `zone`.
+    Returns (local_time, offset_seconds, dst_seconds).
+    """
+    offset_seconds, dst_seconds, _ = get_tz_tables().lookup(zone, to_epoch(utc_time))
+    return utc_time.astimezone(fixed_offset(offset_seconds)), offset_seconds, dst_seconds
+
+
+def local_now(zone: str):
+    return to_local(datetime.now(timezone.utc), zone)
+
+
+def _check_zone(zone: Optional[str]) -> None:
+    # Lists and dicts from JSON bodies are unhashable; the index lookup would raise TypeError
+    if not isinstance(zone, str) or zone not in get_zone_index():
+        raise ConversionError(f"Invalid timezone: {zone}")
+
+
+def _check_policies(ambiguous: str, nonexistent: str) -> None:
+    if ambiguous not in AMBIGUOUS_POLICIES:
+        raise ConversionError(f"Invalid ambiguous policy: {ambiguous} (use {', '.join(AMBIGUOUS_POLICIES)})")
+    if nonexistent not in NONEXISTENT_POLICIES:
+        raise ConversionError(f"Invalid nonexistent policy: {nonexistent} (use {', '.join(NONEXISTENT_POLICIES)})")
+
+
+def _to_datetime(timestamp: Timestamp) -> datetime:
+    if isinstance(timestamp, datetime):
+        return timestamp
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        # Epoch seconds are always an instant
+        try:
+            return datetime.fromtimestamp(timestamp, timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            # Beyond the platform's time_t or datetime's years, or NaN
+            raise ConversionError(f"Timestamp out of range: {timestamp}")
+    with stage("parse"):
+        try:
+            return parse_timestamp(timestamp)
+        except Exception:
+            raise ConversionError(INVALID_TIMESTAMP)
+
+
+def _compute(parsed: datetime, target_timezone: str, source_timezone: Optional[str],
+             ambiguous: str, nonexistent: str) -> ConversionResult:
+    with stage("convert"):
+        tables = get_tz_tables()
+        if source_timezone is None:
+            # Naive timestamps are UTC; the input's own offset is echoed in the result
+            utc_time = parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+            offset_seconds, dst_seconds, _ = tables.lookup(target_timezone, to_epoch(utc_time))
+            return ConversionResult.from_datetime(utc_time, target_timezone, offset_seconds, dst_seconds)
+        if parsed.tzinfo is None:
+            try:
+                epoch = tables.resolve_local(source_timezone, to_epoch(parsed), ambiguous, nonexistent)
+            except (AmbiguousTimeError, NonExistentTimeError) as e:
+                raise ConversionError(str(e)) from e
+        else:
+            # An explicit offset already pins the instant
+            epoch = to_epoch(parsed)
+        # Both sides are plain offset lookups, so this costs the same as a UTC conversion
+        source_offset, _, _ = tables.lookup(source_timezone, epoch)
+        offset_seconds, dst_seconds, _ = tables.lookup(target_timezone, epoch)
+        return ConversionResult(epoch, parsed.microsecond, source_offset, offset_seconds,
+                                target_timezone, dst_seconds > 0, source_timezone)
+
+
+def _prepare(timestamp: Timestamp, target_timezone: str, source_timezone: Optional[str],
+             ambiguous: str, nonexistent: str) -> Tuple[datetime, Optional[str]]:
+    """
+    Parse and validate a conversion. Returns the parsed timestamp and the cache
+    key, or None for timestamps that are not cached.
+    """
+    if timestamp is None or timestamp == "" or not target_timezone:
+        raise ConversionError("Missing required fields")
+
+    parsed = _to_datetime(timestamp)
+
+    with stage("validate"):
+        _check_zone(target_timezone)
+        if source_timezone is not None:
+            _check_zone(source_timezone)
+            _check_policies(ambiguous, nonexistent)
+
+    if not isinstance(timestamp, str):
+        return parsed, None
+
+    # Zones are keyed by their rule generation, so a tz reload retires only the
+    # entries of zones whose rules changed
+    if source_timezone is None:
+        return parsed, f"convert:{timestamp}:{zone_cache_key(target_timezone)}"
+    return parsed, (f"convert:{timestamp}:{zone_cache_key(source_timezone)}:{ambiguous}:{nonexistent}:"
+                    f"{zone_cache_key(target_timezone)}")
+
+
+def convert(timestamp: Timestamp, target_timezone: str, source_timezone: Optional[str] = None,
+            ambiguous: str = "earlier", nonexistent: str = "forward") -> ConversionResult:
+    """
+    Convert a timestamp (ISO 8601 or other dateutil-readable string, datetime or
+    epoch seconds) to target_timezone.
+
+    Timestamps without an offset are read as UTC, or as wall time in source_timezone
+    when one is given; ambiguous ("earlier", "later", "raise") and nonexistent
+    ("forward", "backward", "raise") pick how local times repeated or skipped by a
+    clock change are resolved. String timestamps are cached.
+    """
+    parsed, cache_key = _prepare(timestamp, target_timezone, source_timezone, ambiguous, nonexistent)
+    if cache_key is None:
+        return _compute(parsed, target_timezone, source_timezone, ambiguous, nonexistent)
+
+    # Concurrent misses for the same key share one computation
+    cache_ttl = int(os.environ.get("CACHE_TTL", Config.DEFAULT_CACHE_TTL))
+    return time_cache.get_or_compute(
+        cache_key, lambda: _compute(parsed, target_timezone, source_timezone, ambiguous, nonexistent),
+        cache_ttl)
+
+
+async def aconvert(timestamp: Timestamp, target_timezone: str, source_timezone: Optional[str] = None,
+                   ambiguous: str = "earlier", nonexistent: str = "forward") -> ConversionResult:
+    """
+    convert() for asyncio callers: tasks missing the same key await one shared
+    computation instead of blocking the event loop on another thread's.
+    """
+    parsed, cache_key = _prepare(timestamp, target_timezone, source_timezone, ambiguous, nonexistent)
+    if cache_key is None:
+        return _compute(parsed, target_timezone, source_timezone, ambiguous, nonexistent)
+
+    cache_ttl = int(os.environ.get("CACHE_TTL", Config.DEFAULT_CACHE_TTL))
+    return await time_cache.aget_or_compute(
+        cache_key, lambda: _compute(parsed, target_timezone, source_timezone, ambiguous, nonexistent),
+        cache_ttl)
+
+
+def convert_many(timestamps: Any, target_timezone: str, source_timezone: Optional[str] = None,
+                 ambiguous: str = "earlier", nonexistent: str = "forward"):
+    """
+    Convert many timestamps to one zone.
+
+    A sequence returns a list of ConversionResult. A NumPy array of datetime64
+    values or integer epoch seconds is converted in bulk and returns a tuple of
+    arrays (local wall times as datetime64[s], UTC offsets in seconds, DST flags);
+    naive values are UTC instants, or wall time in source_timezone when one is given.
+    """
+    if type(timestamps).__module__ == "numpy" and hasattr(timestamps, "dtype"):
+        return _convert_array(timestamps, target_timezone, source_timezone, ambiguous, nonexistent)
+    return [convert(ts, target_timezone, source_timezone, ambiguous, nonexistent) for ts in timestamps]
+
+
+def _convert_array(values, target_timezone: str, source_timezone: Optional[str],
+                   ambiguous: str, nonexistent: str):
+    # The caller already imported NumPy; the engine never imports it otherwise
+    np = sys.modules["numpy"]
+    _check_zone(target_timezone)
+    if source_timezone is not None:
+        _check_zone(source_timezone)
+        _check_policies(ambiguous, nonexistent)
+
+    if values.dtype.kind == "M":
+        epochs = values.astype("datetime64[s]").astype(np.int64)
+    elif values.dtype.kind in "iu":
+        epochs = values.astype(np.int64)
+    else:
+        raise ConversionError("Arrays must hold datetime64 values or integer epoch seconds")
+
+    tables = get_tz_tables()
+    if source_timezone is not None:
+        try:
+            epochs = np.fromiter(
+                (tables.resolve_local(source_timezone, wall, ambiguous, nonexistent) for wall in epochs.tolist()),
+                dtype=np.int64, count=len(epochs))
+        except (AmbiguousTimeError, NonExistentTimeError) as e:
+            raise ConversionError(str(e)) from e
+
+    # One vectorized search over the zone's slice of the shared (memory-mapped) tables
+    start, count = tables.zones[target_timezone]
+    transitions = np.asarray(tables.transitions[start:start + count])
+    idx = np.searchsorted(transitions, epochs, side="right") - 1
+    np.maximum(idx, 0, out=idx)
+    offsets = np.asarray(tables.offsets[start:start + count])[idx]
+    is_dst = np.asarray(tables.dst[start:start + count])[idx] > 0
+    local = (epochs + offsets).astype("datetime64[s]")
+    return local, offsets, is_dst
+
+
+def _zone_info_entry(zone: str) -> Tuple[str, Callable[[], Dict], int]:
+    """
+    Cache key, compute function and TTL for a zone's current details.
+    """
+    _check_zone(zone)
+
+    def compute():
+        now, offset_seconds, dst_seconds = local_now(zone)
+        return {
+            "name": zone,
+            "country_code": get_zone_index().country_code(zone),
+            "current_time": now.isoformat(),
+            "offset": offset_string(offset_seconds),
+            "is_dst": dst_seconds > 0
+        }
+
+    timezone_info_ttl = int(os.environ.get("TIMEZONE_INFO_CACHE_TTL", Config.TIMEZONE_INFO_CACHE_TTL))
+    return f"timezone_info:{zone_cache_key(zone)}", compute, timezone_info_ttl
+
+
+def zone_info(zone: str) -> Dict:
+    """
+    Current time and offset details for a zone, cached for TIMEZONE_INFO_CACHE_TTL seconds.
+    """
+    # Concurrent misses for the same zone share one computation
+    return time_cache.get_or_compute(*_zone_info_entry(zone))
+
+
+async def azone_info(zone: str) -> Dict:
+    """
+    zone_info() for asyncio callers.
+    """
+    return await time_cache.aget_or_compute(*_zone_info_entry(zone))
+
+
+def current_time(zone: str) -> Dict:
+    """
+    The current UTC and local time in a zone. Not cached, since it is exact to
+    the microsecond; it costs one table lookup.
+    """
+    _check_zone(zone)
+    utc_now = datetime.now(timezone.utc)
+    now, offset_seconds, dst_seconds = to_local(utc_now, zone)
+    return {
+        "timezone": zone,
+        "local_time": now.isoformat(),
+        "utc_time": utc_now.isoformat(),
+        "offset": offset_string(offset_seconds),
+        "is_dst": dst_seconds > 0
+    }
+
+
+def transitions(zone: str, start: Optional[Timestamp] = None, end: Optional[Timestamp] = None) -> List[Dict]:
+    """
+    The offset changes of a zone with start <= instant < end (both optional), oldest first.
+    """
+    _check_zone(zone)
+    tables = get_tz_tables()
+    lo = MIN_INSTANT + 1 if start is None else to_epoch(_aware(_to_datetime(start)))
+    hi = None if end is None else to_epoch(_aware(_to_datetime(end)))
+    results = []
+    for instant, offset, dst, abbreviation in tables.zone_transitions(zone):
+        # The first entry of every zone is pytz's "since the beginning" sentinel
+        if instant < lo or instant <= MIN_INSTANT:
+            continue
+        if hi is not None and instant >= hi:
+            break
+        results.append({
+            "utc_time": datetime.fromtimestamp(instant, timezone.utc).isoformat(),
+            "offset": offset_string(offset),
+            "offset_seconds": offset,
+            "is_dst": dst > 0,
+            "abbreviation": abbreviation,
+        })
+    return results
+
+
+def _aware(dt: datetime) -> datetime:
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
@@ -0,0 +1,254 @@
+"""
+Non-blocking logging.
+
+configure() replaces the root handlers with a QueueHandler: a request thread
+only stamps the record with its request id and puts it on a bounded queue, and
+a background thread formats and writes it. When the queue is full the record is
+dropped and counted instead of blocking the request.
+
+Records from loggers listed in LOG_SAMPLE_RATES ("api.cache=100,api.timing=10")
+below WARNING are sampled: one in N is kept. Set LOG_FORMAT=json for one JSON
+object per line:
+
+    {"level":"ERROR","logger":"main","message":"...","request_id":"4f2c...","time":"..."}
+
+Request ids come from the X-Request-ID header when the client or proxy sends
+one and are generated otherwise; responses echo them.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from . import metrics
+from .config import Config
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_request_id: ContextVar[Optional[str]] = ContextVar("timesync_request_id", default=None)
+
+DROPPED_COUNT = metrics.REGISTRY.counter(
+    "timesync_log_records_dropped_total", "Log records dropped because the log queue was full.")
+SAMPLED_OUT_COUNT = metrics.REGISTRY.counter(
+    "timesync_log_records_sampled_out_total", "Log records skipped by sampling, by logger.",
+    ("logger",))
+
+
+def new_request_id() -> str:
+    return os.urandom(8).hex()
+
+
+def set_request_id(request_id: Optional[str]):
+    """
+    Set the request id for log records of the current request; returns a token
+    for reset_request_id().
+    """
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token) -> None:
+    _request_id.reset(token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def parse_sample_rates(text: str) -> Dict[str, int]:
+    """
+    Parse "logger=N,logger=N" into {logger: N}; malformed entries are ignored.
+    """
+    rates = {}
+    for item in text.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip().isdigit() and int(rate) > 1:
+            rates[name.strip()] = int(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamps records with the request id and samples high-frequency loggers.
+    Attached to the QueueHandler, so it runs on the thread that emits the
+    record (the request thread, where the request id is known), before the
+    record is queued.
+    """
+
+    def __init__(self, sample_rates: Optional[Dict[str, int]] = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self._counts: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rates and record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(record.name)
+            if rate is not None:
+                # Unlocked counter: a lost increment only shifts which record is kept
+                count = self._counts.get(record.name, 0) + 1
+                self._counts[record.name] = count
+                if count % rate:
+                    SAMPLED_OUT_COUNT.inc(record.name)
+                    return False
+        record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with the request id when there is one.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), sort_keys=True, default=str)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them; the listener thread does that.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler formats here, on the request thread. Records stay in
+        # this process, so arguments and tracebacks can be rendered later.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_COUNT.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    """
+    Writes queued records on a background thread.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for room: on a full queue the stock put_nowait would raise
+        self.queue.put(self._sentinel)
+
+
+_handler: Optional[_NonBlockingQueueHandler] = None
+_listener: Optional[_Listener] = None
+_output: Optional[logging.Handler] = None
+_listener_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def configure(level: int = logging.INFO, fmt: Optional[str] = None) -> None:
+    """
+    Route the root logger through the queue. `fmt` is "text" or "json"
+    (LOG_FORMAT by default). Safe to call more than once.
+    """
+    global _handler, _output
+    fmt = fmt or Config.LOG_FORMAT
+    output = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    handler = _NonBlockingQueueHandler(queue.Queue(Config.LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter(parse_sample_rates(Config.LOG_SAMPLE_RATES)))
+
+    with _lock:
+        _stop_listener()
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        _handler, _output = handler, output
+        _start_listener()
+
+
+def _start_listener() -> None:
+    global _listener, _listener_pid
+    _listener = _Listener(_handler.queue, _output, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        # Drains the queue before returning
+        _listener.stop()
+    _listener = None
+
+
+def flush() -> None:
+    """
+    Write out every queued record (restarts the writer thread afterwards).
+    """
+    with _lock:
+        if _handler is not None:
+            _stop_listener()
+            _start_listener()
+
+
+def _reinit_after_fork() -> None:
+    global _lock
+    # The writer thread does not survive fork, and the queue's lock may have been
+    # held by it; start over with a fresh queue and thread in the child
+    _lock = threading.Lock()
+    if _handler is not None:
+        _handler.queue = queue.Queue(Config.LOG_QUEUE_SIZE)
+        _start_listener()
+
+
+def _shutdown() -> None:
+    with _lock:
+        _stop_listener()
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
+atexit.register(_shutdown)
+metrics.REGISTRY.gauge_func(
+    "timesync_log_queue_depth", "Log records waiting to be written.",
+    lambda: _handler.queue.qsize() if _handler is not None else 0)
+
+
+def init_app(app) -> None:
+    """
+    Give every Flask request an id (from X-Request-ID or generated) for its
+    log records, and echo it in the response.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _begin_request_id():
+        request_id = request.headers.get(REQUEST_ID_HEADER) or new_request_id()
+        g._request_id_token = set_request_id(request_id[:64])
+
+    @app.after_request
+    def _emit_request_id(response):
+        request_id = current_request_id()
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _end_request_id(exc):
+        token = g.pop("_request_id_token", None)
+        if token is not None:
+            reset_request_id(token)
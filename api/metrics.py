@@ -0,0 +1,369 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, tuned for sub-millisecond cache hits up to slow fallbacks
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PROCESS_START_TIME = time.time()
+
+
+class _ThreadShards:
+    """
+    Per-thread value dictionaries.
+    Writers only ever touch their own thread's dictionary, so recording a sample
+    never takes a lock. The lock is only used when a new thread registers its shard.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict[Tuple, Any]] = []
+        self._lock = threading.Lock()
+
+    def shard(self) -> Dict[Tuple, Any]:
+        try:
+            return self._local.values
+        except AttributeError:
+            values: Dict[Tuple, Any] = {}
+            with self._lock:
+                self._shards.append(values)
+            self._local.values = values
+            return values
+
+    def shards(self) -> List[Dict[Tuple, Any]]:
+        with self._lock:
+            return list(self._shards)
+
+
+def _format_labels(labelnames: Tuple[str, ...], labels: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """
+    A monotonically increasing counter with optional labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = _ThreadShards()
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        shard = self._values.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._values.shards():
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.collect().items())
+        ]
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram with optional labels.
+    Each sample costs one bisect and two list updates on the calling thread's shard.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = _ThreadShards()
+
+    def observe(self, value: float, *labels: Any) -> None:
+        shard = self._values.shard()
+        series = shard.get(labels)
+        if series is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            series = shard[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self) -> Dict[Tuple, List[float]]:
+        totals: Dict[Tuple, List[float]] = {}
+        for shard in self._values.shards():
+            for labels, series in list(shard.items()):
+                merged = totals.setdefault(labels, [0] * len(series))
+                for i, value in enumerate(series):
+                    merged[i] += value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, series in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(float(series[-1]))}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    A gauge or counter whose value is read from a callback at scrape time.
+    The callback returns either a number or a mapping of label tuples to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], Any],
+                 labelnames: Tuple[str, ...] = (), kind: str = "gauge"):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func
+
+    def render(self) -> List[str]:
+        value = self.func()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(float(v))}"
+            for labels, v in sorted(value.items())
+        ]
+
+
+class MetricsRegistry:
+    """
+    Holds every metric exported by this process and renders them in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_func(self, name: str, documentation: str, func: Callable[[], Any],
+                   labelnames: Tuple[str, ...] = ()) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, func, labelnames))
+
+    def counter_func(self, name: str, documentation: str, func: Callable[[], Any],
+                     labelnames: Tuple[str, ...] = ()) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, func, labelnames, kind="counter"))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+REGISTRY = MetricsRegistry()
+
+# Shared metrics recorded by the request, parsing and auth paths
+REQUEST_COUNT = REGISTRY.counter(
+    "timesync_http_requests_total", "Total HTTP requests by route, method and status.",
+    ("route", "method", "status"))
+REQUEST_LATENCY = REGISTRY.histogram(
+    "timesync_http_request_duration_seconds", "HTTP request latency by route.",
+    ("route", "method"))
+TIMESTAMP_PARSE_COUNT = REGISTRY.counter(
+    "timesync_timestamp_parse_total", "Timestamp parses by path (fast ISO 8601 or dateutil fallback).",
+    ("path",))
+JWT_VERIFY_COUNT = REGISTRY.counter(
+    "timesync_jwt_verifications_total", "JWT verifications by result.",
+    ("result",))
+API_KEY_VERIFY_COUNT = REGISTRY.counter(
+    "timesync_api_key_verifications_total", "API key verifications by result.",
+    ("result",))
+REQUEST_REJECTED_COUNT = REGISTRY.counter(
+    "timesync_requests_rejected_total", "API requests rejected by rate limiting or admission control, by reason.",
+    ("reason",))
+TZ_RELOAD_COUNT = REGISTRY.counter(
+    "timesync_tz_reloads_total", "tz snapshot reload attempts by result.",
+    ("result",))
+TZ_ZONES_CHANGED_COUNT = REGISTRY.counter(
+    "timesync_tz_zones_changed_total", "Zones whose rules changed across tz snapshot reloads.")
+
+
+def _resident_memory_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _process_info():
+    version = ".".join(str(part) for part in sys.version_info[:3])
+    return {(os.getpid(), os.getppid(), version): 1}
+
+
+REGISTRY.gauge_func(
+    "timesync_process_info", "Worker process identity.",
+    _process_info, ("pid", "ppid", "python_version"))
+REGISTRY.gauge_func(
+    "process_start_time_seconds", "Start time of the process since unix epoch in seconds.",
+    lambda: PROCESS_START_TIME)
+REGISTRY.counter_func(
+    "process_cpu_seconds_total", "Total user and system CPU time spent in seconds.",
+    time.process_time)
+REGISTRY.gauge_func(
+    "process_resident_memory_bytes", "Resident memory size in bytes.",
+    lambda: _resident_memory_bytes() or 0)
+REGISTRY.gauge_func(
+    "timesync_process_threads", "Number of live Python threads.",
+    threading.active_count)
+
+
+def register_cache(name: str, cache) -> None:
+    """
+    Export the hit/miss/eviction/refresh and lock contention counters and the size
+    of a TimeCache or ShardedTimeCache.
+    """
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_hits_total", f"Cache hits for the {name} cache.",
+        lambda: cache.hits)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_misses_total", f"Cache misses for the {name} cache.",
+        lambda: cache.misses)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_evictions_total", f"Expired entries evicted from the {name} cache.",
+        lambda: cache.evictions)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_coalesced_total",
+        f"Misses on the {name} cache that waited for an in-flight computation.",
+        lambda: cache.coalesced)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_stale_hits_total",
+        f"Stale entries served from the {name} cache while being refreshed.",
+        lambda: cache.stale_hits)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_refreshes_total",
+        f"Background refreshes started by the {name} cache.",
+        lambda: cache.refreshes)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_lock_acquisitions_total",
+        f"Lock acquisitions on the {name} cache read and write paths.",
+        lambda: cache.acquisitions)
+    REGISTRY.counter_func(
+        f"timesync_cache_{name}_lock_contended_total",
+        f"Lock acquisitions on the {name} cache that waited for another thread.",
+        lambda: cache.contended)
+    REGISTRY.gauge_func(
+        f"timesync_cache_{name}_entries", f"Current number of entries in the {name} cache.",
+        cache.size)
+
+
+def register_api_keys(store) -> None:
+    """
+    Export how many requests API keys authenticated and how many keys are active.
+    Totals only: /metrics is unauthenticated, so it must not list keys or owners.
+    """
+    REGISTRY.counter_func(
+        "timesync_api_key_requests_total", "Requests authenticated with an API key.",
+        lambda: sum(record.uses for record in store))
+    REGISTRY.gauge_func(
+        "timesync_api_keys_active", "API keys that have not been revoked.",
+        lambda: sum(1 for record in store if not record.revoked))
+
+
+def register_admission(admission) -> None:
+    """
+    Export the in-flight request count and overload state of an AdmissionControl.
+    """
+    REGISTRY.gauge_func(
+        "timesync_requests_in_flight", "Admitted API requests currently in progress.",
+        lambda: admission.in_flight)
+    REGISTRY.gauge_func(
+        "timesync_admission_overloaded", "1 while requests are being shed for latency.",
+        lambda: int(admission.overloaded))
+
+
+def register_tz_version(func: Callable[[], Optional[str]]) -> None:
+    """
+    Export the tz database version of the active transition tables as an info gauge.
+    """
+    def versions():
+        version = func()
+        return {(version,): 1} if version is not None else {}
+
+    REGISTRY.gauge_func(
+        "timesync_tz_version_info", "tz database version of the active transition tables.",
+        versions, ("version",))
+
+
+def init_app(app) -> None:
+    """
+    Record per-route request counts and latencies for a Flask app and
+    expose them at /metrics.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = request.endpoint or "unmatched"
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route, request.method)
+            REQUEST_COUNT.inc(route, request.method, response.status_code)
+        return response
+
+    def metrics_view():
+        return Response(REGISTRY.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, validator
 from typing import Optional, List
 from datetime import datetime
-import pytz
+from .zoneindex import get_zone_index
 
 class TimeZone(BaseModel):
     name: str
@@ -25,7 +25,7 @@ class TimeConversionRequest(BaseModel):
 
     @validator('source_timezone', 'target_timezone')
     def validate_timezone(cls, v):
-        if v not in pytz.all_timezones:
+        if v not in get_zone_index():
             raise ValueError(f"Invalid timezone: {v}")
         return v
 
@@ -0,0 +1,221 @@
+"""
+Reverse lookups: which zones are at a given UTC offset or local time right now.
+
+The index keeps every zone filed under its current UTC offset, plus a heap of
+each zone's next transition. A query first applies the transitions that have
+come due since the last query (moving only those zones between offsets) and
+then reads the matching offset buckets, so it costs O(result size) instead of
+a lookup per zone.
+"""
+import re
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from .results import offset_string
+from .tzsnapshot import EPOCH, TzSnapshot, fixed_offset, get_tz_tables, on_reload
+from .zoneindex import get_zone_index
+
+_OFFSET = re.compile(r"^(?:UTC|GMT)?\s*([+-]?)(\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+_LOCAL_TIME = re.compile(r"^(\d{1,2})(?::(\d{2}))?$")
+
+DAY = 86400
+# "HH:MM" matches local times within half an hour either side. UTC offsets are
+# whole quarter hours, so an exact minute would almost never match any zone.
+_MINUTE_WINDOW = 1800
+
+
+def parse_offset(text: str) -> int:
+    """
+    Parse "+05:30", "-0800", "UTC+9" or "5:45" into offset seconds. A leading "+"
+    sent unescaped in a query string arrives as a space, so an unsigned offset is
+    positive.
+    """
+    match = _OFFSET.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid offset: {text}")
+    sign, hours, minutes = match.groups()
+    seconds = int(hours) * 3600 + int(minutes or 0) * 60
+    if int(minutes or 0) >= 60 or seconds > 14 * 3600:
+        raise ValueError(f"Invalid offset: {text}")
+    return -seconds if sign == "-" else seconds
+
+
+def parse_local_time(text: str) -> Tuple[int, int]:
+    """
+    Parse "HH:MM" (within 30 minutes of it) or "HH" (that hour) into
+    (seconds into the day the window starts, width).
+    """
+    match = _LOCAL_TIME.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid local time: {text} (use HH:MM or HH)")
+    hours, minutes = int(match.group(1)), match.group(2)
+    if hours > 23 or (minutes is not None and int(minutes) > 59):
+        raise ValueError(f"Invalid local time: {text} (use HH:MM or HH)")
+    if minutes is None:
+        return hours * 3600, 3600
+    start = hours * 3600 + int(minutes) * 60 - _MINUTE_WINDOW
+    return start % DAY, 2 * _MINUTE_WINDOW
+
+
+class OffsetIndex:
+    """
+    Zones grouped by the UTC offset currently in effect, kept current by
+    applying transitions as they come due.
+    """
+
+    def __init__(self, tables: TzSnapshot, zones, now: Optional[int] = None):
+        self.tables = tables
+        self.zones = zones
+        self.now = int(time.time()) if now is None else now
+        # offset -> sorted zone names; offsets keeps the bucket keys sorted
+        self.buckets: Dict[int, List[str]] = {}
+        self.offsets: List[int] = []
+        self.current: Dict[str, Tuple[int, bool]] = {}
+        self.pending: List[Tuple[int, str]] = []
+        self.transitions_applied = 0
+        self._lock = threading.Lock()
+
+        for zone in zones:
+            if zone not in tables:
+                continue
+            idx = tables.index_at(zone, self.now)
+            self._file(zone, tables.offsets[idx], tables.dst[idx] > 0)
+            self._schedule(zone, idx)
+
+    def _file(self, zone: str, offset: int, is_dst: bool) -> None:
+        bucket = self.buckets.get(offset)
+        if bucket is None:
+            bucket = self.buckets[offset] = []
+            insort(self.offsets, offset)
+        insort(bucket, zone)
+        self.current[zone] = (offset, is_dst)
+
+    def _unfile(self, zone: str) -> None:
+        offset, _ = self.current.pop(zone)
+        bucket = self.buckets[offset]
+        del bucket[bisect_left(bucket, zone)]
+        if not bucket:
+            del self.buckets[offset]
+            del self.offsets[bisect_left(self.offsets, offset)]
+
+    def _schedule(self, zone: str, idx: int) -> None:
+        start, count = self.tables.zones[zone]
+        if idx + 1 < start + count:
+            heapq.heappush(self.pending, (self.tables.transitions[idx + 1], zone))
+
+    def advance(self, now: int) -> None:
+        """
+        Apply every transition at or before `now`. Time never moves backwards
+        here: an earlier `now` leaves the index as it is.
+        """
+        if now <= self.now:
+            return
+        with self._lock:
+            pending = self.pending
+            while pending and pending[0][0] <= now:
+                _, zone = heapq.heappop(pending)
+                idx = self.tables.index_at(zone, now)
+                offset, is_dst = self.tables.offsets[idx], self.tables.dst[idx] > 0
+                if self.current[zone] != (offset, is_dst):
+                    self._unfile(zone)
+                    self._file(zone, offset, is_dst)
+                self._schedule(zone, idx)
+                self.transitions_applied += 1
+            self.now = max(self.now, now)
+
+    def _entries(self, offsets, now: int) -> List[Dict]:
+        results = []
+        for offset in offsets:
+            local_time = (EPOCH + timedelta(seconds=now + offset)).replace(tzinfo=fixed_offset(offset))
+            for zone in self.buckets.get(offset, ()):
+                results.append({
+                    "name": zone,
+                    "offset": offset_string(offset),
+                    "local_time": local_time.isoformat(),
+                    "is_dst": self.current[zone][1],
+                })
+        return results
+
+    def _offsets_between(self, low: int, high: int) -> List[int]:
+        # Current offsets in [low, high)
+        offsets = self.offsets
+        return offsets[bisect_left(offsets, low):bisect_left(offsets, high)]
+
+    def at_offset(self, offset: int, now: Optional[int] = None) -> List[Dict]:
+        """
+        Zones whose current UTC offset is `offset` seconds.
+        """
+        now = int(time.time()) if now is None else now
+        self.advance(now)
+        with self._lock:
+            return self._entries((offset,), now)
+
+    def at_local_time(self, seconds: int, width: int = 60, now: Optional[int] = None) -> List[Dict]:
+        """
+        Zones where the local time of day is in [seconds, seconds + width).
+        """
+        now = int(time.time()) if now is None else now
+        self.advance(now)
+        # Offsets that put now at that time of day; two ranges a day apart can
+        # both be real offsets (e.g. -10:00 and +14:00)
+        base = (seconds - now % DAY) % DAY
+        with self._lock:
+            offsets = (self._offsets_between(base - DAY, base - DAY + width)
+                       + self._offsets_between(base, base + width))
+            return self._entries(offsets, now)
+
+
+_offset_index: Optional[OffsetIndex] = None
+_offset_lock = threading.Lock()
+
+
+def get_offset_index() -> OffsetIndex:
+    """
+    Return the offset index for the current tz tables, building it on first use.
+    """
+    global _offset_index
+    tables = get_tz_tables()
+    zones = get_zone_index().zones
+    index = _offset_index
+    if index is None or index.tables is not tables or index.zones is not zones:
+        with _offset_lock:
+            index = _offset_index
+            if index is None or index.tables is not tables or index.zones is not zones:
+                index = _offset_index = OffsetIndex(tables, zones)
+    return index
+
+
+def _rebuild_after_reload(tables: TzSnapshot) -> None:
+    # Runs on the tz reload thread, so queries keep using the old index until
+    # the new one is ready instead of rebuilding it on the request path
+    if _offset_index is not None:
+        get_offset_index()
+
+
+on_reload(_rebuild_after_reload)
+
+
+def zones_at(offset: Optional[str] = None, local_time: Optional[str] = None,
+             now: Optional[int] = None) -> Dict:
+    """
+    Answer an offset or local time query. Raises ValueError for bad input.
+    """
+    now = int(time.time()) if now is None else now
+    index = get_offset_index()
+    if offset is not None:
+        seconds = parse_offset(offset)
+        return {
+            "offset": offset_string(seconds),
+            "utc_time": datetime.fromtimestamp(now, fixed_offset(0)).isoformat(),
+            "zones": index.at_offset(seconds, now),
+        }
+    seconds, width = parse_local_time(local_time)
+    return {
+        "local_time": local_time.strip(),
+        "utc_time": datetime.fromtimestamp(now, fixed_offset(0)).isoformat(),
+        "zones": index.at_local_time(seconds, width, now),
+    }
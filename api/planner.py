@@ -0,0 +1,188 @@
+"""
+Working-hours overlap planner.
+
+Each zone's daily working window is turned into UTC intervals by resolving the
+window's local start and end against the zone's transition table, once per day.
+A sweep over the sorted interval endpoints then yields the UTC spans where at
+least k zones are working. The cost grows with zones times days, not with the
+length of the range in minutes.
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import Config
+from .offsetindex import DAY
+from .tzsnapshot import EPOCH, TzSnapshot, fixed_offset, get_tz_tables
+from .zoneindex import get_zone_index
+
+DEFAULT_START = "09:00"
+DEFAULT_END = "17:00"
+DEFAULT_WEEKDAYS = (0, 1, 2, 3, 4)  # Monday to Friday
+
+Interval = Tuple[int, int]
+
+
+def parse_clock(text: str) -> int:
+    """
+    Parse "HH:MM" into seconds into the day; "24:00" is allowed as an end.
+    """
+    try:
+        hours, minutes = (int(part) for part in str(text).split(":"))
+    except ValueError:
+        raise ValueError(f"Invalid time of day: {text} (use HH:MM)")
+    if not (0 <= minutes < 60 and 0 <= hours * 60 + minutes <= 24 * 60):
+        raise ValueError(f"Invalid time of day: {text} (use HH:MM)")
+    return hours * 3600 + minutes * 60
+
+
+def first_instant_at(tables: TzSnapshot, zone: str, wall: int) -> int:
+    """
+    The first UTC epoch at which the clocks in `zone` read `wall` or later.
+    For a local time skipped by a clock change that is the change itself.
+    """
+    epoch = tables.resolve_local(zone, wall, "earlier", "forward")
+    idx = tables.index_at(zone, epoch)
+    if epoch + tables.offsets[idx] != wall:
+        # In a gap the resolved instant lies after the change, and the change is
+        # where the clocks jump past `wall`
+        return tables.transitions[idx]
+    return epoch
+
+
+def zone_intervals(tables: TzSnapshot, zone: str, first_day: date, last_day: date,
+                   start: int, end: int, weekdays: Sequence[int]) -> List[Interval]:
+    """
+    UTC intervals during which `zone` is inside its working window on the local
+    days first_day..last_day. A window whose end is not after its start runs
+    past midnight into the next day. Overlapping or touching intervals are merged.
+    """
+    intervals: List[Interval] = []
+    day = first_day
+    while day <= last_day:
+        if day.weekday() in weekdays:
+            midnight = (day - EPOCH.date()).days * DAY
+            lo = first_instant_at(tables, zone, midnight + start)
+            hi = first_instant_at(tables, zone, midnight + end + (DAY if end <= start else 0))
+            if hi > lo:
+                if intervals and lo <= intervals[-1][1]:
+                    intervals[-1] = (intervals[-1][0], max(hi, intervals[-1][1]))
+                else:
+                    intervals.append((lo, hi))
+        day += timedelta(days=1)
+    return intervals
+
+
+def overlaps(intervals: Dict[str, List[Interval]], k: int, lo: int, hi: int) -> List[Tuple[int, int, List[str]]]:
+    """
+    Sweep the intervals of all zones and return (start, end, zones) for every
+    span within [lo, hi) where at least k zones are working.
+    """
+    events = []
+    for zone, spans in intervals.items():
+        for start, end in spans:
+            start, end = max(start, lo), min(end, hi)
+            if start < end:
+                # Ends sort before starts at the same instant: intervals are half-open
+                events.append((start, 1, zone))
+                events.append((end, 0, zone))
+    events.sort()
+
+    results: List[Tuple[int, int, List[str]]] = []
+    active: Dict[str, None] = {}
+    i = 0
+    while i < len(events):
+        instant = events[i][0]
+        while i < len(events) and events[i][0] == instant:
+            _, starting, zone = events[i]
+            if starting:
+                active[zone] = None
+            else:
+                active.pop(zone, None)
+            i += 1
+        if results and results[-1][1] is None:
+            # Close the open span when the set of working zones changes
+            results[-1] = (results[-1][0], instant, results[-1][2])
+        if len(active) >= k:
+            results.append((instant, None, sorted(active)))
+    return [span for span in results if span[1] is not None and span[1] > span[0]]
+
+
+def _isoformat(epoch: int) -> str:
+    return (EPOCH + timedelta(seconds=epoch)).replace(tzinfo=fixed_offset(0)).isoformat()
+
+
+def _parse_date(value, name: str) -> date:
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value} (use YYYY-MM-DD)")
+
+
+def plan_overlap(zones: List, start_date: str, end_date: Optional[str] = None,
+                 working_hours: Optional[Dict] = None, weekdays: Optional[Sequence[int]] = None,
+                 min_zones: Optional[int] = None) -> Dict:
+    """
+    Find the UTC spans between start_date and end_date (inclusive, UTC days) where
+    at least min_zones of the zones (all of them by default) are in working hours.
+
+    Each zone is a name or {"timezone", "start", "end", "weekdays"}; missing fields
+    fall back to working_hours ({"start", "end"}, 09:00-17:00 by default) and
+    weekdays (0 = Monday, Monday to Friday by default). Raises ValueError for bad input.
+    """
+    if not isinstance(zones, list) or not zones:
+        raise ValueError("zones must be a non-empty list")
+    if len(zones) > Config.MAX_PLANNER_ZONES:
+        raise ValueError(f"Too many zones: at most {Config.MAX_PLANNER_ZONES}")
+    first = _parse_date(start_date, "start_date")
+    last = _parse_date(end_date or start_date, "end_date")
+    if last < first:
+        raise ValueError("end_date must not be before start_date")
+    if (last - first).days + 1 > Config.MAX_PLANNER_DAYS:
+        raise ValueError(f"Date range too long: at most {Config.MAX_PLANNER_DAYS} days")
+
+    defaults = working_hours or {}
+    if not isinstance(defaults, dict):
+        raise ValueError("working_hours must be an object with start and end")
+    default_weekdays = DEFAULT_WEEKDAYS if weekdays is None else weekdays
+    tables = get_tz_tables()
+    index = get_zone_index()
+
+    intervals: Dict[str, List[Interval]] = {}
+    for entry in zones:
+        if isinstance(entry, str):
+            entry = {"timezone": entry}
+        if not isinstance(entry, dict):
+            raise ValueError("Each zone must be a timezone name or an object")
+        zone = entry.get("timezone")
+        if not isinstance(zone, str) or zone not in index or zone not in tables:
+            raise ValueError(f"Invalid timezone: {zone}")
+        if zone in intervals:
+            raise ValueError(f"Duplicate timezone: {zone}")
+        start = parse_clock(entry.get("start", defaults.get("start", DEFAULT_START)))
+        end = parse_clock(entry.get("end", defaults.get("end", DEFAULT_END)))
+        days = entry.get("weekdays", default_weekdays)
+        if not isinstance(days, (list, tuple)) or not all(isinstance(d, int) and 0 <= d <= 6 for d in days):
+            raise ValueError("weekdays must be integers from 0 (Monday) to 6 (Sunday)")
+        # A window from two local days earlier can still be open at the start of the
+        # range (UTC-12 plus an overnight window); one day later covers UTC+14
+        intervals[zone] = zone_intervals(tables, zone, first - timedelta(days=2), last + timedelta(days=1),
+                                         start, end, frozenset(days))
+
+    k = len(intervals) if min_zones is None else min_zones
+    if not isinstance(k, int) or not 1 <= k <= len(intervals):
+        raise ValueError(f"min_zones must be between 1 and {len(intervals)}")
+
+    lo = (first - EPOCH.date()).days * DAY
+    hi = (last - EPOCH.date()).days * DAY + DAY
+    spans = overlaps(intervals, k, lo, hi)
+    return {
+        "start": _isoformat(lo),
+        "end": _isoformat(hi),
+        "min_zones": k,
+        "total_minutes": sum(end - start for start, end, _ in spans) // 60,
+        "overlaps": [
+            {"start": _isoformat(start), "end": _isoformat(end),
+             "minutes": (end - start) // 60, "zones": names}
+            for start, end, names in spans
+        ],
+    }
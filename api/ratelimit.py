@@ -0,0 +1,223 @@
+"""
+Per-client rate limiting and load shedding.
+
+Every API request passes two checks before its body is read:
+
+- Token buckets per client IP and per credential. The IP bucket is charged
+  first, so requests with made-up credentials still spend their IP's budget.
+  Credentials get a bucket only once the app has verified them, keyed by what
+  the app's identify() returns (e.g. the API key id or the token's user), so
+  rotating junk credentials cannot mint fresh buckets. The app keeps the
+  verified identity for the route, so checking it here costs nothing extra. A
+  client over its rate gets 429 with Retry-After, so one abusive client spends
+  its own budget instead of everyone's worker time.
+- Admission control. A request is rejected with 503 and Retry-After when the
+  worker already has ADMISSION_MAX_IN_FLIGHT requests in progress, when it sat
+  in the proxy queue longer than ADMISSION_MAX_QUEUE_MS (read from the
+  X-Request-Start header the proxy adds), or while the worker is overloaded:
+  when even the fastest request of the last interval took longer than
+  ADMISSION_LATENCY_TARGET_MS, every other request is shed until latency
+  recovers.
+
+State is per worker process, so a client can reach the configured rates once
+per worker.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from . import metrics
+from .config import Config
+
+# Buckets kept per limiter; the least recently used are dropped past this size
+MAX_BUCKETS = 10000
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets by key: each holds up to `burst` tokens and refills at `rate`
+    tokens per second. A bucket is two floats updated on access, so an idle
+    client costs nothing.
+    """
+
+    def __init__(self, rate: float, burst: float, max_buckets: int = MAX_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        # key -> (tokens, updated), least recently used first
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """
+        Take one token for key. Returns 0 when allowed, otherwise the seconds
+        until a token is available.
+        """
+        now = time.monotonic() if now is None else now
+        buckets = self._buckets
+        with self._lock:
+            tokens, updated = buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            buckets[key] = (tokens - 1 if allowed else tokens, now)
+            buckets.move_to_end(key)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / self.rate
+
+
+class AdmissionControl:
+    """
+    Tracks in-flight requests and the minimum latency over fixed intervals
+    (as CoDel does for queue delay) to decide whether to take on more work.
+    """
+
+    def __init__(self, max_in_flight: int = 0, max_queue_ms: float = 0,
+                 latency_target_ms: float = 0, interval: float = 1.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue_ms / 1000
+        self.latency_target = latency_target_ms / 1000
+        self.interval = interval
+        self.in_flight = 0
+        self.overloaded = False
+        self._window_start = time.monotonic()
+        self._window_min: Optional[float] = None
+        self._shed = 0
+        self._lock = threading.Lock()
+
+    def admit(self, queue_delay: Optional[float] = None) -> Optional[str]:
+        """
+        Start a request. Returns None when admitted (call finish() afterwards)
+        or the reason it was rejected.
+        """
+        if self.max_queue and queue_delay is not None and queue_delay > self.max_queue:
+            return "queue"
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                return "in_flight"
+            if self.overloaded:
+                # Shed every other request; the rest keep measuring latency
+                self._shed += 1
+                if self._shed % 2:
+                    return "latency"
+            self.in_flight += 1
+        return None
+
+    def finish(self, elapsed: float, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.in_flight -= 1
+            if not self.latency_target:
+                return
+            if self._window_min is None or elapsed < self._window_min:
+                self._window_min = elapsed
+            if now - self._window_start >= self.interval:
+                self.overloaded = self._window_min > self.latency_target
+                self._window_start = now
+                self._window_min = None
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """
+        Leave the overloaded state when no request has finished for two intervals,
+        since nothing shows the worker is still slow.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if now - self._window_start >= 2 * self.interval:
+                self.overloaded = False
+                self._window_start = now
+                self._window_min = None
+
+
+def queue_delay(header: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds since an X-Request-Start value ("t=<epoch>" or a bare epoch in
+    seconds, milliseconds or microseconds), or None if it is missing or malformed.
+    """
+    if not header:
+        return None
+    try:
+        value = header.strip()
+        started = float(value[2:] if value.startswith("t=") else value)
+    except ValueError:
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    now = time.time() if now is None else now
+    return max(0.0, now - started)
+
+
+def client_ip(remote_addr: Optional[str], forwarded_for: Optional[str]) -> str:
+    """
+    The client address. Behind TRUSTED_PROXIES proxies it is read from
+    X-Forwarded-For, skipping the entries those proxies appended for each other;
+    anything further left could have been sent by the client.
+    """
+    if Config.TRUSTED_PROXIES and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        if len(hops) >= Config.TRUSTED_PROXIES:
+            return hops[-Config.TRUSTED_PROXIES]
+    return remote_addr or "unknown"
+
+
+def retry_after(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+credential_limiter = TokenBucketLimiter(Config.RATE_LIMIT_RATE, Config.RATE_LIMIT_BURST)
+ip_limiter = TokenBucketLimiter(Config.RATE_LIMIT_IP_RATE, Config.RATE_LIMIT_IP_BURST)
+admission = AdmissionControl(Config.ADMISSION_MAX_IN_FLIGHT, Config.ADMISSION_MAX_QUEUE_MS,
+                             Config.ADMISSION_LATENCY_TARGET_MS)
+metrics.register_admission(admission)
+
+
+def init_blueprints(*blueprints, identify: Optional[Callable[[], Optional[str]]] = None) -> None:
+    """
+    Rate-limit and admission-control every request routed to the blueprints.
+    identify() returns the rate limit key of the request's verified credential,
+    or None when it has none that checks out.
+    """
+    from flask import g, request
+
+    from .encoding import json_response
+
+    def reject(status: int, detail: str, reason: str, wait: float):
+        metrics.REQUEST_REJECTED_COUNT.inc(reason)
+        response = json_response({"status": "error", "detail": detail}, status)
+        response.headers["Retry-After"] = retry_after(wait)
+        return response
+
+    def check():
+        now = time.monotonic()
+        if Config.RATE_LIMIT_ENABLED:
+            wait = ip_limiter.take(client_ip(request.remote_addr, request.headers.get("X-Forwarded-For")), now)
+            if wait:
+                return reject(429, "Rate limit exceeded", "ip", wait)
+            credential = identify() if identify is not None else None
+            if credential is not None:
+                wait = credential_limiter.take(credential, now)
+                if wait:
+                    return reject(429, "Rate limit exceeded", "client", wait)
+
+        admission.expire(now)
+        reason = admission.admit(queue_delay(request.headers.get("X-Request-Start")))
+        if reason is not None:
+            return reject(503, "Server overloaded, retry later", reason, admission.interval)
+        g._admitted = now
+        return None
+
+    def release(exc):
+        started = g.pop("_admitted", None)
+        if started is not None:
+            admission.finish(time.monotonic() - started)
+
+    for blueprint in blueprints:
+        blueprint.before_request(check)
+        blueprint.teardown_request(release)
@@ -0,0 +1,90 @@
+"""
+Compact conversion results.
+
+Cached conversions are kept as small slotted records holding epoch seconds and
+offsets instead of dicts of formatted strings; zone names are interned and the
+JSON-ready dict is only built when a response is rendered.
+"""
+import sys
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Optional
+
+from .tzsnapshot import EPOCH, fixed_offset, to_epoch
+
+# Offsets and zone names repeat across millions of entries; keep one object per value
+_offsets: Dict[int, int] = {}
+
+
+def _shared_offset(seconds: int) -> int:
+    return _offsets.setdefault(seconds, seconds)
+
+
+@lru_cache(maxsize=None)
+def offset_string(offset_seconds: int) -> str:
+    """
+    Format a UTC offset as "+HH:MM", matching the API's historical formatting.
+    """
+    offset_hours = int(offset_seconds // 3600)
+    offset_minutes = int((offset_seconds % 3600) // 60)
+    return f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
+
+
+class ConversionResult:
+    """
+    A converted instant: UTC epoch seconds and microseconds, the offset the
+    input timestamp was written in, and the target zone's offset and DST flag.
+    For conversions from a source zone, source_zone is set and source_offset is
+    that zone's offset at the instant.
+    """
+
+    __slots__ = ("epoch", "microsecond", "source_offset", "offset", "zone", "is_dst", "source_zone")
+
+    def __init__(self, epoch: int, microsecond: int, source_offset: int, offset: int,
+                 zone: str, is_dst: bool, source_zone: Optional[str] = None):
+        self.epoch = epoch
+        self.microsecond = microsecond
+        self.source_offset = _shared_offset(source_offset)
+        self.offset = _shared_offset(offset)
+        self.zone = sys.intern(zone)
+        self.is_dst = is_dst
+        self.source_zone = sys.intern(source_zone) if source_zone else None
+
+    @classmethod
+    def from_datetime(cls, utc_time: datetime, zone: str, offset_seconds: int,
+                      dst_seconds: int) -> "ConversionResult":
+        """
+        Build a result from an aware input datetime and the target zone's offsets.
+        """
+        return cls(
+            to_epoch(utc_time),
+            utc_time.microsecond,
+            int(utc_time.utcoffset().total_seconds()),
+            int(offset_seconds),
+            zone,
+            dst_seconds > 0,
+        )
+
+    def _isoformat(self, offset: int) -> str:
+        local = EPOCH + timedelta(seconds=self.epoch + offset, microseconds=self.microsecond)
+        return local.replace(tzinfo=fixed_offset(offset)).isoformat()
+
+    def to_dict(self) -> Dict:
+        if self.source_zone is not None:
+            return {
+                "source_timestamp": self._isoformat(self.source_offset),
+                "source_timezone": self.source_zone,
+                "source_offset": offset_string(self.source_offset),
+                "utc_timestamp": self._isoformat(0),
+                "local_timestamp": self._isoformat(self.offset),
+                "timezone": self.zone,
+                "offset": offset_string(self.offset),
+                "is_dst": self.is_dst
+            }
+        return {
+            "utc_timestamp": self._isoformat(self.source_offset),
+            "local_timestamp": self._isoformat(self.offset),
+            "timezone": self.zone,
+            "offset": offset_string(self.offset),
+            "is_dst": self.is_dst
+        }
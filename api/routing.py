@@ -0,0 +1,31 @@
+from typing import Callable
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from .config import Config
+from . import timing
+
+
+class TimedRoute(APIRoute):
+    """
+    FastAPI route class that times each request, emits a Server-Timing header
+    and runs the sampling profiler, mirroring api.timing.init_app for Flask.
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            timer, token = timing.begin()
+            profile = timing.profiler.start(request.headers.get(timing.PROFILE_HEADER))
+            try:
+                response = await original_handler(request)
+            finally:
+                timing.profiler.finish(profile)
+                timing.end(token)
+            if Config.SERVER_TIMING_ENABLED:
+                response.headers["Server-Timing"] = timer.server_timing()
+            return response
+
+        return timed_handler
@@ -1,19 +1,20 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Response
 from pydantic import BaseModel, validator
-from typing import Optional, List, Dict
-import pytz
-from datetime import datetime, timezone
+from typing import Any, Optional, List, Dict
 from dateutil import parser
 import logging
-from .cache import TimeCache
+from . import binbatch, engine, userdata
 from .auth import get_current_user, User
-from flask import request, jsonify, g
+from .routing import TimedRoute
+from .timing import stage
+from .offsetindex import zones_at
+from .planner import plan_overlap
+from .zoneindex import get_zone_index
+from .zoneregistry import get_zone_registry
+from .zonesearch import DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT, MAX_LIMIT as MAX_SEARCH_LIMIT, search_zones
 
-# Initialize router
-router = APIRouter()
-
-# Initialize cache
-time_cache = TimeCache()
+# Initialize router; TimedRoute adds Server-Timing headers and sampled profiling
+router = APIRouter(route_class=TimedRoute)
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -22,6 +23,9 @@ logger = logging.getLogger(__name__)
 class ConversionRequest(BaseModel):
     utc_timestamp: str
     target_timezone: str
+    source_timezone: Optional[str] = None
+    ambiguous: str = "earlier"
+    nonexistent: str = "forward"
 
     @validator('utc_timestamp')
     def validate_timestamp(cls, v):
@@ -33,10 +37,18 @@ class ConversionRequest(BaseModel):
 
     @validator('target_timezone')
     def validate_timezone(cls, v):
-        if v not in pytz.all_timezones:
+        if v not in get_zone_index():
             raise ValueError(f"Invalid timezone: {v}")
         return v
 
+class OverlapRequest(BaseModel):
+    zones: List[Any]
+    start_date: str
+    end_date: Optional[str] = None
+    working_hours: Optional[Dict[str, str]] = None
+    weekdays: Optional[List[int]] = None
+    min_zones: Optional[int] = None
+
 # Response models
 class ConversionResponse(BaseModel):
     utc_timestamp: str
@@ -44,6 +56,9 @@ class ConversionResponse(BaseModel):
     timezone: str
     offset: str
     is_dst: bool
+    source_timestamp: Optional[str] = None
+    source_timezone: Optional[str] = None
+    source_offset: Optional[str] = None
 
 class TimezoneInfo(BaseModel):
     name: str
@@ -58,50 +73,45 @@ async def get_all_timezones():
     """
     Get a list of all available time zones.
     """
-    return pytz.all_timezones
+    return list(get_zone_index().zones)
+
+@router.get("/timezones/search", response_model=List[Dict])
+async def search_timezones(
+    q: str = Query(..., min_length=1, description="Zone, city, country or abbreviation to search for"),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT)
+):
+    """
+    Search time zones by name, city, country or common alias, best matches first.
+    """
+    return search_zones(q, limit)
+
+@router.get("/timezones/at", response_model=Dict)
+async def get_zones_at(
+    offset: Optional[str] = Query(None, description="UTC offset, e.g. '+05:30'"),
+    local_time: Optional[str] = Query(None, description="Local time of day, 'HH:MM' (±30 minutes) or 'HH' (that hour)")
+):
+    """
+    List the zones currently at a UTC offset or showing a local time of day:
+    within 30 minutes of 'HH:MM', or anywhere in the hour 'HH'.
+    """
+    if (offset is None) == (local_time is None):
+        raise HTTPException(status_code=400, detail="Pass exactly one of: offset, local_time")
+    try:
+        return zones_at(offset, local_time)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
 
 @router.get("/timezone/{timezone}", response_model=TimezoneInfo)
 async def get_timezone_info(timezone: str):
     """
     Get detailed information about a specific timezone.
     """
-    if timezone not in pytz.all_timezones:
+    if timezone not in get_zone_index():
         raise HTTPException(status_code=400, detail=f"Invalid timezone: {timezone}")
     
-    # Try to get from cache first
-    cached_info = time_cache.get(f"timezone_info:{timezone}")
-    if cached_info:
-        return cached_info
-    
     try:
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-        
-        # Get country code if available
-        country_code = None
-        for code, timezones in pytz.country_timezones.items():
-            if timezone in timezones:
-                country_code = code
-                break
-        
-        # Calculate offset in hours and minutes
-        offset_seconds = now.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-        
-        result = {
-            "name": timezone,
-            "country_code": country_code,
-            "current_time": now.isoformat(),
-            "offset": offset_str,
-            "is_dst": now.dst().total_seconds() > 0
-        }
-        
-        # Store in cache for 5 minutes
-        time_cache.set(f"timezone_info:{timezone}", result, 300)
-        
-        return result
+        # Cached for TIMEZONE_INFO_CACHE_TTL seconds by the engine
+        return await engine.azone_info(timezone)
     except Exception as e:
         logger.error(f"Error getting timezone info: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing timezone info: {str(e)}")
@@ -128,50 +138,17 @@ async def get_popular_timezones():
     
     return results
 
-@router.post("/convert", response_model=ConversionResponse)
+@router.post("/convert", response_model=ConversionResponse, response_model_exclude_none=True)
 async def convert_time(request: ConversionRequest, current_user: User = Depends(get_current_user)):
     """
     Convert a UTC timestamp to a target timezone with DST handling.
     """
-    # Generate cache key based on request
-    cache_key = f"convert:{request.utc_timestamp}:{request.target_timezone}"
-    
-    # Try to get from cache first
-    cached_result = time_cache.get(cache_key)
-    if cached_result:
-        return cached_result
-    
     try:
-        # Parse the UTC timestamp
-        utc_time = parser.parse(request.utc_timestamp)
-        if utc_time.tzinfo is None:
-            utc_time = utc_time.replace(tzinfo=timezone.utc)
-        
-        # Convert to target timezone
-        target_tz = pytz.timezone(request.target_timezone)
-        local_time = utc_time.astimezone(target_tz)
-        
-        # Get DST information
-        is_dst = local_time.dst().total_seconds() > 0
-        
-        # Calculate offset
-        offset_seconds = local_time.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-        
-        result = {
-            "utc_timestamp": utc_time.isoformat(),
-            "local_timestamp": local_time.isoformat(),
-            "timezone": request.target_timezone,
-            "offset": offset_str,
-            "is_dst": is_dst
-        }
-        
-        # Store in cache for 1 hour (since timezone rules don't change frequently)
-        time_cache.set(cache_key, result, 3600)
-        
-        return result
+        result = await engine.aconvert(request.utc_timestamp, request.target_timezone, request.source_timezone,
+                                       request.ambiguous, request.nonexistent)
+        # Added to the user's history by a background writer, off this request
+        userdata.recorder.record_conversion(current_user.username, result)
+        return result.to_dict()
     except ValueError as ve:
         logger.error(f"Validation error: {str(ve)}")
         raise HTTPException(status_code=400, detail=str(ve))
@@ -179,46 +156,74 @@ async def convert_time(request: ConversionRequest, current_user: User = Depends(
         logger.error(f"Error converting time: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error converting time: {str(e)}")
 
-@router.get("/convert", response_model=ConversionResponse)
+@router.get("/convert", response_model=ConversionResponse, response_model_exclude_none=True)
 async def convert_time_get(
     utc_timestamp: str = Query(..., description="UTC timestamp in ISO 8601 format"),
     target_timezone: str = Query(..., description="Target timezone (e.g., 'America/New_York')"),
+    source_timezone: Optional[str] = Query(None, description="Zone to read timestamps without an offset in"),
+    ambiguous: str = Query("earlier", description="earlier, later or raise"),
+    nonexistent: str = Query("forward", description="forward, backward or raise"),
     current_user: User = Depends(get_current_user)
 ):
     """
     Convert a UTC timestamp to a target timezone with DST handling (GET method).
     """
-    request = ConversionRequest(utc_timestamp=utc_timestamp, target_timezone=target_timezone)
+    request = ConversionRequest(utc_timestamp=utc_timestamp, target_timezone=target_timezone,
+                                source_timezone=source_timezone, ambiguous=ambiguous, nonexistent=nonexistent)
     return await convert_time(request, current_user)
 
-@router.get("/now/{timezone}", response_model=Dict)
+@router.post("/convert/batch", response_class=Response)
+async def convert_batch_binary(request: Request, current_user: User = Depends(get_current_user)):
+    """
+    Convert a packed binary batch (int64 epochs and uint16 zone ids from the zone
+    registry) into packed int32 offsets and DST flags; see api/binbatch.py.
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != binbatch.MIMETYPE:
+        raise HTTPException(status_code=415, detail=f"Send the batch as {binbatch.MIMETYPE}")
+    content_length = request.headers.get("content-length")
+    try:
+        if content_length is not None and content_length.isdigit():
+            # Reject oversized bodies before reading them
+            binbatch.item_count(int(content_length))
+        with stage("parse"):
+            body = await request.body()
+        with stage("convert"):
+            packed = binbatch.convert_packed(body)
+    except binbatch.BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(packed, media_type=binbatch.MIMETYPE)
+
+@router.get("/zones/registry", response_model=Dict)
+async def get_zone_registry_route():
+    """
+    Stable zone ids for the binary batch protocol: a zone's id is its position in
+    `zones`, and ids never change (new zones are appended).
+    """
+    return get_zone_registry().to_dict()
+
+@router.post("/overlap", response_model=Dict)
+async def plan_working_hours_overlap(request: OverlapRequest):
+    """
+    Find the UTC spans where at least min_zones of the zones are in working hours.
+    """
+    try:
+        with stage("plan"):
+            return plan_overlap(request.zones, request.start_date, request.end_date,
+                                request.working_hours, request.weekdays, request.min_zones)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+@router.get("/now/{timezone:path}", response_model=Dict)
 async def get_current_time(timezone: str):
     """
     Get the current time in the specified timezone.
     """
-    if timezone not in pytz.all_timezones:
+    if timezone not in get_zone_index():
         raise HTTPException(status_code=400, detail=f"Invalid timezone: {timezone}")
     
     try:
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-        
-        # Get UTC time
-        utc_now = datetime.now(timezone.utc)
-        
-        # Calculate offset
-        offset_seconds = now.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-        
-        return {
-            "timezone": timezone,
-            "local_time": now.isoformat(),
-            "utc_time": utc_now.isoformat(),
-            "offset": offset_str,
-            "is_dst": now.dst().total_seconds() > 0
-        }
+        # One transition table lookup; names like Europe/Paris span two path segments
+        return engine.current_time(timezone)
     except Exception as e:
         logger.error(f"Error getting current time: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting current time: {str(e)}")
@@ -228,62 +233,19 @@ def convert_flask_time():
     """
     Flask-compatible function to convert UTC time to a target timezone.
     """
+    from flask import request, jsonify
+
     try:
         data = request.get_json()
         utc_timestamp = data.get('utc_timestamp')
         target_timezone = data.get('target_timezone')
         
-        if not utc_timestamp or not target_timezone:
-            return jsonify({"error": "Missing required fields"}), 400
-            
-        # Validate timestamp
         try:
-            parser.parse(utc_timestamp)
-        except Exception:
-            return jsonify({"error": "Invalid timestamp format. Use ISO 8601 format (e.g., '2023-05-01T12:00:00Z')"}), 400
-            
-        # Validate timezone
-        if target_timezone not in pytz.all_timezones:
-            return jsonify({"error": f"Invalid timezone: {target_timezone}"}), 400
-            
-        # Generate cache key
-        cache_key = f"convert:{utc_timestamp}:{target_timezone}"
-        
-        # Try to get from cache first
-        cached_result = time_cache.get(cache_key)
-        if cached_result:
-            return jsonify(cached_result)
-            
-        # Parse the UTC timestamp
-        utc_time = parser.parse(utc_timestamp)
-        if utc_time.tzinfo is None:
-            utc_time = utc_time.replace(tzinfo=timezone.utc)
-            
-        # Convert to target timezone
-        target_tz = pytz.timezone(target_timezone)
-        local_time = utc_time.astimezone(target_tz)
-            
-        # Get DST information
-        is_dst = local_time.dst().total_seconds() > 0
+            result = engine.convert(utc_timestamp, target_timezone)
+        except engine.ConversionError as e:
+            return jsonify({"error": str(e)}), 400
             
-        # Calculate offset
-        offset_seconds = local_time.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-            
-        result = {
-            "utc_timestamp": utc_time.isoformat(),
-            "local_timestamp": local_time.isoformat(),
-            "timezone": target_timezone,
-            "offset": offset_str,
-            "is_dst": is_dst
-        }
-            
-        # Store in cache for 1 hour
-        time_cache.set(cache_key, result, 3600)
-            
-        return jsonify(result)
+        return jsonify(result.to_dict())
     except Exception as e:
         logger.error(f"Error converting time: {str(e)}")
         return jsonify({"error": f"Error converting time: {str(e)}"}), 500
@@ -292,49 +254,21 @@ def get_all_timezones_flask():
     """
     Flask-compatible function to get all available timezones.
     """
-    return jsonify(pytz.all_timezones)
+    from flask import request, jsonify
+
+    return jsonify(list(get_zone_index().zones))
 
 def get_timezone_info_flask(timezone):
     """
     Flask-compatible function to get timezone information.
     """
-    if timezone not in pytz.all_timezones:
+    from flask import request, jsonify
+
+    if timezone not in get_zone_index():
         return jsonify({"error": f"Invalid timezone: {timezone}"}), 400
         
-    # Try to get from cache first
-    cached_info = time_cache.get(f"timezone_info:{timezone}")
-    if cached_info:
-        return jsonify(cached_info)
-        
     try:
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-            
-        # Get country code if available
-        country_code = None
-        for code, timezones in pytz.country_timezones.items():
-            if timezone in timezones:
-                country_code = code
-                break
-            
-        # Calculate offset in hours and minutes
-        offset_seconds = now.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-            
-        result = {
-            "name": timezone,
-            "country_code": country_code,
-            "current_time": now.isoformat(),
-            "offset": offset_str,
-            "is_dst": now.dst().total_seconds() > 0
-        }
-            
-        # Store in cache for 5 minutes
-        time_cache.set(f"timezone_info:{timezone}", result, 300)
-            
-        return jsonify(result)
+        return jsonify(engine.zone_info(timezone))
     except Exception as e:
         logger.error(f"Error getting timezone info: {str(e)}")
         return jsonify({"error": f"Error processing timezone info: {str(e)}"}), 500
@@ -343,6 +277,8 @@ def get_popular_timezones_flask():
     """
     Flask-compatible function to get popular timezones.
     """
+    from flask import request, jsonify
+
     popular_zones = [
         "America/New_York", "America/Los_Angeles", "America/Chicago",
         "Europe/London", "Europe/Paris", "Europe/Berlin",
@@ -353,39 +289,7 @@ def get_popular_timezones_flask():
     results = []
     for zone in popular_zones:
         try:
-            # Try to get from cache first
-            cached_info = time_cache.get(f"timezone_info:{zone}")
-            if cached_info:
-                results.append(cached_info)
-                continue
-                
-            tz = pytz.timezone(zone)
-            now = datetime.now(tz)
-                
-            # Get country code if available
-            country_code = None
-            for code, timezones in pytz.country_timezones.items():
-                if zone in timezones:
-                    country_code = code
-                    break
-                
-            # Calculate offset in hours and minutes
-            offset_seconds = now.utcoffset().total_seconds()
-            offset_hours = int(offset_seconds // 3600)
-            offset_minutes = int((offset_seconds % 3600) // 60)
-            offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-                
-            result = {
-                "name": zone,
-                "country_code": country_code,
-                "current_time": now.isoformat(),
-                "offset": offset_str,
-                "is_dst": now.dst().total_seconds() > 0
-            }
-                
-            # Store in cache for 5 minutes
-            time_cache.set(f"timezone_info:{zone}", result, 300)
-            results.append(result)
+            results.append(engine.zone_info(zone))
         except Exception as e:
             logger.error(f"Error getting info for {zone}: {str(e)}")
         
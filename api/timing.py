@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from .config import Config
+from . import metrics
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Header a client can send to request a profile of that single request
+PROFILE_HEADER = "X-TimeSync-Profile"
+
+STAGE_LATENCY = metrics.REGISTRY.histogram(
+    "timesync_stage_duration_seconds", "Time spent in each stage of the conversion and auth paths.",
+    ("stage",))
+
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("timesync_stage_timer", default=None)
+
+
+class StageTimer:
+    """
+    Collects the duration of each named stage of a single request.
+    """
+
+    __slots__ = ("stages", "started")
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+        self.started = time.perf_counter()
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages.append((name, seconds))
+        STAGE_LATENCY.observe(seconds, name)
+
+    def server_timing(self) -> str:
+        """
+        Render the stages as a Server-Timing header value (durations in milliseconds).
+        """
+        parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.3f}")
+        return ", ".join(parts)
+
+
+def begin():
+    """
+    Start timing a request. Returns the timer and a token for end().
+    """
+    timer = StageTimer()
+    return timer, _current_timer.set(timer)
+
+
+def end(token) -> None:
+    _current_timer.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block of code as a named stage of the current request.
+    Outside of a timed request this is a no-op.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(name, time.perf_counter() - start)
+
+
+class RequestProfiler:
+    """
+    Opt-in sampling profiler.
+    Profiles one in every `sample_rate` requests (0 disables sampling) and, when
+    `header_enabled` is set, any request carrying the profile header. Profiles are
+    aggregated per process and a hot-path report is written every `report_every`
+    profiled requests.
+    """
+
+    def __init__(self, sample_rate: int = 0, header_enabled: bool = False,
+                 report_dir: str = "profiles", report_every: int = 50):
+        self.sample_rate = sample_rate
+        self.header_enabled = header_enabled
+        self.report_dir = report_dir
+        self.report_every = max(1, report_every)
+        self._requests = 0
+        self._profiled = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.header_enabled
+
+    def should_profile(self, header_value: Optional[str]) -> bool:
+        if self.header_enabled and header_value == "1":
+            return True
+        if self.sample_rate > 0:
+            self._requests += 1
+            return self._requests % self.sample_rate == 0
+        return False
+
+    def start(self, header_value: Optional[str] = None):
+        """
+        Start profiling the current request if it is selected.
+        Returns the running profile, or None.
+        """
+        if not self.enabled or not self.should_profile(header_value):
+            return None
+
+        # Deferred import: the profiler is only loaded once a request is sampled
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profile
+
+    def finish(self, profile) -> None:
+        if profile is None:
+            return
+        profile.disable()
+
+        import pstats
+
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._profiled += 1
+            if self._profiled % self.report_every == 0:
+                self._write_report()
+
+    def _write_report(self) -> None:
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            base = os.path.join(self.report_dir, f"profile-{os.getpid()}")
+            self._stats.dump_stats(f"{base}.prof")
+            with open(f"{base}.txt", "w") as f:
+                self._stats.stream = f
+                f.write(f"Aggregated profile of {self._profiled} requests\n")
+                self._stats.sort_stats("cumulative").print_stats(40)
+            logger.info(f"Wrote profile report for {self._profiled} requests to {base}.txt")
+        except OSError as e:
+            logger.error(f"Error writing profile report: {str(e)}")
+
+
+# Process-wide profiler configured from the environment
+profiler = RequestProfiler(
+    sample_rate=Config.PROFILE_SAMPLE_RATE,
+    header_enabled=Config.PROFILE_HEADER_ENABLED,
+    report_dir=Config.PROFILE_DIR,
+    report_every=Config.PROFILE_REPORT_EVERY,
+)
+
+
+def init_app(app) -> None:
+    """
+    Time every request of a Flask app, emit a Server-Timing header and run
+    the sampling profiler.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _begin_timing():
+        g._stage_timer, g._stage_token = begin()
+        g._profile = profiler.start(request.headers.get(PROFILE_HEADER))
+
+    @app.after_request
+    def _emit_server_timing(response):
+        timer = g.get("_stage_timer")
+        if timer is not None and Config.SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = timer.server_timing()
+        return response
+
+    @app.teardown_request
+    def _end_timing(exc):
+        profiler.finish(g.pop("_profile", None))
+        token = g.pop("_stage_token", None)
+        if token is not None:
+            end(token)
+        g.pop("_stage_timer", None)
@@ -0,0 +1,539 @@
+"""
+Compact binary snapshot of the tz transition tables.
+
+The snapshot holds, for every zone, its UTC transition instants (int64 epoch
+seconds), UTC offsets and DST amounts (int32 seconds) and abbreviation ids
+(uint16) into an interned string table. Workers memory-map the file read-only,
+so every process shares one page-cache copy and startup costs a single mmap
+instead of loading tzdata files zone by zone.
+
+    python -m api.tzsnapshot build       # generate from the installed pytz data
+    python -m api.tzsnapshot validate    # compare a snapshot against pytz
+
+Workers poll the snapshot file (every TZ_RELOAD_INTERVAL seconds) and swap in a
+rebuilt one without a restart; see reload_tz_tables().
+
+Lookups mirror pytz's fromutc(): the entry in effect is the last transition at
+or before the instant, and instants before the first transition use the first
+entry.
+"""
+import os
+import sys
+import mmap
+import struct
+import bisect
+import logging
+import time
+import threading
+from array import array
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .config import Config
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TZSNAP01"
+FORMAT_VERSION = 1
+
+# magic, format version, byte order mark, zone count, table count, transition
+# count, abbreviation count, string table size, tz version, then the byte
+# offsets of the seven sections
+_HEADER = struct.Struct("<8sIIIIIII16s7Q")
+_ZONE_ENTRY = struct.Struct("<IHHII")  # name offset, name length, pad, first transition, count
+_ABBREV_ENTRY = struct.Struct("<II")  # string offset, length
+_BYTE_ORDER_MARK = 0x01020304
+
+EPOCH = datetime(1970, 1, 1)
+
+# pytz uses datetime(1, 1, 1) as the first transition of every zone
+MIN_INSTANT = -62135596800
+
+# How a local time is resolved when it occurs twice (clocks set back) or not at
+# all (clocks set forward)
+AMBIGUOUS_POLICIES = ("earlier", "later", "raise")
+NONEXISTENT_POLICIES = ("forward", "backward", "raise")
+
+# Offsets are sampled this far either side of a local time; no zone changes its
+# offset twice within a day
+_LOCAL_WINDOW = 86400
+
+
+class AmbiguousTimeError(ValueError):
+    """A local time that occurs twice in its zone, with the "raise" policy."""
+
+
+class NonExistentTimeError(ValueError):
+    """A local time skipped over in its zone, with the "raise" policy."""
+
+
+def to_epoch(dt: datetime) -> int:
+    """
+    Whole epoch seconds (floored) for a naive UTC or an aware datetime.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+
+def _wall_string(wall: int) -> str:
+    return (EPOCH + timedelta(seconds=wall)).isoformat()
+
+
+@lru_cache(maxsize=None)
+def fixed_offset(seconds: int) -> timezone:
+    """
+    Shared fixed-offset tzinfo for a UTC offset in seconds.
+    """
+    return timezone(timedelta(seconds=seconds))
+
+
+def _zone_tables(zone) -> Tuple[list, list, list, list]:
+    """
+    Return (transitions, offsets, dst, abbreviations) for a pytz zone.
+    """
+    if hasattr(zone, "_utc_transition_times"):
+        transitions = [to_epoch(t) for t in zone._utc_transition_times]
+        offsets = [int(info[0].total_seconds()) for info in zone._transition_info]
+        dst = [int(info[1].total_seconds()) for info in zone._transition_info]
+        abbrevs = [info[2] for info in zone._transition_info]
+    else:
+        # StaticTzInfo and UTC: a single entry in effect for all time
+        transitions = [MIN_INSTANT]
+        offsets = [int(zone.utcoffset(None).total_seconds())]
+        dst = [0]
+        abbrevs = [zone.tzname(None)]
+    return transitions, offsets, dst, abbrevs
+
+
+def _align(buf: bytearray, boundary: int = 8) -> int:
+    buf.extend(b"\0" * (-len(buf) % boundary))
+    return len(buf)
+
+
+def build_snapshot() -> bytes:
+    """
+    Serialize the installed pytz data into the snapshot format.
+    Zones with identical tables (links such as US/Eastern) share one table.
+    """
+    import pytz
+
+    strings = bytearray()
+    string_offsets: Dict[str, int] = {}
+
+    def intern(value: str) -> Tuple[int, int]:
+        encoded = value.encode("utf-8")
+        if value not in string_offsets:
+            string_offsets[value] = len(strings)
+            strings.extend(encoded)
+        return string_offsets[value], len(encoded)
+
+    abbrev_ids: Dict[str, int] = {}
+    transitions = array("q")
+    offsets = array("i")
+    dst = array("i")
+    abbrevs = array("H")
+    tables: Dict[Tuple, Tuple[int, int]] = {}
+    zone_entries = []
+
+    for name in pytz.all_timezones:
+        zone_transitions, zone_offsets, zone_dst, zone_abbrevs = _zone_tables(pytz.timezone(name))
+        abbrev_idx = [abbrev_ids.setdefault(a, len(abbrev_ids)) for a in zone_abbrevs]
+        key = (tuple(zone_transitions), tuple(zone_offsets), tuple(zone_dst), tuple(abbrev_idx))
+        if key not in tables:
+            tables[key] = (len(transitions), len(zone_transitions))
+            transitions.extend(zone_transitions)
+            offsets.extend(zone_offsets)
+            dst.extend(zone_dst)
+            abbrevs.extend(abbrev_idx)
+        start, count = tables[key]
+        name_offset, name_length = intern(name)
+        zone_entries.append(_ZONE_ENTRY.pack(name_offset, name_length, 0, start, count))
+
+    abbrev_entries = [_ABBREV_ENTRY.pack(*intern(a)) for a in abbrev_ids]
+
+    for values in (transitions, offsets, dst, abbrevs):
+        if sys.byteorder != "little":
+            values.byteswap()
+
+    body = bytearray(b"\0" * _HEADER.size)
+    sections = []
+    for chunk in (b"".join(zone_entries), transitions.tobytes(), offsets.tobytes(),
+                  dst.tobytes(), abbrevs.tobytes(), b"".join(abbrev_entries)):
+        sections.append(_align(body))
+        body.extend(chunk)
+    strings_offset = _align(body)
+    body.extend(strings)
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, _BYTE_ORDER_MARK, len(zone_entries), len(tables), len(transitions),
+        len(abbrev_ids), len(strings), pytz.OLSON_VERSION.encode("ascii"),
+        *sections, strings_offset,
+    )
+    body[:_HEADER.size] = header
+    return bytes(body)
+
+
+class TzSnapshot:
+    """
+    Read-only view of a snapshot buffer (an mmap or bytes).
+    The arrays are memoryview casts over the buffer, so nothing is copied.
+    """
+
+    def __init__(self, buffer, source: str = "<memory>"):
+        self.source = source
+        self._buffer = buffer
+        view = memoryview(buffer)
+        (magic, fmt, bom, zone_count, table_count, transition_count, abbrev_count,
+         strings_size, version, zones_at, transitions_at, offsets_at, dst_at, abbrevs_at,
+         abbrev_table_at, strings_at) = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"{source} is not a tz snapshot (format {FORMAT_VERSION})")
+        if bom != _BYTE_ORDER_MARK or sys.byteorder != "little":
+            raise ValueError(f"{source} byte order does not match this platform")
+
+        self.version = version.rstrip(b"\0").decode("ascii")
+        self.table_count = table_count
+        self.transitions = view[transitions_at:transitions_at + 8 * transition_count].cast("q")
+        self.offsets = view[offsets_at:offsets_at + 4 * transition_count].cast("i")
+        self.dst = view[dst_at:dst_at + 4 * transition_count].cast("i")
+        self.abbrev_ids = view[abbrevs_at:abbrevs_at + 2 * transition_count].cast("H")
+
+        strings = view[strings_at:strings_at + strings_size]
+        self.abbreviations = tuple(
+            sys.intern(bytes(strings[off:off + length]).decode("utf-8"))
+            for off, length in _ABBREV_ENTRY.iter_unpack(view[abbrev_table_at:abbrev_table_at + 8 * abbrev_count])
+        )
+        self.zones: Dict[str, Tuple[int, int]] = {}
+        for name_off, name_len, _, start, count in _ZONE_ENTRY.iter_unpack(
+                view[zones_at:zones_at + _ZONE_ENTRY.size * zone_count]):
+            name = sys.intern(bytes(strings[name_off:name_off + name_len]).decode("utf-8"))
+            self.zones[name] = (start, count)
+
+    def __contains__(self, zone: str) -> bool:
+        return zone in self.zones
+
+    def index_at(self, zone: str, epoch: int) -> int:
+        """
+        Position in the flat arrays of the entry in effect at `epoch` for `zone`.
+        """
+        start, count = self.zones[zone]
+        idx = bisect.bisect_right(self.transitions, epoch, start, start + count) - 1
+        return idx if idx >= start else start
+
+    def lookup(self, zone: str, epoch: int) -> Tuple[int, int, str]:
+        """
+        Return (utc offset seconds, dst seconds, abbreviation) in effect at `epoch`.
+        """
+        idx = self.index_at(zone, epoch)
+        return self.offsets[idx], self.dst[idx], self.abbreviations[self.abbrev_ids[idx]]
+
+    def resolve_local(self, zone: str, wall: int, ambiguous: str = "earlier",
+                      nonexistent: str = "forward") -> int:
+        """
+        Return the UTC epoch at which the clocks in `zone` show `wall`, a local
+        time in epoch seconds counted as if it were UTC.
+
+        The answer comes from the offsets in effect either side of `wall`: at most
+        two instants can show a given local time. When both do (clocks set back),
+        "earlier" picks the first and "later" the second. When neither does (clocks
+        set forward), "forward" reads the time with the offset from before the
+        change, landing after the gap, and "backward" with the offset from after
+        it, landing before the gap. "raise" raises AmbiguousTimeError or
+        NonExistentTimeError instead.
+        """
+        offsets = self.offsets
+        before = offsets[self.index_at(zone, wall - _LOCAL_WINDOW)]
+        after = offsets[self.index_at(zone, wall + _LOCAL_WINDOW)]
+        if before == after:
+            # No offset change nearby (the common case): one instant
+            epoch = wall - before
+            if offsets[self.index_at(zone, epoch)] == before:
+                return epoch
+        candidates = sorted(epoch for epoch in {wall - before, wall - after}
+                            if offsets[self.index_at(zone, epoch)] == wall - epoch)
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates:
+            if ambiguous == "raise":
+                raise AmbiguousTimeError(f"Local time {_wall_string(wall)} is ambiguous in {zone}")
+            return candidates[-1] if ambiguous == "later" else candidates[0]
+        if nonexistent == "raise":
+            raise NonExistentTimeError(f"Local time {_wall_string(wall)} does not exist in {zone}")
+        return wall - (after if nonexistent == "backward" else before)
+
+    def zone_transitions(self, zone: str) -> Iterator[Tuple[int, int, int, str]]:
+        """
+        Yield (instant, utc offset, dst, abbreviation) for every transition of `zone`.
+        """
+        start, count = self.zones[zone]
+        for idx in range(start, start + count):
+            yield (self.transitions[idx], self.offsets[idx], self.dst[idx],
+                   self.abbreviations[self.abbrev_ids[idx]])
+
+
+def write_snapshot(path: str) -> TzSnapshot:
+    data = build_snapshot()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return TzSnapshot(data, path)
+
+
+def open_snapshot(path: str) -> TzSnapshot:
+    """
+    Memory-map a snapshot file read-only.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return TzSnapshot(mapped, path)
+
+
+def validate_snapshot(snapshot: TzSnapshot) -> int:
+    """
+    Compare the snapshot with pytz at, just before and just after every transition
+    of every zone. Returns the number of mismatches (0 means identical).
+    """
+    import pytz
+
+    mismatches = 0
+    for name in pytz.all_timezones:
+        zone = pytz.timezone(name)
+        if name not in snapshot:
+            logger.error(f"Zone missing from snapshot: {name}")
+            mismatches += 1
+            continue
+        transitions = _zone_tables(zone)[0]
+        for instant in transitions:
+            for epoch in (instant - 1, instant, instant + 1):
+                if epoch < MIN_INSTANT:
+                    continue
+                utc_dt = EPOCH + timedelta(seconds=epoch)
+                try:
+                    local = pytz.utc.localize(utc_dt).astimezone(zone)
+                except OverflowError:
+                    # Local time before year 1; not representable by either side
+                    continue
+                expected = (int(local.utcoffset().total_seconds()), int(local.dst().total_seconds()), local.tzname())
+                if snapshot.lookup(name, epoch) != expected:
+                    logger.error(f"Mismatch for {name} at {utc_dt}: {snapshot.lookup(name, epoch)} != {expected}")
+                    mismatches += 1
+    return mismatches
+
+
+_tables: Optional[TzSnapshot] = None
+_tables_lock = threading.Lock()
+
+# Cache keys name zones through these strings; a zone whose rules change on reload
+# gets a new one ("Europe/Kyiv#2"), so only its cached results stop matching
+_zone_keys: Dict[str, str] = {}
+_generations: Dict[str, int] = {}
+
+# Snapshot file identity (inode, mtime, size) the current tables were loaded from
+_loaded_stat: Optional[Tuple[int, int, int]] = None
+_reload_listeners: List[Callable[[TzSnapshot], None]] = []
+_watcher: Optional[threading.Thread] = None
+_watcher_pid: Optional[int] = None
+
+
+def tz_version() -> str:
+    import pytz
+    return pytz.OLSON_VERSION
+
+
+def get_tz_tables() -> TzSnapshot:
+    """
+    Return the process-wide transition tables: the memory-mapped snapshot when it
+    exists and is at least as new as the installed tz data, otherwise tables built
+    in-process. A background thread swaps in newer snapshots as they appear.
+    """
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                _tables = _load_tables()
+    if _watcher_pid != os.getpid() and Config.TZ_RELOAD_INTERVAL > 0:
+        _start_watcher()
+    return _tables
+
+
+def zone_cache_key(zone: str) -> str:
+    """
+    The name to use for `zone` in cache keys; it changes when the zone's rules do.
+    """
+    return _zone_keys.get(zone, zone)
+
+
+def on_reload(listener: Callable[[TzSnapshot], None]) -> None:
+    """
+    Call listener(new_tables) after every reload, e.g. to rebuild derived indexes.
+    """
+    _reload_listeners.append(listener)
+
+
+def _snapshot_stat(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _usable(snapshot: TzSnapshot) -> bool:
+    # Snapshots built from newer tz data than the installed pytz are how updates
+    # reach running workers; older ones are ignored
+    if snapshot.version >= tz_version():
+        return True
+    logger.warning(f"Ignoring tz snapshot {snapshot.source} built for tz {snapshot.version}")
+    return False
+
+
+def _load_tables() -> TzSnapshot:
+    global _loaded_stat
+    path = Config.TZ_SNAPSHOT_PATH
+    stat = _snapshot_stat(path)
+    if stat is not None:
+        try:
+            snapshot = open_snapshot(path)
+            if _usable(snapshot):
+                _loaded_stat = stat
+                return snapshot
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable tz snapshot {path}: {str(e)}")
+    _loaded_stat = stat
+    logger.info("Building tz tables in-process")
+    return TzSnapshot(build_snapshot())
+
+
+def changed_zones(old: TzSnapshot, new: TzSnapshot) -> List[str]:
+    """
+    Zones added, removed, or whose transitions, offsets, DST amounts or
+    abbreviations differ between two snapshots.
+    """
+    def table(snapshot: TzSnapshot, zone: str) -> Tuple:
+        start, count = snapshot.zones[zone]
+        end = start + count
+        return (snapshot.transitions[start:end].tobytes(), snapshot.offsets[start:end].tobytes(),
+                snapshot.dst[start:end].tobytes(),
+                tuple(snapshot.abbreviations[i] for i in snapshot.abbrev_ids[start:end]))
+
+    changed = [zone for zone in old.zones if zone not in new.zones]
+    for zone in new.zones:
+        if zone not in old.zones or table(old, zone) != table(new, zone):
+            changed.append(zone)
+    return changed
+
+
+def reload_tz_tables(force: bool = False) -> List[str]:
+    """
+    Load the snapshot file if it changed since the current tables were loaded,
+    swap it in and return the zones whose rules changed. The swap is a single
+    reference assignment, so requests see either the old or the new tables.
+    """
+    global _tables, _loaded_stat
+    path = Config.TZ_SNAPSHOT_PATH
+    stat = _snapshot_stat(path)
+    if stat is None or (stat == _loaded_stat and not force):
+        return []
+    old = get_tz_tables()
+    try:
+        new = open_snapshot(path)
+    except (OSError, ValueError) as e:
+        # Possibly caught mid-write; the next poll tries again
+        logger.warning(f"Could not reload tz snapshot {path}: {str(e)}")
+        metrics.TZ_RELOAD_COUNT.inc("failed")
+        return []
+    if not _usable(new):
+        _loaded_stat = stat
+        metrics.TZ_RELOAD_COUNT.inc("ignored")
+        return []
+
+    changed = changed_zones(old, new)
+    with _tables_lock:
+        for zone in changed:
+            generation = _generations[zone] = _generations.get(zone, 0) + 1
+            _zone_keys[zone] = f"{zone}#{generation}"
+        _tables = new
+        _loaded_stat = stat
+    metrics.TZ_RELOAD_COUNT.inc("applied")
+    metrics.TZ_ZONES_CHANGED_COUNT.inc(amount=len(changed))
+    logger.info(f"Loaded tz {new.version} from {path} (was {old.version}); "
+                f"{len(changed)} zones changed")
+    for listener in _reload_listeners:
+        try:
+            listener(new)
+        except Exception as e:
+            logger.error(f"tz reload listener failed: {str(e)}")
+    return changed
+
+
+def _watch_loop() -> None:
+    while True:
+        time.sleep(Config.TZ_RELOAD_INTERVAL)
+        try:
+            reload_tz_tables()
+        except Exception as e:
+            logger.error(f"tz snapshot reload failed: {str(e)}")
+
+
+def _start_watcher() -> None:
+    global _watcher, _watcher_pid
+    with _tables_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+        _watcher = threading.Thread(target=_watch_loop, name="tz-reload", daemon=True)
+    _watcher.start()
+
+
+def _reinit_after_fork() -> None:
+    global _tables_lock, _watcher, _watcher_pid
+    # The watcher thread does not survive fork; a lock held by it would never be released
+    _tables_lock = threading.Lock()
+    _watcher = None
+    _watcher_pid = None
+
+
+def active_tz_version() -> Optional[str]:
+    """
+    tz version of the tables currently served, or None before they are loaded.
+    """
+    return _tables.version if _tables is not None else None
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
+metrics.register_tz_version(active_tz_version)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or validate the tz snapshot.")
+    parser.add_argument("command", choices=("build", "validate"))
+    parser.add_argument("--path", default=Config.TZ_SNAPSHOT_PATH)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if args.command == "build":
+        snapshot = write_snapshot(args.path)
+    else:
+        snapshot = open_snapshot(args.path)
+        if snapshot.version != tz_version():
+            print(f"{args.path} was built for tz {snapshot.version}, installed is {tz_version()}")
+            return 1
+
+    mismatches = validate_snapshot(snapshot)
+    size = os.path.getsize(args.path)
+    print(f"{args.path}: tz {snapshot.version}, {len(snapshot.zones)} zones, "
+          f"{snapshot.table_count} distinct tables, {len(snapshot.transitions)} transitions, "
+          f"{size} bytes, {mismatches} mismatches against pytz")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
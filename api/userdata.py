@@ -0,0 +1,336 @@
+"""
+Per-user favorite zones and recent conversions (UserProfile in api/models.py).
+
+Requests never write to the user store themselves. They append an event to an
+in-memory buffer (a deque, so appending is O(1) under a lock held only for the
+append) and a background thread moves the buffered events into the store in
+batches every ACTIVITY_FLUSH_INTERVAL seconds, or sooner once
+ACTIVITY_BATCH_SIZE events are waiting. Once ACTIVITY_BUFFER_SIZE events are
+waiting, new conversions are dropped and counted; favorite changes are always
+kept, since the user was told they happened. Recording a conversion costs
+/convert one append however slow the store is.
+
+The USER_MAX_FAVORITES cap is applied where events are applied, in buffer
+order, so of two concurrent adds past the cap exactly one is rejected, and
+the view the adding request reads back tells it which.
+
+The store keeps users' data in memory, like the user database it sits next
+to; a real database would replace UserDataStore.apply(). Reads never wait for
+the writer: they copy the user's stored data and replay that user's events
+still in the buffer on top, so users always see their own changes.
+"""
+import os
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import engine, metrics
+from .config import Config
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# The popular zones, shown on dashboards until the user picks favorites
+DEFAULT_ZONES = (
+    "America/New_York", "America/Los_Angeles", "America/Chicago",
+    "Europe/London", "Europe/Paris", "Europe/Berlin",
+    "Asia/Tokyo", "Asia/Shanghai", "Asia/Dubai",
+    "Australia/Sydney", "Pacific/Auckland",
+)
+
+# Event kinds in the buffer: (kind, username, payload)
+CONVERSION = "conversion"
+FAVORITE = "favorite"
+UNFAVORITE = "unfavorite"
+
+DROPPED_COUNT = metrics.REGISTRY.counter(
+    "timesync_user_events_dropped_total", "Conversions left out of user history because the buffer was full.")
+REJECTED_COUNT = metrics.REGISTRY.counter(
+    "timesync_user_favorites_rejected_total", "Favorite zones not added because the user had the maximum.")
+FLUSHED_COUNT = metrics.REGISTRY.counter(
+    "timesync_user_events_flushed_total", "User activity events written to the user store.")
+
+
+class UserData:
+    """
+    One user's favorite zones (in the order they were added) and most recent
+    conversions (newest first).
+    """
+
+    __slots__ = ("favorites", "recent")
+
+    def __init__(self, history_size: int):
+        self.favorites: List[str] = []
+        self.recent: deque = deque(maxlen=history_size)
+
+    def apply(self, kind: str, payload, max_favorites: int) -> bool:
+        """
+        Apply one event. Returns False when a favorite is refused by the cap.
+        """
+        if kind == CONVERSION:
+            self.recent.appendleft(payload)
+        elif kind == FAVORITE:
+            if payload not in self.favorites:
+                if len(self.favorites) >= max_favorites:
+                    return False
+                self.favorites.append(payload)
+        elif kind == UNFAVORITE and payload in self.favorites:
+            self.favorites.remove(payload)
+        return True
+
+    def recent_conversions(self) -> List[Dict]:
+        """
+        The recent conversions, newest first, as TimeConversionResponse dicts.
+        """
+        # Results are formatted on read; the buffer and store hold the compact records
+        return [_conversion_entry(result) for result in self.recent]
+
+
+class UserDataStore:
+    """
+    User data by username; every batch of events is applied under one lock.
+    """
+
+    def __init__(self, history_size: int = 20, max_favorites: int = 20):
+        self.history_size = history_size
+        self.max_favorites = max_favorites
+        self._users: Dict[str, UserData] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def _user(self, username: str) -> UserData:
+        data = self._users.get(username)
+        if data is None:
+            data = self._users[username] = UserData(self.history_size)
+        return data
+
+    def apply(self, events: Iterable[Tuple]) -> int:
+        """
+        Apply events, consuming the iterable under the store lock. Returns the
+        number applied.
+        """
+        applied = 0
+        rejected = 0
+        with self._lock:
+            for kind, username, payload in events:
+                if not self._user(username).apply(kind, payload, self.max_favorites):
+                    rejected += 1
+                applied += 1
+        if rejected:
+            REJECTED_COUNT.inc(amount=rejected)
+        return applied
+
+    def view(self, username: str, pending: Callable[[], Tuple]) -> UserData:
+        """
+        A copy of the user's data with their events among pending() applied on top.
+        """
+        view = UserData(self.history_size)
+        with self._lock:
+            data = self._users.get(username)
+            if data is not None:
+                view.favorites.extend(data.favorites)
+                view.recent.extend(data.recent)
+            # Taken while the store is locked: flushes take events out of the
+            # buffer under the same lock, so each one is either stored or copied here
+            events = pending()
+        for kind, name, payload in events:
+            if name == username:
+                view.apply(kind, payload, self.max_favorites)
+        return view
+
+
+def _conversion_entry(result) -> Dict:
+    converted = result.to_dict()
+    return {
+        "original_timestamp": converted.get("source_timestamp", converted["utc_timestamp"]),
+        "converted_timestamp": converted["local_timestamp"],
+        "source_timezone": result.source_zone or "UTC",
+        "target_timezone": result.zone,
+        "offset": converted["offset"],
+        "is_dst": converted["is_dst"],
+    }
+
+
+class ActivityRecorder:
+    """
+    Write-behind buffer in front of a UserDataStore.
+    """
+
+    def __init__(self, store: UserDataStore, capacity: int = 10000, batch_size: int = 500,
+                 interval: float = 1.0):
+        self.store = store
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer: deque = deque()
+        # Held for every append, copy and batch removal, so none of them relies on
+        # deque operations being atomic (they are not without the GIL)
+        self._buffer_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # Serializes flushes so batches reach the store in the order they were recorded
+        self._flush_lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def _record(self, event: Tuple) -> None:
+        buffer = self._buffer
+        with self._buffer_lock:
+            # Only history is dropped; the buffer can exceed capacity by favorite changes
+            dropped = event[0] == CONVERSION and len(buffer) >= self.capacity
+            if not dropped:
+                buffer.append(event)
+        if dropped:
+            DROPPED_COUNT.inc()
+            return
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def record_conversion(self, username: str, result) -> None:
+        """
+        Add a ConversionResult to the user's recent conversions.
+        """
+        self._record((CONVERSION, username, result))
+
+    def add_favorite(self, username: str, zone: str) -> None:
+        self._record((FAVORITE, username, zone))
+
+    def remove_favorite(self, username: str, zone: str) -> None:
+        self._record((UNFAVORITE, username, zone))
+
+    def view(self, username: str) -> UserData:
+        """
+        The user's data including their events not written to the store yet.
+        Does not wait for or trigger a flush.
+        """
+        return self.store.view(username, self._snapshot)
+
+    def _snapshot(self) -> Tuple:
+        with self._buffer_lock:
+            return tuple(self._buffer)
+
+    def _take(self, count: int):
+        # A generator, so the batch is only removed once the store iterates it under its lock
+        buffer = self._buffer
+        with self._buffer_lock:
+            batch = [buffer.popleft() for _ in range(min(count, len(buffer)))]
+        yield from batch
+
+    def flush(self) -> int:
+        """
+        Write every buffered event to the store. Returns the number written.
+        """
+        written = 0
+        with self._flush_lock:
+            while self._buffer:
+                # Events leave the buffer while the store applies them, under its lock
+                written += self.store.apply(self._take(self.batch_size))
+        if written:
+            FLUSHED_COUNT.inc(amount=written)
+        return written
+
+    def _start_writer(self) -> None:
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            # A forked child inherits the flag but not the thread
+            self._writer = threading.Thread(target=self._write_loop, name="user-activity", daemon=True)
+            self._writer_pid = os.getpid()
+        self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Flushing user activity failed: {str(e)}")
+
+    def _after_fork(self) -> None:
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._writer = None
+
+
+store = UserDataStore(Config.USER_HISTORY_SIZE, Config.USER_MAX_FAVORITES)
+recorder = ActivityRecorder(store, Config.ACTIVITY_BUFFER_SIZE, Config.ACTIVITY_BATCH_SIZE,
+                            Config.ACTIVITY_FLUSH_INTERVAL)
+
+os.register_at_fork(after_in_child=recorder._after_fork)
+metrics.REGISTRY.gauge_func(
+    "timesync_user_events_pending", "User activity events waiting to be written.", lambda: recorder.pending)
+
+
+def favorites(username: str) -> List[str]:
+    return recorder.view(username).favorites
+
+
+def add_favorite(username: str, zone: str) -> Optional[List[str]]:
+    """
+    Add a favorite zone. Returns the user's favorites, or None when the zone was
+    refused because they already have USER_MAX_FAVORITES.
+    """
+    recorder.add_favorite(username, zone)
+    favorite_zones = favorites(username)
+    return favorite_zones if zone in favorite_zones else None
+
+
+def remove_favorite(username: str, zone: str) -> List[str]:
+    """
+    Remove a favorite zone. Returns the user's remaining favorites.
+    """
+    recorder.remove_favorite(username, zone)
+    return favorites(username)
+
+
+def _dashboard(username: str, data: UserData, timezones: List[Dict]) -> Dict:
+    return {
+        "username": username,
+        "favorite_timezones": data.favorites,
+        "timezones": timezones,
+        "recent_conversions": data.recent_conversions(),
+    }
+
+
+def dashboard(username: str) -> Dict:
+    """
+    Everything the dashboard shows for a user in one response: current details
+    of their favorite zones (the popular ones until they pick some) and their
+    recent conversions.
+    """
+    data = recorder.view(username)
+    timezones = []
+    for zone in data.favorites or DEFAULT_ZONES:
+        try:
+            # Shared by every user for TIMEZONE_INFO_CACHE_TTL seconds
+            timezones.append(engine.zone_info(zone))
+        except engine.ConversionError:
+            # A favorite dropped from the tz data since it was added
+            continue
+    return _dashboard(username, data, timezones)
+
+
+async def adashboard(username: str) -> Dict:
+    """
+    dashboard() for asyncio callers.
+    """
+    data = recorder.view(username)
+    timezones = []
+    for zone in data.favorites or DEFAULT_ZONES:
+        try:
+            timezones.append(await engine.azone_info(zone))
+        except engine.ConversionError:
+            continue
+    return _dashboard(username, data, timezones)
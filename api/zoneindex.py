@@ -0,0 +1,193 @@
+"""
+Prebuilt timezone and country indexes.
+
+Building the zone list from pytz checks every zone file on disk and the country
+mapping parses zone.tab, which each worker would otherwise pay on its first
+request. The index is generated at build time into a JSON artifact:
+
+    python -m api.zoneindex build
+    python -m api.zoneindex check
+
+and loaded at runtime. If the artifact is missing or was built from different
+tz data, the index is rebuilt in-process instead.
+
+When a worker reloads newer tz tables (see api.tzsnapshot), the index follows
+them: it is reloaded from the artifact if that was rebuilt for the same tz
+version, and otherwise derived from the tables' zone list, in which case zones
+new in the tables have no country until the worker restarts.
+"""
+import json
+import os
+import sys
+import logging
+import threading
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from .config import Config
+from .tzsnapshot import on_reload
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+
+
+class ZoneIndex:
+    """
+    Zone names and country lookups for the installed tz data.
+    """
+
+    __slots__ = ("version", "zones", "zone_set", "zone_countries", "country_names")
+
+    def __init__(self, version: str, zones, zone_countries: Dict[str, str],
+                 country_names: Dict[str, str]):
+        self.version = version
+        self.zones: Tuple[str, ...] = tuple(zones)
+        self.zone_set: FrozenSet[str] = frozenset(self.zones)
+        self.zone_countries = zone_countries
+        self.country_names = country_names
+
+    def __contains__(self, zone: str) -> bool:
+        return zone in self.zone_set
+
+    def country_code(self, zone: str) -> Optional[str]:
+        return self.zone_countries.get(zone)
+
+    def to_dict(self) -> Dict:
+        return {
+            "format": INDEX_FORMAT,
+            "version": self.version,
+            "zones": list(self.zones),
+            "zone_countries": self.zone_countries,
+            "country_names": self.country_names,
+        }
+
+
+def tz_version() -> str:
+    import pytz
+    return pytz.OLSON_VERSION
+
+
+def build_index() -> ZoneIndex:
+    """
+    Build the index from the installed pytz data.
+    """
+    import pytz
+
+    # Keep the first country listing a zone, matching the previous linear scan
+    zone_countries: Dict[str, str] = {}
+    for code, timezones in pytz.country_timezones.items():
+        for zone in timezones:
+            zone_countries.setdefault(zone, code)
+
+    return ZoneIndex(
+        version=pytz.OLSON_VERSION,
+        zones=pytz.all_timezones,
+        zone_countries=zone_countries,
+        country_names=dict(pytz.country_names.items()),
+    )
+
+
+def save_index(index: ZoneIndex, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index.to_dict(), f, separators=(",", ":"), sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def load_index(path: str, version: Optional[str] = None) -> Optional[ZoneIndex]:
+    """
+    Load a prebuilt index for tz `version` (default: the installed one). Returns
+    None if it is missing, unreadable or stale.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if data.get("format") != INDEX_FORMAT or data.get("version") != (version or tz_version()):
+        logger.warning(f"Ignoring stale zone index at {path} (built for tz {data.get('version')})")
+        return None
+
+    return ZoneIndex(data["version"], data["zones"], data["zone_countries"], data["country_names"])
+
+
+_index: Optional[ZoneIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_zone_index() -> ZoneIndex:
+    """
+    Return the process-wide index, loading the artifact or building it on first use.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = load_index(Config.ZONE_INDEX_PATH)
+                if index is None:
+                    logger.info("Building zone index in-process")
+                    index = build_index()
+                _index = index
+    return _index
+
+
+def index_for_tables(index: ZoneIndex, tables) -> ZoneIndex:
+    """
+    `index` with its zones replaced by those of reloaded tz tables. Country data
+    is kept for the zones that remain.
+    """
+    zones = sorted(tables.zones)
+    zone_countries = {zone: code for zone, code in index.zone_countries.items() if zone in tables.zones}
+    return ZoneIndex(tables.version, zones, zone_countries, index.country_names)
+
+
+def _follow_reload(tables) -> None:
+    # Runs on the tz reload thread before the indexes derived from this one
+    # (search, registry, offsets) are rebuilt by their own listeners
+    global _index
+    index = _index
+    if index is None or (index.version == tables.version and index.zone_set == tables.zones.keys()):
+        return
+    new_index = load_index(Config.ZONE_INDEX_PATH, tables.version)
+    if new_index is None or new_index.zone_set != tables.zones.keys():
+        new_index = index_for_tables(index, tables)
+    added = len(new_index.zone_set - index.zone_set)
+    removed = len(index.zone_set - new_index.zone_set)
+    # One reference assignment; validation sees the old or the new zones
+    _index = new_index
+    logger.info(f"Zone index follows tz {tables.version}: {added} zones added, {removed} removed")
+
+
+on_reload(_follow_reload)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or check the prebuilt zone index.")
+    parser.add_argument("command", choices=("build", "check"))
+    parser.add_argument("--path", default=Config.ZONE_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = build_index()
+        save_index(index, args.path)
+        print(f"Wrote {len(index.zones)} zones (tz {index.version}) to {args.path}")
+        return 0
+
+    index = load_index(args.path)
+    if index is None:
+        print(f"{args.path} is missing or stale")
+        return 1
+    if index.to_dict() != build_index().to_dict():
+        print(f"{args.path} does not match the installed tz data")
+        return 1
+    print(f"{args.path} is up to date ({len(index.zones)} zones, tz {index.version})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Stable integer ids for zone names, used by the binary batch protocol.
+
+A zone's id is its line number (from 0) in data/zone_registry.txt. The file is
+committed and only ever appended to, so an id keeps naming the same zone across
+deploys and tz data updates and clients can cache the registry indefinitely.
+After upgrading pytz, append any new zones with:
+
+    python -m api.zoneregistry build
+    python -m api.zoneregistry check
+
+Zones dropped from the tz data keep their ids; converting them reports an
+unknown zone. Zones added by reloaded tz tables get the next free ids in the
+worker, in the same order `build` would append them.
+"""
+import os
+import sys
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import Config
+from .tzsnapshot import on_reload
+from .zoneindex import get_zone_index
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Ids are sent as uint16
+MAX_ZONES = 65536
+
+
+class ZoneRegistry:
+    """
+    Zone names by id and ids by name.
+    """
+
+    __slots__ = ("zones", "ids", "_slices")
+
+    def __init__(self, zones: Sequence[str]):
+        if len(zones) > MAX_ZONES:
+            raise ValueError(f"Zone registry holds {len(zones)} zones, ids only go up to {MAX_ZONES - 1}")
+        self.zones: Tuple[str, ...] = tuple(zones)
+        self.ids: Dict[str, int] = {zone: i for i, zone in enumerate(self.zones)}
+        self._slices = None
+
+    def __len__(self) -> int:
+        return len(self.zones)
+
+    def zone_id(self, zone: str) -> Optional[int]:
+        return self.ids.get(zone)
+
+    def slices(self, tables) -> List[Optional[Tuple[int, int]]]:
+        """
+        (start, end) of each id's entries in the flat arrays of `tables`, or None
+        for zones the tables do not have. Recomputed when the tables are reloaded.
+        """
+        cached = self._slices
+        if cached is None or cached[0] is not tables:
+            zones = tables.zones
+            slices = []
+            for zone in self.zones:
+                entry = zones.get(zone)
+                slices.append(None if entry is None else (entry[0], entry[0] + entry[1]))
+            cached = self._slices = (tables, slices)
+        return cached[1]
+
+    def to_dict(self) -> Dict:
+        return {"size": len(self.zones), "zones": list(self.zones)}
+
+
+def load_registry(path: str) -> Optional[List[str]]:
+    try:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    except OSError:
+        return None
+
+
+def save_registry(zones: Sequence[str], path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(f"{zone}\n" for zone in zones)
+    os.replace(tmp_path, path)
+
+
+def extend_registry(zones: Sequence[str], installed: Sequence[str]) -> List[str]:
+    """
+    The registry with installed zones it lacks appended in sorted order; existing
+    ids never move.
+    """
+    known = set(zones)
+    return list(zones) + sorted(zone for zone in installed if zone not in known)
+
+
+_registry: Optional[ZoneRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_zone_registry() -> ZoneRegistry:
+    """
+    Return the process-wide registry, loading the committed file on first use.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                zones = load_registry(Config.ZONE_REGISTRY_PATH)
+                if zones is None:
+                    # Ids are only stable while the tz data stays the same
+                    logger.warning(f"Zone registry {Config.ZONE_REGISTRY_PATH} is missing; "
+                                   f"numbering the installed zones instead")
+                    zones = []
+                extended = extend_registry(zones, get_zone_index().zones)
+                if len(extended) > len(zones):
+                    logger.warning(f"{len(extended) - len(zones)} installed zones have no registry id; "
+                                   f"run python -m api.zoneregistry build")
+                _registry = ZoneRegistry(extended)
+    return _registry
+
+
+def _extend_after_reload(tables) -> None:
+    # The zone index listener ran first, so it already lists the new zones
+    global _registry
+    registry = _registry
+    if registry is None:
+        return
+    extended = extend_registry(registry.zones, get_zone_index().zones)
+    if len(extended) > len(registry):
+        _registry = ZoneRegistry(extended)
+        logger.warning(f"{len(extended) - len(registry)} zones from tz {tables.version} have no committed "
+                       f"registry id; run python -m api.zoneregistry build")
+
+
+on_reload(_extend_after_reload)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extend or check the zone id registry.")
+    parser.add_argument("command", choices=("build", "check"))
+    parser.add_argument("--path", default=Config.ZONE_REGISTRY_PATH)
+    args = parser.parse_args(argv)
+
+    zones = load_registry(args.path) or []
+    installed = get_zone_index().zones
+    extended = extend_registry(zones, installed)
+    added = len(extended) - len(zones)
+    if args.command == "build":
+        if added:
+            save_registry(extended, args.path)
+        print(f"Appended {added} zones to {args.path} ({len(extended)} ids)")
+        return 0
+
+    if added:
+        print(f"{args.path} lacks {added} installed zones")
+        return 1
+    print(f"{args.path} is up to date ({len(zones)} ids)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Zone search and autocomplete.
+
+A sorted term list is built once per zone index from zone names, their city and
+region components, country names and codes, and common aliases (abbreviations
+and former city names). A query is answered with a binary search for the
+terms it prefixes, so lookups touch only the matching slice of the index. A
+substring scan over the zone names is used only when prefix matches come up
+short.
+"""
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from .tzsnapshot import on_reload
+from .zoneindex import ZoneIndex, get_zone_index
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Match kinds, best first; a zone's score is its best kind plus small tie-breakers
+EXACT = 100
+ZONE_PREFIX = 90
+ALIAS = 80
+CITY_PREFIX = 70
+WORD_PREFIX = 60
+COUNTRY = 50
+SUBSTRING = 20
+
+# Common abbreviations, nicknames and former names
+ALIASES: Dict[str, Tuple[str, ...]] = {
+    "est": ("America/New_York",),
+    "edt": ("America/New_York",),
+    "eastern": ("America/New_York",),
+    "cst": ("America/Chicago", "Asia/Shanghai"),
+    "cdt": ("America/Chicago",),
+    "central": ("America/Chicago",),
+    "mst": ("America/Denver", "America/Phoenix"),
+    "mdt": ("America/Denver",),
+    "mountain": ("America/Denver",),
+    "pst": ("America/Los_Angeles",),
+    "pdt": ("America/Los_Angeles",),
+    "pacific": ("America/Los_Angeles",),
+    "akst": ("America/Anchorage",),
+    "hst": ("Pacific/Honolulu",),
+    "gmt": ("Europe/London", "Etc/GMT"),
+    "bst": ("Europe/London",),
+    "utc": ("UTC",),
+    "cet": ("Europe/Paris", "Europe/Berlin"),
+    "cest": ("Europe/Paris", "Europe/Berlin"),
+    "eet": ("Europe/Athens", "Europe/Helsinki"),
+    "msk": ("Europe/Moscow",),
+    "ist": ("Asia/Kolkata",),
+    "pkt": ("Asia/Karachi",),
+    "jst": ("Asia/Tokyo",),
+    "kst": ("Asia/Seoul",),
+    "hkt": ("Asia/Hong_Kong",),
+    "sgt": ("Asia/Singapore",),
+    "aest": ("Australia/Sydney", "Australia/Brisbane"),
+    "aedt": ("Australia/Sydney",),
+    "acst": ("Australia/Adelaide", "Australia/Darwin"),
+    "awst": ("Australia/Perth",),
+    "nzst": ("Pacific/Auckland",),
+    "nzdt": ("Pacific/Auckland",),
+    "nyc": ("America/New_York",),
+    "la": ("America/Los_Angeles",),
+    "san francisco": ("America/Los_Angeles",),
+    "sf": ("America/Los_Angeles",),
+    "seattle": ("America/Los_Angeles",),
+    "boston": ("America/New_York",),
+    "washington": ("America/New_York",),
+    "miami": ("America/New_York",),
+    "dallas": ("America/Chicago",),
+    "houston": ("America/Chicago",),
+    "beijing": ("Asia/Shanghai",),
+    "peking": ("Asia/Shanghai",),
+    "mumbai": ("Asia/Kolkata",),
+    "bombay": ("Asia/Kolkata",),
+    "calcutta": ("Asia/Kolkata",),
+    "delhi": ("Asia/Kolkata",),
+    "new delhi": ("Asia/Kolkata",),
+    "bangalore": ("Asia/Kolkata",),
+    "bengaluru": ("Asia/Kolkata",),
+    "saigon": ("Asia/Ho_Chi_Minh",),
+    "kiev": ("Europe/Kyiv", "Europe/Kiev"),
+    "rangoon": ("Asia/Yangon",),
+    "katmandu": ("Asia/Kathmandu",),
+    "madras": ("Asia/Kolkata",),
+    "sydney": ("Australia/Sydney",),
+    "dubai": ("Asia/Dubai",),
+    "frankfurt": ("Europe/Berlin",),
+    "munich": ("Europe/Berlin",),
+    "milan": ("Europe/Rome",),
+    "barcelona": ("Europe/Madrid",),
+    "geneva": ("Europe/Zurich",),
+    "osaka": ("Asia/Tokyo",),
+    "toronto": ("America/Toronto",),
+    "montreal": ("America/Toronto",),
+    "sao paulo": ("America/Sao_Paulo",),
+}
+
+# Zones people search for most; they win ties
+POPULAR = (
+    "America/New_York", "America/Los_Angeles", "America/Chicago",
+    "Europe/London", "Europe/Paris", "Europe/Berlin",
+    "Asia/Tokyo", "Asia/Shanghai", "Asia/Dubai", "Asia/Kolkata",
+    "Australia/Sydney", "Pacific/Auckland", "UTC",
+)
+_POPULAR_RANK = {zone: i for i, zone in enumerate(POPULAR)}
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase and treat underscores like spaces, so "new york" matches New_York.
+    """
+    return " ".join(text.lower().replace("_", " ").split())
+
+
+class ZoneSearchIndex:
+    """
+    Sorted search terms with, for each term, the zones it points to and how
+    strongly.
+    """
+
+    __slots__ = ("zones", "countries", "terms", "postings", "haystack", "starts")
+
+    def __init__(self, index: ZoneIndex):
+        self.zones: Tuple[str, ...] = index.zones
+        self.countries: List[Tuple[Optional[str], Optional[str]]] = []
+        postings: Dict[str, Dict[int, int]] = {}
+        zone_ids = {zone: i for i, zone in enumerate(self.zones)}
+
+        def add(term: str, zone_id: int, kind: int) -> None:
+            if term:
+                slot = postings.setdefault(term, {})
+                if slot.get(zone_id, 0) < kind:
+                    slot[zone_id] = kind
+
+        for zone_id, zone in enumerate(self.zones):
+            code = index.country_code(zone)
+            country = index.country_names.get(code) if code else None
+            self.countries.append((code, country))
+
+            name = normalize(zone)
+            add(name, zone_id, ZONE_PREFIX)
+            parts = name.split("/")
+            add(parts[-1], zone_id, CITY_PREFIX)
+            for part in parts[:-1]:
+                add(part, zone_id, WORD_PREFIX)
+            for part in parts:
+                for word in part.split(" "):
+                    add(word, zone_id, WORD_PREFIX)
+            if country:
+                add(normalize(country), zone_id, COUNTRY)
+                for word in normalize(country).split(" "):
+                    add(word, zone_id, COUNTRY)
+            if code:
+                add(code.lower(), zone_id, COUNTRY)
+
+        for alias, targets in ALIASES.items():
+            for zone in targets:
+                if zone in zone_ids:
+                    add(alias, zone_ids[zone], ALIAS)
+
+        self.terms: List[str] = sorted(postings)
+        self.postings: List[Tuple[Tuple[int, int], ...]] = [
+            tuple(postings[term].items()) for term in self.terms
+        ]
+        # All normalized names in one string, so substring matches are str.find calls
+        names = [normalize(zone) for zone in self.zones]
+        self.haystack = "\n".join(names)
+        self.starts: List[int] = []
+        position = 0
+        for name in names:
+            self.starts.append(position)
+            position += len(name) + 1
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+        """
+        Zones matching query, best first.
+        """
+        q = normalize(query)
+        if not q:
+            return []
+
+        scores: Dict[int, int] = {}
+        terms = self.terms
+        i = bisect_left(terms, q)
+        while i < len(terms) and terms[i].startswith(q):
+            exact = terms[i] == q
+            for zone_id, kind in self.postings[i]:
+                score = kind + (EXACT - ZONE_PREFIX if exact else 0)
+                if scores.get(zone_id, 0) < score:
+                    scores[zone_id] = score
+            i += 1
+
+        # Fall back to substring matches ("ork" in "america/new york") when short
+        if len(scores) < limit:
+            starts = self.starts
+            position = self.haystack.find(q)
+            while position >= 0:
+                zone_id = bisect_right(starts, position) - 1
+                scores.setdefault(zone_id, SUBSTRING)
+                if zone_id + 1 == len(starts):
+                    break
+                # Continue with the next name
+                position = self.haystack.find(q, starts[zone_id + 1])
+
+        ranked = heapq.nsmallest(
+            limit, scores.items(),
+            key=lambda item: (-item[1], _POPULAR_RANK.get(self.zones[item[0]], len(POPULAR)),
+                              len(self.zones[item[0]]), self.zones[item[0]]),
+        )
+        results = []
+        for zone_id, _ in ranked:
+            code, country = self.countries[zone_id]
+            results.append({"name": self.zones[zone_id], "country_code": code, "country": country})
+        return results
+
+
+_search_index: Optional[ZoneSearchIndex] = None
+_search_lock = threading.Lock()
+
+
+def get_search_index() -> ZoneSearchIndex:
+    """
+    Return the search index for the current zone index, building it on first use.
+    """
+    global _search_index
+    index = get_zone_index()
+    if _search_index is None or _search_index.zones is not index.zones:
+        with _search_lock:
+            if _search_index is None or _search_index.zones is not index.zones:
+                _search_index = ZoneSearchIndex(index)
+    return _search_index
+
+
+def _rebuild_after_reload(tables) -> None:
+    # Off the request path, like the offset index; the zone index listener ran first
+    if _search_index is not None:
+        get_search_index()
+
+
+on_reload(_rebuild_after_reload)
+
+
+def search_zones(query: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+    return get_search_index().search(query, max(1, min(limit, MAX_LIMIT)))
@@ -0,0 +1,57 @@
+import asyncio
+
+from fastapi import FastAPI, Request
+
+from api.config import Config
+from api import auth, logpipeline, timesync
+from api.offsetindex import get_offset_index
+from api.tzsnapshot import active_tz_version
+from api.zoneindex import get_zone_index
+from api.zonesearch import get_search_index
+
+# Records are queued and written by a background thread (see api/logpipeline.py)
+logpipeline.configure()
+
+# ASGI entry point serving the FastAPI routers (run with: uvicorn asgi:app)
+app = FastAPI(
+    title=Config.API_TITLE,
+    description=Config.API_DESCRIPTION,
+    version=Config.API_VERSION,
+)
+
+app.include_router(timesync.router, prefix="/api/timesync", tags=["timesync"])
+app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
+
+
+@app.middleware("http")
+async def add_request_id(request: Request, call_next):
+    # Tag log records with the request id and echo it in the response
+    request_id = request.headers.get(logpipeline.REQUEST_ID_HEADER) or logpipeline.new_request_id()
+    token = logpipeline.set_request_id(request_id[:64])
+    try:
+        response = await call_next(request)
+    finally:
+        logpipeline.reset_request_id(token)
+    response.headers[logpipeline.REQUEST_ID_HEADER] = request_id[:64]
+    return response
+
+
+@app.middleware("http")
+async def add_tz_version(request: Request, call_next):
+    # Report the tz database version responses were computed with
+    response = await call_next(request)
+    version = active_tz_version()
+    if version is not None:
+        response.headers["X-TZ-Version"] = version
+    return response
+
+
+def warmup():
+    """
+    Build the zone, search and offset indexes and pre-warm the popular timezone cache
+    before gunicorn forks workers (see gunicorn.conf.py).
+    """
+    get_zone_index()
+    get_search_index()
+    get_offset_index()
+    asyncio.run(timesync.get_popular_timezones())
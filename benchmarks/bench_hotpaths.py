@@ -0,0 +1,375 @@
+"""
+Microbenchmarks for the conversion and auth hot paths.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_hotpaths
+    python -m benchmarks.bench_hotpaths --filter convert
+    python -m benchmarks.bench_hotpaths --compare benchmarks/results/<commit>.json
+
+Results are written to benchmarks/results/<commit>.json so runs on different
+commits can be compared with --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# The HTTP cases send thousands of requests from one address; measure the
+# handlers, not the 429 path
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+# Representative zones: no DST, northern and southern DST, half-hour, 45-minute
+# and 30-minute-DST offsets
+ZONES = [
+    "UTC",
+    "America/New_York",
+    "Europe/London",
+    "Asia/Kolkata",
+    "Asia/Kathmandu",
+    "Australia/Lord_Howe",
+]
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+HIT_RATIOS = [0.0, 0.5, 0.9, 0.99]
+
+_CASES: List[Tuple[str, Callable[[], Callable[[], object]]]] = []
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark case. The decorated function performs any setup and
+    returns the zero-argument callable that is timed.
+    """
+    def register(setup):
+        _CASES.append((name, setup))
+        return setup
+    return register
+
+
+def _timestamps(count: int, start: datetime = datetime(2023, 1, 1, tzinfo=timezone.utc)) -> List[str]:
+    step = timedelta(minutes=37)
+    return [(start + step * i).strftime("%Y-%m-%dT%H:%M:%SZ") for i in range(count)]
+
+
+def _app():
+    import main
+    return main
+
+
+def _engine():
+    from api import engine
+    return engine
+
+
+for _zone in ZONES:
+    @benchmark(f"convert.miss[{_zone}]")
+    def _convert_miss(zone=_zone):
+        engine = _engine()
+        timestamps = _timestamps(1024)
+        state = {"i": 0}
+
+        def op():
+            state["i"] = (state["i"] + 1) % len(timestamps)
+            engine.time_cache.clear()
+            return engine.convert(timestamps[state["i"]], zone)
+        return op
+
+
+@benchmark("convert.hit")
+def _convert_hit():
+    engine = _engine()
+    engine.convert("2023-05-01T12:00:00Z", "America/New_York")
+    return lambda: engine.convert("2023-05-01T12:00:00Z", "America/New_York")
+
+
+for _ratio in HIT_RATIOS:
+    @benchmark(f"convert.hit_ratio[{_ratio}]")
+    def _convert_hit_ratio(ratio=_ratio):
+        engine = _engine()
+        hot = ("2023-05-01T12:00:00Z", "America/New_York")
+        cold = [(ts, ZONES[i % len(ZONES)]) for i, ts in enumerate(_timestamps(100))]
+        engine.convert(*hot)
+        # Seeded access pattern with the requested share of hits
+        rng = random.Random(42)
+        pattern = [rng.random() < ratio for _ in range(len(cold))]
+        state = {"i": 0}
+
+        def op():
+            i = state["i"] = (state["i"] + 1) % len(pattern)
+            if pattern[i]:
+                return engine.convert(*hot)
+            ts, zone = cold[i]
+            engine.time_cache.remove(f"convert:{ts}:{zone}")
+            return engine.convert(ts, zone)
+        return op
+
+
+@benchmark("cache.get_hit")
+def _cache_get_hit():
+    from api.cache import TimeCache
+    cache = TimeCache()
+    cache.set("key", {"value": 1}, 3600)
+    return lambda: cache.get("key")
+
+
+@benchmark("cache.get_miss")
+def _cache_get_miss():
+    from api.cache import TimeCache
+    cache = TimeCache()
+    return lambda: cache.get("missing")
+
+
+@benchmark("cache.set")
+def _cache_set():
+    from api.cache import TimeCache
+    cache = TimeCache()
+    keys = [f"convert:{ts}:UTC" for ts in _timestamps(1024)]
+    state = {"i": 0}
+
+    def op():
+        state["i"] = (state["i"] + 1) % len(keys)
+        cache.set(keys[state["i"]], {"value": 1}, 3600)
+    return op
+
+
+@benchmark("validate.timezone")
+def _validate_timezone():
+    from api.zoneindex import get_zone_index
+    # The membership test engine._check_zone and the routes run
+    index = get_zone_index()
+    return lambda: "Pacific/Auckland" in index
+
+
+@benchmark("tz.offset_lookup")
+def _offset_lookup():
+    from api.tzsnapshot import get_tz_tables
+    tables = get_tz_tables()
+    return lambda: tables.lookup("America/New_York", 1682942400)
+
+
+@benchmark("parse.timestamp[iso]")
+def _parse_iso():
+    engine = _engine()
+    return lambda: engine.parse_timestamp("2023-05-01T12:00:00Z")
+
+
+@benchmark("parse.timestamp[fallback]")
+def _parse_fallback():
+    engine = _engine()
+    return lambda: engine.parse_timestamp("May 1 2023 12:00 UTC")
+
+
+@benchmark("auth.verify_token")
+def _verify_token():
+    main = _app()
+    token = main.create_access_token({"sub": "testuser"}, timedelta(minutes=30))
+    return lambda: main.verify_token(token)
+
+
+@benchmark("auth.create_token")
+def _create_token():
+    main = _app()
+    return lambda: main.create_access_token({"sub": "testuser"}, timedelta(minutes=30))
+
+
+@benchmark("http.timezones")
+def _http_timezones():
+    client = _app().app.test_client()
+    return lambda: client.get("/api/timesync/timezones")
+
+
+@benchmark("http.convert_hit")
+def _http_convert_hit():
+    client = _app().app.test_client()
+    url = "/api/timesync/convert?utc_timestamp=2023-05-01T12:00:00Z&target_timezone=Europe/Paris"
+    client.get(url)
+    return lambda: client.get(url)
+
+
+for _size in BATCH_SIZES:
+    @benchmark(f"http.batch[{_size}]")
+    def _http_batch(size=_size):
+        client = _app().app.test_client()
+        body = {"conversions": [
+            {"utc_timestamp": ts, "target_timezone": ZONES[i % len(ZONES)]}
+            for i, ts in enumerate(_timestamps(size))
+        ]}
+        client.post("/api/timesync/convert/batch", json=body)
+        return lambda: client.post("/api/timesync/convert/batch", json=body)
+
+    @benchmark(f"http.batch_binary[{_size}]")
+    def _http_batch_binary(size=_size):
+        from array import array
+        from api.zoneregistry import get_zone_registry
+
+        client = _app().app.test_client()
+        ids = get_zone_registry().ids
+        start = int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp())
+        # Same instants and zones as http.batch, packed as epochs and zone ids
+        body = (array("q", (start + 37 * 60 * i for i in range(size))).tobytes()
+                + array("H", (ids[ZONES[i % len(ZONES)]] for i in range(size))).tobytes())
+        client.post("/api/timesync/convert/batch", data=body, content_type="application/octet-stream")
+        return lambda: client.post("/api/timesync/convert/batch", data=body,
+                                   content_type="application/octet-stream")
+
+
+def run_case(op: Callable[[], object], min_time: float, repeat: int) -> Dict[str, float]:
+    """
+    Time a callable. The loop count is calibrated so each of the `repeat`
+    runs takes roughly min_time / repeat seconds.
+    """
+    loops = 1
+    target = min_time / repeat
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            op()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target / 10 or loops >= 1_000_000:
+            break
+        loops *= 10
+    loops = max(1, int(loops * target / max(elapsed, 1e-9)))
+
+    per_op = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            op()
+        per_op.append((time.perf_counter() - start) / loops)
+
+    median = statistics.median(per_op)
+    return {
+        "loops": loops,
+        "best_us": min(per_op) * 1e6,
+        "median_us": median * 1e6,
+        "stdev_us": (statistics.stdev(per_op) if len(per_op) > 1 else 0.0) * 1e6,
+        "ops_per_sec": 1 / median if median else 0.0,
+    }
+
+
+def measure_cache_memory(count: int) -> Dict[str, float]:
+    """
+    Bytes per cached conversion (key, entry and result), measured with tracemalloc
+    by filling a fresh cache through engine.convert. The same results stored
+    in the previous dict-of-dicts format are measured for comparison.
+    """
+    from api.cache import TimeCache
+    engine = _engine()
+    requests = [(ts, ZONES[i % len(ZONES)]) for i, ts in enumerate(_timestamps(count))]
+    saved_cache = engine.time_cache
+    engine.time_cache = TimeCache(janitor_interval=0)
+    try:
+        # Warm up lazily built tables so only the entries are counted
+        engine.convert(*requests[0])
+        engine.time_cache.clear()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for ts, zone in requests:
+            engine.convert(ts, zone)
+        compact = tracemalloc.get_traced_memory()[0] - before
+
+        results = [engine.time_cache.cache[f"convert:{ts}:{zone}"].value for ts, zone in requests]
+        before = tracemalloc.get_traced_memory()[0]
+        legacy = {}
+        for (ts, zone), result in zip(requests, results):
+            legacy[f"convert:{ts}:{zone}"] = {"value": result.to_dict(), "expires": time.time() + 3600}
+        legacy_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+    finally:
+        engine.time_cache = saved_cache
+
+    return {
+        "entries": count,
+        "bytes_per_entry": compact / count,
+        "legacy_bytes_per_entry": legacy_bytes / count,
+    }
+
+
+def git_revision() -> str:
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"]) != 0
+        return f"{rev}-dirty" if dirty else rev
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline: Dict, current: Dict) -> None:
+    print(f"\n{'case':40} {'baseline us':>12} {'current us':>12} {'change':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or "median_us" not in base or "median_us" not in result:
+            continue
+        change = (result["median_us"] - base["median_us"]) / base["median_us"] * 100
+        print(f"{name:40} {base['median_us']:12.2f} {result['median_us']:12.2f} {change:+7.1f}%")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the conversion and auth hot paths.")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this string")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds spent timing each case")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="baseline result file to compare against")
+    parser.add_argument("--list", action="store_true", help="list cases and exit")
+    parser.add_argument("--memory-entries", type=int, default=100000,
+                        help="cache entries used for the memory.cache_entry measurement (0 skips it)")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _ in _CASES:
+            print(name)
+        return 0
+
+    # Keep request logging out of the measurements
+    logging.disable(logging.CRITICAL)
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+
+    for name, setup in _CASES:
+        if args.filter not in name:
+            continue
+        result = run_case(setup(), args.min_time, args.repeat)
+        report["results"][name] = result
+        print(f"{name:40} {result['median_us']:12.2f} us/op {result['ops_per_sec']:14.0f} ops/s")
+
+    if args.memory_entries and args.filter in "memory.cache_entry":
+        memory = measure_cache_memory(args.memory_entries)
+        report["memory"] = memory
+        print(f"{'memory.cache_entry':40} {memory['bytes_per_entry']:12.0f} B/entry "
+              f"(previous dict format: {memory['legacy_bytes_per_entry']:.0f} B/entry)")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Closed-loop load generator for the Flask (WSGI) and FastAPI (ASGI) apps.
+
+Drives a running server at a fixed concurrency and reports throughput and
+latency percentiles. With --spawn it starts the server itself on a free port.
+
+Usage (from the repository root):
+    python -m benchmarks.loadgen --spawn flask --scenario convert -c 16 -d 20
+    python -m benchmarks.loadgen --spawn asgi --scenario convert -c 16 -d 20
+    python -m benchmarks.loadgen --url http://localhost:5000 --scenario timezones
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from .bench_hotpaths import RESULTS_DIR, ZONES, git_revision
+
+SCENARIOS = ("convert", "timezones", "popular", "batch")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(mode: str, workers: int) -> Tuple[subprocess.Popen, str]:
+    """
+    Start gunicorn (flask) or uvicorn (asgi) on a free local port and wait until it accepts connections.
+    """
+    port = _free_port()
+    if mode == "flask":
+        cmd = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--log-level", "warning", "main:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    env = dict(os.environ, FLASK_ENV="production")
+    # One client IP drives all the load; per-client limits would measure the 429 path
+    env.setdefault("RATE_LIMIT_ENABLED", "0")
+    proc = subprocess.Popen(cmd, env=env)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with status {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+def login(base_url: str, mode: str, username: str, password: str) -> Optional[str]:
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    if mode == "asgi":
+        # The FastAPI token endpoint takes an OAuth2 form
+        body = urlencode({"username": username, "password": password})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    else:
+        body = json.dumps({"username": username, "password": password})
+        headers = {"Content-Type": "application/json"}
+    conn.request("POST", "/api/auth/token", body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    if response.status != 200:
+        return None
+    return json.loads(data)["access_token"]
+
+
+def build_requests(scenario: str, hit_ratio: float, batch_size: int, count: int = 2048
+                   ) -> List[Tuple[str, str, Optional[bytes]]]:
+    """
+    Pre-build (method, path, body) tuples so request construction stays out of the timed loop.
+    """
+    rng = random.Random(7)
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    def timestamp() -> str:
+        if rng.random() < hit_ratio:
+            return "2023-05-01T12:00:00Z"
+        moment = start + timedelta(seconds=rng.randrange(0, 365 * 86400))
+        return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    requests = []
+    for _ in range(count):
+        if scenario == "convert":
+            query = urlencode({"utc_timestamp": timestamp(), "target_timezone": rng.choice(ZONES)})
+            requests.append(("GET", f"/api/timesync/convert?{query}", None))
+        elif scenario == "timezones":
+            requests.append(("GET", "/api/timesync/timezones", None))
+        elif scenario == "popular":
+            requests.append(("GET", "/api/timesync/popular-timezones", None))
+        elif scenario == "batch":
+            body = {"conversions": [
+                {"utc_timestamp": timestamp(), "target_timezone": rng.choice(ZONES)}
+                for _ in range(batch_size)
+            ]}
+            requests.append(("POST", "/api/timesync/convert/batch", json.dumps(body).encode()))
+    return requests
+
+
+def _worker(base_url: str, requests, headers: Dict[str, str], stop_at: float,
+            latencies: List[float], errors: List[int]) -> None:
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    i = random.randrange(len(requests))
+    while time.perf_counter() < stop_at:
+        method, path, body = requests[i]
+        i = (i + 1) % len(requests)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+            status = 0
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    conn.close()
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(base_url: str, requests, headers: Dict[str, str], concurrency: int,
+             duration: float, warmup: float) -> Dict[str, float]:
+    if warmup > 0:
+        _run_threads(base_url, requests, headers, concurrency, warmup)
+    latencies, errors, elapsed = _run_threads(base_url, requests, headers, concurrency, duration)
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "duration_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def _run_threads(base_url, requests, headers, concurrency, duration):
+    # One latency list per thread avoids sharing a list between writers
+    per_thread = [([], []) for _ in range(concurrency)]
+    start = time.perf_counter()
+    stop_at = start + duration
+    threads = [
+        threading.Thread(target=_worker, args=(base_url, requests, headers, stop_at, lat, err), daemon=True)
+        for lat, err in per_thread
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = [value for lat, _ in per_thread for value in lat]
+    errors = [value for _, err in per_thread for value in err]
+    return latencies, errors, elapsed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Drive the TimeSync API at a fixed concurrency.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server")
+    target.add_argument("--spawn", choices=("flask", "asgi"), help="start the server locally")
+    parser.add_argument("--mode", choices=("flask", "asgi"), help="server flavour behind --url (default: flask)")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes with --spawn")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="convert")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before measuring")
+    parser.add_argument("--hit-ratio", type=float, default=0.5, help="share of requests for a repeated key")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--username", default="testuser")
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/load-<commit>-<mode>-<scenario>.json)")
+    args = parser.parse_args(argv)
+
+    mode = args.spawn or args.mode or "flask"
+    proc = None
+    if args.spawn:
+        proc, base_url = spawn_server(args.spawn, args.workers)
+    else:
+        base_url = args.url.rstrip("/")
+
+    try:
+        headers = {"Connection": "keep-alive", "Content-Type": "application/json"}
+        token = login(base_url, mode, args.username, args.password)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        elif mode == "asgi":
+            print("Warning: login failed; authenticated ASGI routes will return 401", file=sys.stderr)
+
+        requests = build_requests(args.scenario, args.hit_ratio, args.batch_size)
+        result = run_load(base_url, requests, headers, args.concurrency, args.duration, args.warmup)
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
+        "scenario": args.scenario,
+        "concurrency": args.concurrency,
+        "hit_ratio": args.hit_ratio,
+        "batch_size": args.batch_size if args.scenario == "batch" else None,
+        "result": result,
+    }
+
+    print(f"{mode} {args.scenario} c={args.concurrency}: "
+          f"{result['throughput_rps']:.0f} req/s, p50 {result['p50_ms']:.2f} ms, "
+          f"p99 {result['p99_ms']:.2f} ms, {result['errors']} errors of {result['requests']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{revision}-{mode}-{args.scenario}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
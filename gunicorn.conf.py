@@ -0,0 +1,70 @@
+"""
+Gunicorn settings driven by api.config.Config.
+
+    gunicorn -c gunicorn.conf.py                          # serves main:app
+    WORKER_CLASS=gthread gunicorn -c gunicorn.conf.py
+    WORKER_CLASS=uvicorn gunicorn -c gunicorn.conf.py     # serves asgi:app
+
+The app module follows WORKER_CLASS, so start commands leave it out; naming
+one that does not fit the worker class stops the server at startup.
+
+The app is preloaded in the master process and warmed up (zone index, tz
+tables, deferred imports, popular-zone cache) before workers are forked, so the
+warm state is shared copy-on-write and no worker starts cold.
+"""
+import gc
+import multiprocessing
+import os
+
+from api.config import Config
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', Config.PORT)}"
+reuse_port = True
+timeout = Config.WORKER_TIMEOUT
+preload_app = Config.PRELOAD_APP
+
+# Size workers from the CPU count, capped by MAX_WORKERS
+workers = max(1, min(Config.MAX_WORKERS, cpu_count * 2 + 1))
+
+if Config.WORKER_CLASS == "uvicorn":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:app"
+elif Config.WORKER_CLASS == "gthread":
+    worker_class = "gthread"
+    threads = Config.WORKER_THREADS or min(8, cpu_count * 2)
+    wsgi_app = "main:app"
+else:
+    worker_class = "sync"
+    wsgi_app = "main:app"
+
+
+def on_starting(server):
+    """
+    Refuse an app passed on the command line that does not fit the worker class:
+    an ASGI worker cannot serve the Flask app, nor a WSGI worker the FastAPI one.
+    """
+    if server.app.app_uri != wsgi_app:
+        raise RuntimeError(f"WORKER_CLASS={Config.WORKER_CLASS} serves {wsgi_app}, not {server.app.app_uri}; "
+                           f"start gunicorn without the app argument")
+
+
+def when_ready(server):
+    """
+    Runs in the master after the app is loaded and before workers are forked.
+    """
+    if not (preload_app and Config.WARMUP_ENABLED):
+        return
+
+    if Config.WORKER_CLASS == "uvicorn":
+        import asgi
+        asgi.warmup()
+    else:
+        import main
+        main.warmup()
+
+    # Keep the warmed objects out of the collector so GC passes in the workers
+    # do not write to (and un-share) their pages
+    gc.freeze()
+    server.log.info("Warmup complete; forking %s %s worker(s)", workers, worker_class)
@@ -1,12 +1,20 @@
 import os
 import logging
-import pytz
-from datetime import datetime, timedelta, timezone
-from dateutil import parser
-import jwt
-from passlib.context import CryptContext
-from flask import Flask, render_template, request, jsonify, send_from_directory, Blueprint
+from functools import lru_cache
+from datetime import datetime, timedelta
+from flask import Flask, Response, g, render_template, request, send_from_directory, Blueprint
 from dotenv import load_dotenv
+from api import assets, binbatch, engine, logpipeline, metrics, ratelimit, timing, userdata
+from api.timing import stage
+from api.apikeys import get_api_key_store
+from api.config import Config
+from api.encoding import dumps, encoded_response, json_response
+from api.zoneindex import get_zone_index
+from api.zoneregistry import get_zone_registry
+from api.planner import plan_overlap
+from api.offsetindex import get_offset_index, zones_at
+from api.zonesearch import DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT, get_search_index, search_zones
+from api.tzsnapshot import active_tz_version, get_tz_tables
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,32 +25,38 @@ if os.environ.get('FLASK_ENV') == 'development':
 else:
     log_level = logging.INFO
 
-logging.basicConfig(
-    level=log_level,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Records are queued and written by a background thread (see api/logpipeline.py)
+logpipeline.configure(log_level)
 logger = logging.getLogger(__name__)
 
-# Create Flask app
-app = Flask(__name__)
+# Create Flask app; /static is served by api.assets with cache headers
+app = Flask(__name__, static_folder=None)
 app.config["SECRET_KEY"] = os.environ.get("JWT_SECRET", "insecure_default_secret_key_for_development")
 
 # Add production error handlers
 @app.errorhandler(404)
 def not_found(error):
     if request.path.startswith('/api/'):
-        return jsonify({"status": "error", "detail": "Resource not found"}), 404
+        return json_response({"status": "error", "detail": "Resource not found"}, 404)
     return render_template('404.html'), 404
 
 @app.errorhandler(500)
 def server_error(error):
     logger.error(f"Server error: {error}")
     if request.path.startswith('/api/'):
-        return jsonify({"status": "error", "detail": "Internal server error"}), 500
+        return json_response({"status": "error", "detail": "Internal server error"}, 500)
     return render_template('500.html'), 500
 
-# Initialize password context for authentication
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password context for authentication, created on first use so that workers
+# do not import passlib at startup
+_pwd_context = None
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 # JWT Secret and configuration
 SECRET_KEY = os.environ.get("JWT_SECRET", "insecure_default_secret_key_for_development")
@@ -55,44 +69,22 @@ fake_users_db = {
         "username": "testuser",
         "full_name": "Test User",
         "email": "user@example.com",
-        "hashed_password": pwd_context.hash("password123"),
+        # Precomputed bcrypt hash of "password123" (hashing at import costs ~0.4s per worker)
+        "hashed_password": "$2b$12$/w21da3UfiDtdkq34lV/3OBDcZaJ4KCC.jJla4Th/6s4LXkE57QlK",
         "disabled": False,
     }
 }
 
-# Create a simple in-memory cache
-class TimeCache:
-    def __init__(self):
-        self.cache = {}
-        logger.debug("Initialized TimeCache")
-        
-    def get(self, key):
-        if key in self.cache:
-            entry = self.cache[key]
-            if entry["expiry"] > datetime.now():
-                return entry["value"]
-            else:
-                del self.cache[key]
-        return None
-        
-    def set(self, key, value, ttl=3600):
-        self.cache[key] = {
-            "value": value,
-            "expiry": datetime.now() + timedelta(seconds=ttl)
-        }
-        
-    def clear(self):
-        self.cache.clear()
-
-# Initialize cache
-time_cache = TimeCache()
+# Conversion results are cached by the engine
+metrics.register_cache("time", engine.time_cache)
+metrics.register_api_keys(get_api_key_store())
 
 # Auth helper functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def get_user(db, username):
     if username in db:
@@ -109,6 +101,7 @@ def authenticate_user(db, username, password):
     return user
 
 def create_access_token(data, expires_delta=None):
+    import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -119,134 +112,178 @@ def create_access_token(data, expires_delta=None):
     return encoded_jwt
 
 def verify_token(token):
+    import jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
         if username is None:
+            metrics.JWT_VERIFY_COUNT.inc("missing_subject")
             return None
+        metrics.JWT_VERIFY_COUNT.inc("valid")
         return payload
     except jwt.PyJWTError:
+        metrics.JWT_VERIFY_COUNT.inc("invalid")
         return None
 
 # Create API blueprints
 timesync_bp = Blueprint('timesync', __name__, url_prefix='/api/timesync')
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
+def conversion_args(data):
+    """
+    Conversion arguments from a request body, query string or batch item.
+    `timestamp` is accepted as an alias of `utc_timestamp`.
+    """
+    return (
+        data.get('timestamp') or data.get('utc_timestamp'),
+        data.get('target_timezone'),
+        data.get('source_timezone') or None,
+        data.get('ambiguous') or "earlier",
+        data.get('nonexistent') or "forward",
+    )
+
 # TimeSync Routes
 @timesync_bp.route('/convert', methods=['POST', 'GET'])
 def convert_time_route():
     try:
         if request.method == 'GET':
-            utc_timestamp = request.args.get('utc_timestamp')
-            target_timezone = request.args.get('target_timezone')
+            args = conversion_args(request.args)
         else:
-            data = request.get_json()
-            utc_timestamp = data.get('utc_timestamp')
-            target_timezone = data.get('target_timezone')
+            args = conversion_args(request.get_json())
         
-        if not utc_timestamp or not target_timezone:
-            return jsonify({"error": "Missing required fields"}), 400
-            
-        # Validate timestamp
         try:
-            parser.parse(utc_timestamp)
-        except Exception:
-            return jsonify({"error": "Invalid timestamp format. Use ISO 8601 format (e.g., '2023-05-01T12:00:00Z')"}), 400
+            result = engine.convert(*args)
+        except engine.ConversionError as e:
+            return json_response({"error": str(e)}, 400)
             
-        # Validate timezone
-        if target_timezone not in pytz.all_timezones:
-            return jsonify({"error": f"Invalid timezone: {target_timezone}"}), 400
+        # Signed-in users get the conversion in their history (written behind, off this request)
+        username = request_username()
+        if username is not None:
+            userdata.recorder.record_conversion(username, result)
             
-        # Generate cache key
-        cache_key = f"convert:{utc_timestamp}:{target_timezone}"
-        
-        # Try to get from cache first
-        cached_result = time_cache.get(cache_key)
-        if cached_result:
-            return jsonify(cached_result)
-            
-        # Parse the UTC timestamp
-        utc_time = parser.parse(utc_timestamp)
-        if utc_time.tzinfo is None:
-            utc_time = utc_time.replace(tzinfo=timezone.utc)
-            
-        # Convert to target timezone
-        target_tz = pytz.timezone(target_timezone)
-        local_time = utc_time.astimezone(target_tz)
-            
-        # Get DST information
-        is_dst = local_time.dst().total_seconds() > 0
-            
-        # Calculate offset
-        offset_seconds = local_time.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
+        with stage("encode"):
+            return json_response(result.to_dict())
+    except Exception as e:
+        logger.error(f"Error converting time: {str(e)}")
+        return json_response({"error": f"Error converting time: {str(e)}"}, 500)
+
+@timesync_bp.route('/convert/batch', methods=['POST'])
+def convert_batch_route():
+    if request.mimetype == binbatch.MIMETYPE:
+        return convert_binary_batch()
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('conversions'), list):
+            return json_response({"error": "Request body must contain a 'conversions' list"}, 400)
             
-        result = {
-            "utc_timestamp": utc_time.isoformat(),
-            "local_timestamp": local_time.isoformat(),
-            "timezone": target_timezone,
-            "offset": offset_str,
-            "is_dst": is_dst
-        }
+        conversions = data['conversions']
+        if len(conversions) > Config.MAX_BATCH_SIZE:
+            return json_response({"error": f"Batch too large: at most {Config.MAX_BATCH_SIZE} conversions per request"}, 400)
             
-        # Store in cache for specified TTL (default 1 hour)
-        cache_ttl = int(os.environ.get("CACHE_TTL", 3600))
-        time_cache.set(cache_key, result, cache_ttl)
+        # Invalid items are reported in place so one bad entry does not fail the batch
+        results = []
+        for item in conversions:
+            if not isinstance(item, dict):
+                results.append({"error": "Each conversion must be an object"})
+                continue
+            try:
+                results.append(engine.convert(*conversion_args(item)).to_dict())
+            except engine.ConversionError as e:
+                results.append({"error": str(e)})
+            except (ValueError, TypeError, OverflowError, OSError) as e:
+                # Values of the wrong type or outside the representable range
+                results.append({"error": f"Invalid conversion: {str(e)}"})
             
-        return jsonify(result)
+        with stage("encode"):
+            return json_response({"results": results})
     except Exception as e:
-        logger.error(f"Error converting time: {str(e)}")
-        return jsonify({"error": f"Error converting time: {str(e)}"}), 500
+        logger.error(f"Error converting batch: {str(e)}")
+        return json_response({"error": f"Error converting batch: {str(e)}"}, 500)
+
+def convert_binary_batch():
+    # Reject oversized bodies before reading them
+    try:
+        if request.content_length is not None:
+            binbatch.item_count(request.content_length)
+        with stage("parse"):
+            body = request.get_data(cache=False)
+        with stage("convert"):
+            packed = binbatch.convert_packed(body)
+    except binbatch.BatchFormatError as e:
+        return json_response({"error": str(e)}, 400)
+    return Response(packed, mimetype=binbatch.MIMETYPE)
+
+@lru_cache(maxsize=1)
+def encoded_zone_registry(registry):
+    # The registry is fixed for the life of the process, so encode it once
+    return dumps(registry.to_dict())
+
+@timesync_bp.route('/zones/registry', methods=['GET'])
+def zone_registry_route():
+    return encoded_response(encoded_zone_registry(get_zone_registry()))
+
+@timesync_bp.route('/overlap', methods=['POST'])
+def overlap_route():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'zones' not in data or 'start_date' not in data:
+        return json_response({"error": "Request body must contain 'zones' and 'start_date'"}, 400)
+        
+    try:
+        with stage("plan"):
+            plan = plan_overlap(data['zones'], data['start_date'], data.get('end_date'),
+                                data.get('working_hours'), data.get('weekdays'), data.get('min_zones'))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+        
+    with stage("encode"):
+        return json_response(plan)
+
+@lru_cache(maxsize=1)
+def encoded_zone_list(index):
+    # The zone list only changes with the index, so encode it once per index
+    return dumps(list(index.zones))
 
 @timesync_bp.route('/timezones', methods=['GET'])
 def get_timezones_route():
-    return jsonify(pytz.all_timezones)
+    if app.debug:
+        return json_response(list(get_zone_index().zones))
+    return encoded_response(encoded_zone_list(get_zone_index()))
+
+@timesync_bp.route('/timezones/search', methods=['GET'])
+def search_timezones_route():
+    query = request.args.get('q', '')
+    if not query.strip():
+        return json_response({"error": "Missing required parameter: q"}, 400)
+        
+    try:
+        limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        return json_response({"error": "limit must be an integer"}, 400)
+        
+    return json_response(search_zones(query, limit))
+
+@timesync_bp.route('/timezones/at', methods=['GET'])
+def zones_at_route():
+    offset = request.args.get('offset')
+    local_time = request.args.get('local_time')
+    if (offset is None) == (local_time is None):
+        return json_response({"error": "Pass exactly one of: offset, local_time"}, 400)
+        
+    try:
+        return json_response(zones_at(offset, local_time))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
 
 @timesync_bp.route('/timezones/<timezone>', methods=['GET'])
 def get_timezone_info_route(timezone):
-    if timezone not in pytz.all_timezones:
-        return jsonify({"error": f"Invalid timezone: {timezone}"}), 400
-        
-    # Try to get from cache first
-    cached_info = time_cache.get(f"timezone_info:{timezone}")
-    if cached_info:
-        return jsonify(cached_info)
+    if timezone not in get_zone_index():
+        return json_response({"error": f"Invalid timezone: {timezone}"}, 400)
         
     try:
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-            
-        # Get country code if available
-        country_code = None
-        for code, timezones in pytz.country_timezones.items():
-            if timezone in timezones:
-                country_code = code
-                break
-            
-        # Calculate offset in hours and minutes
-        offset_seconds = now.utcoffset().total_seconds()
-        offset_hours = int(offset_seconds // 3600)
-        offset_minutes = int((offset_seconds % 3600) // 60)
-        offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-            
-        result = {
-            "name": timezone,
-            "country_code": country_code,
-            "current_time": now.isoformat(),
-            "offset": offset_str,
-            "is_dst": now.dst().total_seconds() > 0
-        }
-            
-        # Store in cache for timezone info
-        timezone_info_ttl = int(os.environ.get("TIMEZONE_INFO_CACHE_TTL", 300))
-        time_cache.set(f"timezone_info:{timezone}", result, timezone_info_ttl)
-            
-        return jsonify(result)
+        return json_response(engine.zone_info(timezone))
     except Exception as e:
         logger.error(f"Error getting timezone info: {str(e)}")
-        return jsonify({"error": f"Error processing timezone info: {str(e)}"}), 500
+        return json_response({"error": f"Error processing timezone info: {str(e)}"}, 500)
 
 @timesync_bp.route('/popular', methods=['GET'])
 @timesync_bp.route('/popular-timezones', methods=['GET'])
@@ -261,44 +298,11 @@ def get_popular_timezones_route():
     results = []
     for zone in popular_zones:
         try:
-            # Try to get from cache first
-            cached_info = time_cache.get(f"timezone_info:{zone}")
-            if cached_info:
-                results.append(cached_info)
-                continue
-                
-            tz = pytz.timezone(zone)
-            now = datetime.now(tz)
-                
-            # Get country code if available
-            country_code = None
-            for code, timezones in pytz.country_timezones.items():
-                if zone in timezones:
-                    country_code = code
-                    break
-                
-            # Calculate offset in hours and minutes
-            offset_seconds = now.utcoffset().total_seconds()
-            offset_hours = int(offset_seconds // 3600)
-            offset_minutes = int((offset_seconds % 3600) // 60)
-            offset_str = f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
-                
-            result = {
-                "name": zone,
-                "country_code": country_code,
-                "current_time": now.isoformat(),
-                "offset": offset_str,
-                "is_dst": now.dst().total_seconds() > 0
-            }
-                
-            # Store in cache for timezone info
-            timezone_info_ttl = int(os.environ.get("TIMEZONE_INFO_CACHE_TTL", 300))
-            time_cache.set(f"timezone_info:{zone}", result, timezone_info_ttl)
-            results.append(result)
+            results.append(engine.zone_info(zone))
         except Exception as e:
             logger.error(f"Error getting info for {zone}: {str(e)}")
         
-    return jsonify(results)
+    return json_response(results)
 
 # Auth Routes
 @auth_bp.route('/token', methods=['POST'])
@@ -306,34 +310,36 @@ def login_route():
     try:
         data = request.get_json()
         if not data:
-            return jsonify({"error": "Invalid request data"}), 400
+            return json_response({"error": "Invalid request data"}, 400)
             
         username = data.get('username')
         password = data.get('password')
         
         if not username or not password:
-            return jsonify({"error": "Missing username or password"}), 400
+            return json_response({"error": "Missing username or password"}, 400)
             
-        user = authenticate_user(fake_users_db, username, password)
+        with stage("verify_password"):
+            user = authenticate_user(fake_users_db, username, password)
         if not user:
-            return jsonify({"error": "Incorrect username or password"}), 401
+            return json_response({"error": "Incorrect username or password"}, 401)
             
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user["username"]}, expires_delta=access_token_expires
-        )
+        with stage("sign_token"):
+            access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+            access_token = create_access_token(
+                data={"sub": user["username"]}, expires_delta=access_token_expires
+            )
         
-        return jsonify({"access_token": access_token, "token_type": "bearer"})
+        return json_response({"access_token": access_token, "token_type": "bearer"})
     except Exception as e:
         logger.error(f"Error during login: {str(e)}")
-        return jsonify({"error": "Login failed"}), 500
+        return json_response({"error": "Login failed"}, 500)
 
 @auth_bp.route('/register', methods=['POST'])
 def register_route():
     try:
         data = request.get_json()
         if not data:
-            return jsonify({"error": "Invalid request data"}), 400
+            return json_response({"error": "Invalid request data"}, 400)
             
         username = data.get('username')
         email = data.get('email')
@@ -341,10 +347,10 @@ def register_route():
         full_name = data.get('full_name')
         
         if not username or not email or not password:
-            return jsonify({"error": "Missing required fields"}), 400
+            return json_response({"error": "Missing required fields"}, 400)
             
         if username in fake_users_db:
-            return jsonify({"error": "Username already registered"}), 400
+            return json_response({"error": "Username already registered"}, 400)
             
         # Create a new user with hashed password
         hashed_password = get_password_hash(password)
@@ -358,7 +364,7 @@ def register_route():
             "disabled": False,
         }
         
-        return jsonify({
+        return json_response({
             "username": username,
             "email": email,
             "full_name": full_name,
@@ -366,30 +372,94 @@ def register_route():
         })
     except Exception as e:
         logger.error(f"Error during registration: {str(e)}")
-        return jsonify({"error": "Registration failed"}), 500
-
-@auth_bp.route('/users/me', methods=['GET'])
-def current_user_route():
-    try:
+        return json_response({"error": "Registration failed"}, 500)
+
+def authenticate_request():
+    """
+    Authenticate the current request with an X-API-Key header or a bearer token.
+    Returns (user, None) or (None, error_response).
+
+    The outcome is kept for the rest of the request, so the rate limiter, the
+    route and request_username() verify the credential once between them.
+    """
+    outcome = g.get("_auth")
+    if outcome is None:
+        outcome = g._auth = _authenticate_request()
+    return outcome
+
+def _authenticate_request():
+    api_key = request.headers.get(Config.API_KEY_HEADER)
+    if api_key:
+        with stage("verify_api_key"):
+            record = get_api_key_store().authenticate(api_key)
+        if record is None:
+            metrics.API_KEY_VERIFY_COUNT.inc("invalid")
+            return None, json_response({"error": "Invalid API key"}, 401)
+        metrics.API_KEY_VERIFY_COUNT.inc("valid")
+        g._credential_id = f"key:{record.key_id}"
+        username = record.owner
+    else:
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"error": "Missing or invalid authorization header"}), 401
+            return None, json_response({"error": "Missing or invalid authorization header"}, 401)
             
         token = auth_header.split(' ')[1]
         
-        payload = verify_token(token)
+        with stage("verify_token"):
+            payload = verify_token(token)
         if not payload:
-            return jsonify({"error": "Invalid token"}), 401
-            
+            return None, json_response({"error": "Invalid token"}, 401)
         username = payload.get("sub")
+        g._credential_id = f"user:{username}"
+        
+    with stage("lookup_user"):
         user = get_user(fake_users_db, username)
-        if not user:
-            return jsonify({"error": "User not found"}), 401
-            
-        if user["disabled"]:
-            return jsonify({"error": "Inactive user"}), 400
+    if not user:
+        return None, json_response({"error": "User not found"}, 401)
+        
+    if user["disabled"]:
+        return None, json_response({"error": "Inactive user"}, 400)
+    return user, None
+
+def authenticate_password_request():
+    """
+    authenticate_request() for routes that manage API keys, which only accept a
+    bearer token: a leaked key must not be able to mint its own replacement.
+    """
+    if request.headers.get(Config.API_KEY_HEADER):
+        return None, json_response(
+            {"error": "API keys are managed with a bearer token from /token, not an API key"}, 403)
+    return authenticate_request()
+
+def request_username():
+    """
+    Username for the credentials sent with the request, or None when there are
+    none or they are invalid; for routes that also serve anonymous clients.
+    """
+    if not request.headers.get(Config.API_KEY_HEADER) and not request.headers.get('Authorization'):
+        return None
+    user, _ = authenticate_request()
+    return user["username"] if user else None
+
+def credential_id():
+    """
+    Rate limit key for the request's credential once it checks out: the API key
+    id or the user a bearer token was issued to. None for missing or invalid
+    credentials, which only count against the client's IP.
+    """
+    if not request.headers.get(Config.API_KEY_HEADER) and not request.headers.get('Authorization'):
+        return None
+    authenticate_request()
+    return g.get("_credential_id")
+
+@auth_bp.route('/users/me', methods=['GET'])
+def current_user_route():
+    try:
+        user, error = authenticate_request()
+        if error:
+            return error
             
-        return jsonify({
+        return json_response({
             "username": user["username"],
             "email": user["email"],
             "full_name": user["full_name"],
@@ -397,16 +467,109 @@ def current_user_route():
         })
     except Exception as e:
         logger.error(f"Error getting user: {str(e)}")
-        return jsonify({"error": "Authentication failed"}), 500
+        return json_response({"error": "Authentication failed"}, 500)
+
+@auth_bp.route('/users/me/dashboard', methods=['GET'])
+def user_dashboard_route():
+    user, error = authenticate_request()
+    if error:
+        return error
+        
+    # Favorite zone details and recent conversions in one response
+    return json_response(userdata.dashboard(user["username"]))
+
+@auth_bp.route('/users/me/favorites', methods=['POST'])
+def add_favorite_route():
+    user, error = authenticate_request()
+    if error:
+        return error
+        
+    data = request.get_json(silent=True) or {}
+    zone = data.get('timezone')
+    if not isinstance(zone, str) or zone not in get_zone_index():
+        return json_response({"error": f"Invalid timezone: {zone}"}, 400)
+        
+    favorites = userdata.add_favorite(user["username"], zone)
+    if favorites is None:
+        return json_response({"error": f"At most {Config.USER_MAX_FAVORITES} favorite timezones"}, 400)
+    return json_response({"favorite_timezones": favorites})
+
+@auth_bp.route('/users/me/favorites/<path:zone>', methods=['DELETE'])
+def remove_favorite_route(zone):
+    user, error = authenticate_request()
+    if error:
+        return error
+        
+    return json_response({"favorite_timezones": userdata.remove_favorite(user["username"], zone)})
+
+@auth_bp.route('/api-keys', methods=['POST'])
+def issue_api_key_route():
+    user, error = authenticate_password_request()
+    if error:
+        return error
+        
+    data = request.get_json(silent=True) or {}
+    name = data.get('name')
+    if not name or not isinstance(name, str):
+        return json_response({"error": "Missing required field: name"}, 400)
+        
+    key, record = get_api_key_store().issue(user["username"], name)
+    logger.info(f"Issued API key {record.key_id} for {user['username']}")
+    # The key is only ever shown in this response
+    return json_response(dict(record.to_dict(), api_key=key), 201)
+
+@auth_bp.route('/api-keys', methods=['GET'])
+def list_api_keys_route():
+    user, error = authenticate_request()
+    if error:
+        return error
+        
+    return json_response([record.to_dict() for record in get_api_key_store().list(user["username"])])
+
+@auth_bp.route('/api-keys/<key_id>', methods=['DELETE'])
+def revoke_api_key_route(key_id):
+    user, error = authenticate_password_request()
+    if error:
+        return error
+        
+    store = get_api_key_store()
+    record = store.get(key_id)
+    if record is None or record.owner != user["username"]:
+        return json_response({"error": "API key not found"}, 404)
+        
+    # Written to API_KEYS_PATH, so every worker stops accepting the key
+    record = store.revoke(key_id) or store.get(key_id)
+    logger.info(f"Revoked API key {key_id} for {user['username']}")
+    return json_response(record.to_dict())
+
+# Per-client rate limits and load shedding, checked before request bodies are read
+ratelimit.init_blueprints(timesync_bp, auth_bp, identify=credential_id)
 
 # Register blueprints
 app.register_blueprint(timesync_bp)
 app.register_blueprint(auth_bp)
 
-# Serve static files
-@app.route('/static/<path:path>')
-def serve_static(path):
-    return send_from_directory('static', path)
+# Request ids for log records, echoed in X-Request-ID
+logpipeline.init_app(app)
+
+# Request metrics and the /metrics endpoint
+metrics.init_app(app)
+
+# Per-stage Server-Timing headers and the sampling profiler
+timing.init_app(app)
+
+# Report the tz database version responses were computed with; it changes when
+# workers hot-reload a rebuilt tz snapshot
+@app.after_request
+def add_tz_version(response):
+    version = active_tz_version()
+    if version is not None:
+        response.headers['X-TZ-Version'] = version
+    return response
+
+# Serve static files: fingerprinted names (see asset_url in the templates) are
+# cached by browsers for good
+assets.init_app(app)
 
 # Serve robots.txt from static directory
 @app.route('/robots.txt')
@@ -416,17 +579,17 @@ def serve_robots():
 # Home route
 @app.route('/')
 def home():
-    return render_template('index.html', request=request)
+    return assets.render_page('index.html')
 
 # Dashboard route
 @app.route('/dashboard')
 def dashboard():
-    return render_template('dashboard.html', request=request)
+    return assets.render_page('dashboard.html')
 
 # API documentation route
 @app.route('/api-docs')
 def api_docs():
-    return render_template('api.html', request=request)
+    return assets.render_page('api.html')
 
 # Protected route example
 @app.route('/protected')
@@ -436,9 +599,32 @@ def protected_route():
         token = auth_header.split(' ')[1]
         payload = verify_token(token)
         if payload:
-            return jsonify({"status": "success", "data": payload})
-        return jsonify({"status": "error", "detail": "Invalid token"}), 401
-    return jsonify({"status": "error", "detail": "Invalid authorization header"}), 401
+            return json_response({"status": "success", "data": payload})
+        return json_response({"status": "error", "detail": "Invalid token"}, 401)
+    return json_response({"status": "error", "detail": "Invalid authorization header"}, 401)
+
+# Pre-fork warmup (see gunicorn.conf.py)
+def warmup():
+    """
+    Build the zone, search and offset indexes, zone registry and tz tables, load deferred imports,
+    pre-warm the popular timezone cache and pre-render the pages so forked workers share them
+    and start warm.
+    """
+    get_zone_index()
+    get_search_index()
+    get_tz_tables()
+    get_offset_index()
+    get_zone_registry().slices(get_tz_tables())
+    get_pwd_context()
+    verify_token(create_access_token({"sub": "warmup"}))
+    engine.parse_timestamp("May 1 2023 12:00 UTC")
+    with app.test_request_context():
+        get_popular_timezones_route()
+    # Pre-render the pages and hash the static files once, before forking
+    for path, page in (('/', home), ('/dashboard', dashboard), ('/api-docs', api_docs)):
+        with app.test_request_context(path):
+            page()
+    logger.info("Warmup complete")
 
 if __name__ == "__main__":
     debug_mode = os.environ.get("FLASK_DEBUG", "1") == "1"
@@ -0,0 +1,97 @@
+"""
+Cold-start audit for gunicorn workers.
+
+Imports main.py in fresh interpreters under `python -X importtime`, serves one
+conversion request, and reports the slowest imports alongside the time to the
+first response. Exits non-zero when the median exceeds the startup budget
+(STARTUP_BUDGET_MS, see api/config.py), so it can gate deploys.
+
+Usage (from the repository root):
+    python -m scripts.startup_audit
+    python -m scripts.startup_audit --runs 5 --top 15 --budget-ms 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter; prints timings as JSON on the last stdout line
+CHILD_CODE = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+client = main.app.test_client()
+client.get('/api/timesync/convert?utc_timestamp=2023-05-01T12:00:00Z&target_timezone=America/New_York')
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_request_ms": (served - imported) * 1000}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    Parse `-X importtime` output into (module, self_us, cumulative_us) tuples.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        # Nested imports keep their indentation so top-level ones can be told apart
+        modules.append((parts[2][1:].rstrip(), int(parts[0]), int(parts[1])))
+    return modules
+
+
+def audit_once() -> Tuple[Dict[str, float], List[Tuple[str, int, int]]]:
+    env = dict(os.environ, FLASK_ENV="production")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_CODE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(proc.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(proc.stderr)
+
+
+def main(argv=None) -> int:
+    sys.path.insert(0, ROOT)
+    from api.config import Config
+
+    parser = argparse.ArgumentParser(description="Audit worker cold-start time.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=Config.STARTUP_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    runs = [audit_once() for _ in range(args.runs)]
+    totals = [t["import_ms"] + t["first_request_ms"] for t, _ in runs]
+    import_ms = statistics.median(t["import_ms"] for t, _ in runs)
+    first_ms = statistics.median(t["first_request_ms"] for t, _ in runs)
+    median_total = statistics.median(totals)
+
+    # Slowest imports of the median run, by self time and by cumulative time
+    _, modules = runs[totals.index(sorted(totals)[len(totals) // 2])]
+    print("Slowest imports by self time:")
+    for name, self_us, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name.strip()}")
+    print("Slowest direct imports by cumulative time:")
+    shallow = [m for m in modules if len(m[0]) - len(m[0].lstrip()) <= 2]
+    for name, _, cumulative_us in sorted(shallow, key=lambda m: m[2], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name.strip()}")
+
+    print(f"\nimport main: {import_ms:.1f} ms, first request: {first_ms:.1f} ms, "
+          f"total: {median_total:.1f} ms (median of {args.runs}), budget: {args.budget_ms:.0f} ms")
+    if median_total > args.budget_ms:
+        print("Startup budget exceeded")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
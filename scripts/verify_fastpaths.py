@@ -0,0 +1,465 @@
+"""
+Differential check of the conversion fast paths against pytz.
+
+Every optimized path is run over the same generated inputs and compared with
+the reference implementation: dateutil parsing and pytz astimezone(), as
+convert_time_route did before the fast paths existed. The paths checked are
+engine.convert on a cold and a warm cache, with epoch input and with
+source-zone wall times, the binary batch codec, NumPy bulk conversion (when
+NumPy is installed), the offset index, the /convert route and the JSON batch
+route, where malformed and out-of-range items are mixed in and must fail in
+place without failing the batch.
+
+Inputs cover every zone:
+
+- random instants from 1800 to 2200 (LMT offsets, far-future dates past the
+  last generated transition) written in several ISO 8601 styles
+- the instants around sampled transitions of each zone: DST changes and
+  historical offset changes
+- local times at the edges and in the middle of DST gaps and overlaps, with
+  each ambiguous/nonexistent policy
+- the 2038 boundary
+
+Prints every mismatch (up to --report per path) and the throughput of each
+path. Exits non-zero on any mismatch, so it can gate changes to the hot path.
+
+Usage (from the repository root):
+    python -m scripts.verify_fastpaths
+    python -m scripts.verify_fastpaths --seed 7 --samples 50 --transitions 0
+    python -m scripts.verify_fastpaths --zones Europe/Dublin Australia/Lord_Howe
+"""
+import argparse
+import logging
+import os
+import random
+import struct
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The route check sends every request from one address
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+EPOCH = datetime(1970, 1, 1)
+
+# Checked instants and local times stay within these years
+START = (datetime(1800, 1, 1) - EPOCH) // timedelta(seconds=1)
+END = (datetime(2200, 1, 1) - EPOCH) // timedelta(seconds=1)
+
+# Instants checked in every zone besides the random and transition ones
+FIXED_INSTANTS = (START, 0, 2 ** 31 - 1, 2 ** 31, END - 1)
+
+# Batch items that must come back as in-place errors
+BAD_BATCH_ITEMS = (
+    {"timestamp": 1e20, "target_timezone": "UTC"},
+    {"timestamp": "9999-12-31T23:59:59-01:00", "target_timezone": "UTC"},
+    {"timestamp": "0001-01-01T00:00:00", "target_timezone": "America/New_York"},
+    {"timestamp": "2024-01-01T00:00:00Z", "target_timezone": ["x"]},
+    {"timestamp": "2024-01-01T00:00:00Z", "target_timezone": "UTC", "source_timezone": {"x": 1}},
+    {"timestamp": "not a timestamp", "target_timezone": "UTC"},
+    "not an object",
+)
+
+# Offsets the input timestamps are written with ("" is a naive UTC timestamp)
+INPUT_OFFSETS = ("Z", "", "+00:00", "+05:30", "-08:00", "+13:45")
+
+POLICIES = (("earlier", "forward"), ("later", "backward"), ("raise", "raise"))
+
+
+def _utc(epoch: int) -> datetime:
+    import pytz
+    return pytz.utc.localize(EPOCH + timedelta(seconds=epoch))
+
+
+def _offset_string(offset_seconds: float) -> str:
+    offset_hours = int(offset_seconds // 3600)
+    offset_minutes = int((offset_seconds % 3600) // 60)
+    return f"{offset_hours:+03d}:{abs(offset_minutes):02d}"
+
+
+@lru_cache(maxsize=None)
+def _zone(name: str):
+    import pytz
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=None)
+def _entries(name: str) -> Tuple[Tuple[int, int], ...]:
+    """
+    (utc instant, offset) of each of pytz's entries for a zone, starting with
+    its "since the beginning" one; a single entry for fixed-offset zones.
+    """
+    zone = _zone(name)
+    if not hasattr(zone, "_utc_transition_times"):
+        return ((START, int(zone.utcoffset(None).total_seconds())),)
+    return tuple(((t - EPOCH) // timedelta(seconds=1), int(info[0].total_seconds()))
+                 for t, info in zip(zone._utc_transition_times, zone._transition_info))
+
+
+@lru_cache(maxsize=None)
+def _changes(name: str) -> Tuple[Tuple[int, int, int], ...]:
+    """
+    (instant, offset before, offset after) of every transition of a zone.
+    """
+    entries = _entries(name)
+    return tuple((instant, before, after) for (_, before), (instant, after) in zip(entries, entries[1:]))
+
+
+@lru_cache(maxsize=None)
+def _zone_offsets(name: str) -> Tuple[int, ...]:
+    return tuple(sorted({offset for _, offset in _entries(name)}))
+
+
+def reference_lookup(zone: str, epoch: int) -> Tuple[int, bool]:
+    """
+    (UTC offset seconds, DST in effect) at an instant, from pytz.
+    """
+    local = _utc(epoch).astimezone(_zone(zone))
+    return int(local.utcoffset().total_seconds()), local.dst().total_seconds() > 0
+
+
+def _reference_result(utc_time: datetime, target_timezone: str) -> Dict:
+    local_time = utc_time.astimezone(_zone(target_timezone))
+    return {
+        "utc_timestamp": utc_time.isoformat(),
+        "local_timestamp": local_time.isoformat(),
+        "timezone": target_timezone,
+        "offset": _offset_string(local_time.utcoffset().total_seconds()),
+        "is_dst": local_time.dst().total_seconds() > 0
+    }
+
+
+def reference_convert(utc_timestamp: str, target_timezone: str) -> Dict:
+    """
+    convert_time_route before the fast paths: dateutil parsing and pytz astimezone().
+    """
+    from dateutil import parser
+
+    utc_time = parser.parse(utc_timestamp)
+    if utc_time.tzinfo is None:
+        utc_time = utc_time.replace(tzinfo=timezone.utc)
+    return _reference_result(utc_time, target_timezone)
+
+
+def reference_resolve(zone: str, wall: int, ambiguous: str, nonexistent: str) -> Optional[int]:
+    """
+    The instant at which the clocks in `zone` show `wall` (local epoch seconds),
+    under the policies documented in the README; None when the policy raises.
+    Candidates are found by converting back with pytz, not from the snapshot.
+    """
+    candidates = sorted(wall - offset for offset in _zone_offsets(zone)
+                        if reference_lookup(zone, wall - offset)[0] == offset)
+    if len(candidates) == 1:
+        return candidates[0]
+    if candidates:
+        if ambiguous == "raise":
+            return None
+        return candidates[-1] if ambiguous == "later" else candidates[0]
+    if nonexistent == "raise":
+        return None
+    for instant, before, after in _changes(zone):
+        if instant + before <= wall < instant + after:
+            return wall - (after if nonexistent == "backward" else before)
+    raise AssertionError(f"No instant or gap for local time {wall} in {zone}")
+
+
+def reference_convert_local(case: Tuple) -> Optional[Dict]:
+    source, wall, target, ambiguous, nonexistent, _ = case
+    epoch = reference_resolve(source, wall, ambiguous, nonexistent)
+    if epoch is None:
+        return None
+    utc_time = _utc(epoch)
+    source_time = utc_time.astimezone(_zone(source))
+    result = _reference_result(utc_time, target)
+    result.update({
+        "source_timestamp": source_time.isoformat(),
+        "source_timezone": source,
+        "source_offset": _offset_string(source_time.utcoffset().total_seconds()),
+    })
+    return result
+
+
+def _timestamp_text(epoch: int, rng: random.Random) -> str:
+    suffix = rng.choice(INPUT_OFFSETS)
+    if suffix in ("", "Z"):
+        local = EPOCH + timedelta(seconds=epoch)
+    else:
+        sign = 1 if suffix[0] == "+" else -1
+        local = EPOCH + timedelta(seconds=epoch + sign * (int(suffix[1:3]) * 3600 + int(suffix[4:6]) * 60))
+    if rng.random() < 0.3:
+        local = local.replace(microsecond=rng.randrange(1, 1000000))
+    separator = rng.choice("T ")
+    return local.isoformat(separator) + suffix
+
+
+def _sampled_transitions(zone: str, rng: random.Random, limit: int) -> List[Tuple[int, int, int]]:
+    """
+    (instant, offset before, offset after) of up to `limit` transitions of the
+    zone in the checked years, always including the first and last (0: all).
+    """
+    changes = [change for change in _changes(zone) if START <= change[0] < END]
+    if limit and len(changes) > limit:
+        middle = rng.sample(changes[1:-1], max(0, limit - 2))
+        changes = [changes[0]] + sorted(middle) + [changes[-1]]
+    return changes
+
+
+def generate_cases(zones: List[str], rng: random.Random, samples: int, transitions: int):
+    """
+    Returns (instant cases, wall time cases): (zone, epoch, timestamp text) and
+    (source zone, local epoch, target zone, ambiguous, nonexistent, timestamp text).
+    """
+    instants = []
+    walls = []
+
+    def add_wall(zone: str, wall: int, policies) -> None:
+        text = (EPOCH + timedelta(seconds=wall)).isoformat()
+        target = rng.choice(zones)
+        for ambiguous, nonexistent in policies:
+            walls.append((zone, wall, target, ambiguous, nonexistent, text))
+
+    for zone in zones:
+        epochs = [rng.randrange(START, END) for _ in range(samples)]
+        epochs.extend(FIXED_INSTANTS)
+        for instant, before, after in _sampled_transitions(zone, rng, transitions):
+            epochs.extend((instant - 1, instant, instant + 1))
+            # Both edges and the middle of the gap (after > before) or overlap
+            low, high = sorted((instant + before, instant + after))
+            for wall in {low - 1, low, (low + high) // 2, high - 1, high}:
+                add_wall(zone, wall, POLICIES)
+        instants.extend((zone, epoch, _timestamp_text(epoch, rng)) for epoch in epochs)
+        for _ in range(max(1, samples // 4)):
+            add_wall(zone, rng.randrange(START, END), (rng.choice(POLICIES),))
+    return instants, walls
+
+
+class Report:
+    """
+    Mismatches and throughput of every path checked.
+    """
+
+    def __init__(self, max_report: int):
+        self.max_report = max_report
+        self.rows: List[Tuple[str, int, Optional[int], float, Optional[str]]] = []
+        self.mismatches = 0
+
+    def reference(self, name: str, cases: List, compute: Callable) -> List:
+        start = time.perf_counter()
+        expected = [compute(case) for case in cases]
+        self.rows.append((name, len(cases), None, time.perf_counter() - start, None))
+        return expected
+
+    def check(self, name: str, cases: List, expected: List, run: Callable[[List], List],
+              baseline: str) -> None:
+        start = time.perf_counter()
+        actual = run(cases)
+        elapsed = time.perf_counter() - start
+        failed = [(case, want, got) for case, want, got in zip(cases, expected, actual) if want != got]
+        if len(actual) != len(expected):
+            print(f"MISMATCH {name}: {len(actual)} results for {len(expected)} inputs")
+            failed.append((None, len(expected), len(actual)))
+        for case, want, got in failed[:self.max_report]:
+            print(f"MISMATCH {name} {case}\n  expected {want}\n  actual   {got}")
+        self.mismatches += len(failed)
+        self.rows.append((name, len(cases), len(failed), elapsed, baseline))
+
+    def print(self) -> None:
+        rates = {name: items / seconds for name, items, _, seconds, _ in self.rows if seconds}
+        print(f"\n{'path':<34} {'items':>8} {'mismatches':>10} {'items/s':>12} {'vs pytz':>8}")
+        for name, items, failed, seconds, baseline in self.rows:
+            rate = items / seconds if seconds else float("inf")
+            speedup = f"{rate / rates[baseline]:.1f}x" if baseline in rates else ""
+            print(f"{name:<34} {items:>8} {'-' if failed is None else failed:>10} {rate:>12,.0f} {speedup:>8}")
+
+
+def _convert_dicts(engine, cases: List, args: Callable[[Tuple], Tuple]) -> List:
+    results = []
+    for case in cases:
+        try:
+            results.append(engine.convert(*args(case)).to_dict())
+        except engine.ConversionError:
+            results.append(None)
+    return results
+
+
+def _unpack_batch(packed: bytes, count: int) -> List[Tuple[int, bool]]:
+    from api import binbatch
+
+    offsets = struct.unpack(f"<{count}i", packed[:4 * count])
+    return [(offset, bool(flags & binbatch.FLAG_DST)) for offset, flags in zip(offsets, packed[4 * count:])]
+
+
+def check_binbatch(report: Report, instants: List, expected: List) -> None:
+    from api import binbatch
+    from api.zoneregistry import get_zone_registry
+
+    registry = get_zone_registry()
+    cases = [case for case in instants if registry.zone_id(case[0]) is not None]
+    expected = [want for case, want in zip(instants, expected) if registry.zone_id(case[0]) is not None]
+
+    def pack(cases: List) -> bytes:
+        return (struct.pack(f"<{len(cases)}q", *(epoch for _, epoch, _ in cases))
+                + struct.pack(f"<{len(cases)}H", *(registry.zone_id(zone) for zone, _, _ in cases)))
+
+    report.check("binbatch (python)", cases, expected,
+                 lambda cases: _unpack_batch(binbatch._convert_python(pack(cases), len(cases)), len(cases)),
+                 "pytz lookup")
+    if binbatch.numpy is None:
+        return
+
+    def run_numpy(cases: List) -> List:
+        # Take the vectorized path even though each zone has only a few items here
+        min_group_size, binbatch._MIN_GROUP_SIZE = binbatch._MIN_GROUP_SIZE, 0
+        try:
+            return _unpack_batch(binbatch._convert_numpy(pack(cases), len(cases)), len(cases))
+        finally:
+            binbatch._MIN_GROUP_SIZE = min_group_size
+
+    report.check("binbatch (numpy)", cases, expected, run_numpy, "pytz lookup")
+
+
+def check_convert_many(report: Report, instants: List, expected: List) -> None:
+    from api import engine
+
+    np = sys.modules.get("numpy")
+    if np is None:
+        return
+
+    def run(cases: List) -> List:
+        by_zone = defaultdict(list)
+        for position, (zone, epoch, _) in enumerate(cases):
+            by_zone[zone].append((position, epoch))
+        results = [None] * len(cases)
+        for zone, items in by_zone.items():
+            _, offsets, is_dst = engine.convert_many(np.array([epoch for _, epoch in items], dtype=np.int64), zone)
+            for (position, _), offset, dst in zip(items, offsets.tolist(), is_dst.tolist()):
+                results[position] = (offset, dst)
+        return results
+
+    report.check("engine.convert_many (numpy)", instants, expected, run, "pytz lookup")
+
+
+def check_offset_index(report: Report, zones: List[str], rng: random.Random, steps: int) -> None:
+    from api.offsetindex import OffsetIndex
+    from api.tzsnapshot import get_tz_tables
+
+    # One index advanced through the years, as a long-running worker's is
+    moments = sorted(rng.randrange(START, END) for _ in range(steps))
+    cases = [(moment, zone) for moment in moments for zone in zones]
+    expected = report.reference("pytz lookup (offset index)", cases,
+                                lambda case: reference_lookup(case[1], case[0]))
+
+    def run(cases: List) -> List:
+        index = OffsetIndex(get_tz_tables(), zones, now=START)
+        results = []
+        for moment, zone in cases:
+            if moment != index.now:
+                index.advance(moment)
+            results.append(index.current.get(zone))
+        return results
+
+    report.check("offset index (advance)", cases, expected, run, "pytz lookup (offset index)")
+
+
+def check_route(report: Report, cases: List, expected: List) -> None:
+    import main
+
+    client = main.app.test_client()
+
+    def run(cases: List) -> List:
+        return [client.get("/api/timesync/convert",
+                           query_string={"utc_timestamp": text, "target_timezone": zone}).get_json()
+                for zone, _, text in cases]
+
+    report.check("GET /api/timesync/convert", cases, expected, run, "pytz astimezone")
+
+
+def check_batch_route(report: Report, cases: List, expected: List) -> None:
+    import main
+
+    client = main.app.test_client()
+    # Every good item is followed by a bad one; None stands for an in-place error
+    items = []
+    want = []
+    for i, ((zone, _, text), result) in enumerate(zip(cases, expected)):
+        items.append({"utc_timestamp": text, "target_timezone": zone})
+        items.append(BAD_BATCH_ITEMS[i % len(BAD_BATCH_ITEMS)])
+        want.extend((result, None))
+
+    def run(items: List) -> List:
+        response = client.post("/api/timesync/convert/batch", json={"conversions": items})
+        if response.status_code != 200:
+            return [response.status_code]
+        return [None if "error" in result else result for result in response.get_json()["results"]]
+
+    report.check("POST /api/timesync/convert/batch", items, want, run, "pytz astimezone")
+
+
+def main(argv=None) -> int:
+    sys.path.insert(0, ROOT)
+
+    parser = argparse.ArgumentParser(description="Compare the conversion fast paths with pytz.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=20, help="random instants per zone")
+    parser.add_argument("--transitions", type=int, default=12,
+                        help="transitions checked per zone (0: all of them)")
+    parser.add_argument("--index-steps", type=int, default=200, help="instants the offset index is advanced to")
+    parser.add_argument("--route-samples", type=int, default=500, help="conversions sent through the route")
+    parser.add_argument("--zones", nargs="*", help="zones to check (default: all)")
+    parser.add_argument("--report", type=int, default=10, help="mismatches printed per path")
+    args = parser.parse_args(argv)
+
+    # Keep request logging out of the output and the timings
+    logging.disable(logging.CRITICAL)
+
+    from api import engine
+    from api.config import Config
+    from api.zoneindex import get_zone_index
+
+    zones = args.zones or list(get_zone_index().zones)
+    rng = random.Random(args.seed)
+    instants, walls = generate_cases(zones, rng, args.samples, args.transitions)
+    print(f"{len(zones)} zones, {len(instants)} instants, {len(walls)} local times (seed {args.seed})")
+
+    report = Report(args.report)
+    expected = report.reference("pytz astimezone", instants, lambda case: reference_convert(case[2], case[0]))
+    expected_epoch = report.reference("pytz astimezone (epoch)", instants,
+                                      lambda case: _reference_result(_utc(case[1]), case[0]))
+    expected_lookup = report.reference("pytz lookup", instants, lambda case: reference_lookup(case[0], case[1]))
+    expected_local = report.reference("pytz localize (wall times)", walls, reference_convert_local)
+
+    engine.time_cache.clear()
+    report.check("engine.convert (cold cache)", instants, expected,
+                 lambda cases: _convert_dicts(engine, cases, lambda case: (case[2], case[0])), "pytz astimezone")
+    report.check("engine.convert (cached)", instants, expected,
+                 lambda cases: _convert_dicts(engine, cases, lambda case: (case[2], case[0])), "pytz astimezone")
+    report.check("engine.convert (epoch)", instants, expected_epoch,
+                 lambda cases: _convert_dicts(engine, cases, lambda case: (case[1], case[0])),
+                 "pytz astimezone (epoch)")
+    report.check("engine.convert (source zone)", walls, expected_local,
+                 lambda cases: _convert_dicts(engine, cases, lambda case: (case[5], case[2], case[0], case[3], case[4])),
+                 "pytz localize (wall times)")
+    check_binbatch(report, instants, expected_lookup)
+    check_convert_many(report, instants, expected_lookup)
+    check_offset_index(report, zones, rng, args.index_steps)
+
+    sampled = sorted(rng.sample(range(len(instants)), min(args.route_samples, len(instants))))
+    check_route(report, [instants[i] for i in sampled], [expected[i] for i in sampled])
+    check_batch_route(report, [instants[i] for i in sampled[:Config.MAX_BATCH_SIZE // 2]],
+                      [expected[i] for i in sampled[:Config.MAX_BATCH_SIZE // 2]])
+
+    report.print()
+    if report.mismatches:
+        print(f"\n{report.mismatches} mismatches")
+        return 1
+    print("\nAll fast paths match pytz")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
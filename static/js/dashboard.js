@@ -6,17 +6,23 @@
 // Configuration object
 const config = {
     apiBase: "/api/timesync",
+    authBase: "/api/auth",
+    tokenKey: "timesync_token", // localStorage key of a token from POST /api/auth/token
     updateInterval: 10000, // 10 seconds
+    searchDelay: 150, // ms to wait after typing before searching
+    searchLimit: 8,
     defaultTimezone: Intl.DateTimeFormat().resolvedOptions().timeZone || "UTC"
 };
 
 // State management
 let state = {
-    token: null,
+    token: localStorage.getItem(config.tokenKey),
     selectedTimezone: config.defaultTimezone,
     popularTimezones: [],
     conversionHistory: [],
-    worldClock: {}
+    worldClock: {},
+    searchTimer: null,
+    searchSeq: 0
 };
 
 // DOM elements
@@ -51,11 +57,12 @@ async function initDashboard() {
     // Set current UTC time as default in the input
     setCurrentUTCTime();
     
-    // Load available timezones
-    await loadTimezones();
-    
-    // Load popular timezones
-    await loadPopularTimezones();
+    // Load the signed-in user's dashboard, or the popular timezones; they also
+    // seed the timezone dropdown
+    if (!state.token || !(await loadUserDashboard())) {
+        await loadPopularTimezones();
+    }
+    populateTimezoneSelect(state.popularTimezones.map(timezone => timezone.name));
     
     // Setup event listeners
     setupEventListeners();
@@ -78,23 +85,40 @@ function setCurrentUTCTime() {
 }
 
 /**
- * Load available timezones from the API
+ * Request headers carrying the token, when there is one
  */
-async function loadTimezones() {
+function authHeaders() {
+    return state.token ? { Authorization: `Bearer ${state.token}` } : {};
+}
+
+/**
+ * Load the user's favorite timezones and recent conversions in one request.
+ * Returns false when the token is missing or no longer valid.
+ */
+async function loadUserDashboard() {
     try {
-        const response = await fetch(`${config.apiBase}/timezones`);
+        const response = await fetch(`${config.authBase}/users/me/dashboard`, { headers: authHeaders() });
         if (!response.ok) {
-            throw new Error(`Failed to load timezones: ${response.statusText}`);
+            throw new Error(`Failed to load dashboard: ${response.statusText}`);
         }
         
-        const timezones = await response.json();
-        populateTimezoneSelect(timezones);
-        
-        console.log(`Loaded ${timezones.length} timezones`);
+        const data = await response.json();
+        state.popularTimezones = data.timezones;
+        state.conversionHistory = data.recent_conversions.slice(0, 5).map(item => ({
+            utc_timestamp: item.original_timestamp,
+            local_timestamp: item.converted_timestamp,
+            timezone: item.target_timezone,
+            offset: item.offset,
+            is_dst: item.is_dst
+        }));
     } catch (error) {
-        console.error("Error loading timezones:", error);
-        showError("Failed to load timezone data. Please try refreshing the page.");
+        console.error("Error loading user dashboard:", error);
+        return false;
     }
+    
+    renderPopularTimezones();
+    renderConversionHistory();
+    return true;
 }
 
 /**
@@ -149,7 +173,8 @@ async function loadPopularTimezones() {
 }
 
 /**
- * Populate the timezone select dropdown
+ * Populate the timezone select dropdown with the local and popular timezones;
+ * other zones are added as they are picked from search results
  */
 function populateTimezoneSelect(timezones) {
     if (!elements.timezoneSelect) return;
@@ -164,17 +189,27 @@ function populateTimezoneSelect(timezones) {
     localOption.selected = true;
     elements.timezoneSelect.appendChild(localOption);
     
-    // Add all timezones
+    // Add the given timezones
     timezones.forEach(timezone => {
         if (timezone !== config.defaultTimezone) {
-            const option = document.createElement('option');
-            option.value = timezone;
-            option.textContent = timezone;
-            elements.timezoneSelect.appendChild(option);
+            addTimezoneOption(timezone);
         }
     });
 }
 
+/**
+ * Add a timezone to the dropdown unless it is already there
+ */
+function addTimezoneOption(timezone) {
+    const exists = Array.from(elements.timezoneSelect.options).some(option => option.value === timezone);
+    if (!exists) {
+        const option = document.createElement('option');
+        option.value = timezone;
+        option.textContent = timezone;
+        elements.timezoneSelect.appendChild(option);
+    }
+}
+
 /**
  * Render popular timezones as a world clock
  */
@@ -335,7 +370,9 @@ async function convertTime(e) {
         `;
         
         // Make API request
-        const response = await fetch(`${config.apiBase}/convert?utc_timestamp=${encodeURIComponent(utcTimestamp)}&target_timezone=${encodeURIComponent(targetTimezone)}`);
+        // Signed-in conversions are also kept in the user's history on the server
+        const response = await fetch(`${config.apiBase}/convert?utc_timestamp=${encodeURIComponent(utcTimestamp)}&target_timezone=${encodeURIComponent(targetTimezone)}`,
+                                     { headers: authHeaders() });
         
         if (!response.ok) {
             let errorMessage = "Error converting time";
@@ -515,34 +552,51 @@ function setupEventListeners() {
 }
 
 /**
- * Handle timezone search input
+ * Handle timezone search input; waits for a pause in typing before searching
  */
 function handleTimezoneSearch(e) {
-    const searchTerm = e.target.value.trim().toLowerCase();
+    const searchTerm = e.target.value.trim();
     
     if (!elements.searchResults || !elements.timezoneSelect) return;
     
+    clearTimeout(state.searchTimer);
+    
     // Clear results if search term is empty
     if (searchTerm.length === 0) {
+        state.searchSeq++;
         elements.searchResults.innerHTML = '';
         return;
     }
     
-    // Get all timezone options
-    const options = Array.from(elements.timezoneSelect.options);
+    state.searchTimer = setTimeout(() => searchTimezones(searchTerm), config.searchDelay);
+}
+
+/**
+ * Query the search endpoint and display the matching timezones
+ */
+async function searchTimezones(searchTerm) {
+    // Ignore responses to searches that were superseded while in flight
+    const seq = ++state.searchSeq;
     
-    // Filter options based on search term
-    const filteredOptions = options.filter(option => 
-        option.textContent.toLowerCase().includes(searchTerm)
-    );
+    let results;
+    try {
+        const params = new URLSearchParams({ q: searchTerm, limit: config.searchLimit });
+        const response = await fetch(`${config.apiBase}/timezones/search?${params}`);
+        if (!response.ok) {
+            throw new Error(`Failed to search timezones: ${response.statusText}`);
+        }
+        results = await response.json();
+    } catch (error) {
+        console.error("Error searching timezones:", error);
+        return;
+    }
     
-    // Show up to 5 results
-    const limitedResults = filteredOptions.slice(0, 5);
+    if (seq !== state.searchSeq) return;
     
     // Display results
     elements.searchResults.innerHTML = '';
     
-    if (limitedResults.length === 0) {
+    if (results.length === 0) {
         elements.searchResults.innerHTML = `
             <div class="list-group-item">No matching timezones found</div>
         `;
@@ -550,12 +604,14 @@ function handleTimezoneSearch(e) {
         const resultsList = document.createElement('div');
         resultsList.className = 'list-group';
         
-        limitedResults.forEach(option => {
+        results.forEach(result => {
             const item = document.createElement('button');
+            item.type = 'button';
             item.className = 'list-group-item list-group-item-action';
-            item.textContent = option.textContent;
+            item.textContent = result.country ? `${result.name} (${result.country})` : result.name;
             item.addEventListener('click', () => {
-                elements.timezoneSelect.value = option.value;
+                addTimezoneOption(result.name);
+                elements.timezoneSelect.value = result.name;
                 elements.searchResults.innerHTML = '';
                 elements.timezoneSearchInput.value = '';
             });